@@ -0,0 +1,111 @@
+# archive.py
+import argparse
+import asyncio
+import logging
+import sqlite3
+import time
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ("id, title, description, event_time, created_by, chat_type, chat_id, "
+           "notified_7d, notified_1, notified_15m, file_type, file_id, recurrence")
+
+
+# === Архив прошедших событий ===
+# Разовые события (и завершившиеся серии — у них recurrence уже NULL), прошедшие
+# больше after_days дней назад, переносятся из events в events_archive. Каждая
+# пачка — отдельная короткая транзакция в потоке БД, между пачками очередь БД
+# успевает выполнить запросы обработчиков, так что блокировка записи не держится
+# долго, а events остаётся размером «будущее плюс горизонт». После переноса
+# освободившиеся страницы возвращаются файлу порциями incremental_vacuum — если
+# файл в режиме auto_vacuum = INCREMENTAL. Новые базы создаются в нём сразу;
+# старую переводят отдельной командой (полный VACUUM держит блокировку, поэтому
+# только при остановленном боте):
+#   python archive.py --enable-incremental-vacuum
+# До этого освобождённые страницы просто переиспользуются новыми записями.
+class EventArchiver:
+    def __init__(self, db, after_days: int = 30, batch_size: int = 500,
+                 interval: float = 3600, vacuum_pages: int = 256):
+        self.db = db
+        self.after = after_days * 86400
+        self.batch_size = batch_size
+        self.interval = interval
+        self.vacuum_pages = vacuum_pages
+        self.archived = 0
+
+    def _archive_batch(self, conn: sqlite3.Connection, cutoff: int, now: int) -> int:
+        ids = [row[0] for row in conn.execute("""
+            SELECT id FROM events WHERE recurrence IS NULL AND event_time < ?
+            ORDER BY event_time LIMIT ?
+        """, (cutoff, self.batch_size))]
+        if not ids:
+            return 0
+        placeholders = ",".join("?" * len(ids))
+        conn.execute(f"""
+            INSERT OR REPLACE INTO events_archive ({COLUMNS}, archived_at)
+            SELECT {COLUMNS}, ? FROM events WHERE id IN ({placeholders})
+        """, (now, *ids))
+        conn.execute(f"DELETE FROM events WHERE id IN ({placeholders})", ids)
+        return len(ids)
+
+    def _vacuum_step(self, conn: sqlite3.Connection) -> int:
+        # Без выборки строк PRAGMA освобождает только одну страницу за вызов
+        conn.execute(f"PRAGMA incremental_vacuum({self.vacuum_pages})").fetchall()
+        return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+    async def archive(self) -> int:
+        now = int(time.time())
+        cutoff = now - self.after
+        moved = 0
+        while True:
+            count = await self.db.run(self._archive_batch, cutoff, now)
+            moved += count
+            self.archived += count
+            if count < self.batch_size:
+                break
+            await asyncio.sleep(0)
+
+        if moved and await self.db.fetchval("PRAGMA auto_vacuum") == 2:
+            free, previous = await self.db.run(self._vacuum_step), None
+            while free and free != previous:
+                await asyncio.sleep(0)
+                free, previous = await self.db.run(self._vacuum_step), free
+        if moved:
+            logger.info(f"Перенесено в архив событий: {moved}")
+        return moved
+
+    async def run(self):
+        while True:
+            try:
+                await self.archive()
+            except Exception as e:
+                logger.error(f"Ошибка архивации событий: {e}")
+            await asyncio.sleep(self.interval)
+
+
+def enable_incremental_vacuum(path: str):
+    conn = sqlite3.connect(path, isolation_level=None)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            logger.info("auto_vacuum = INCREMENTAL уже включён")
+            return
+        logger.info(f"VACUUM {path}: может занять несколько минут")
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        logger.info("auto_vacuum = INCREMENTAL включён")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    from config import Config
+
+    parser = argparse.ArgumentParser(description="Обслуживание базы событий")
+    parser.add_argument("--enable-incremental-vacuum", action="store_true",
+                        help="перевести файл в auto_vacuum = INCREMENTAL (полный VACUUM, бот должен быть остановлен)")
+    args = parser.parse_args()
+    logging.basicConfig(level=Config.LOG_LEVEL)
+    if args.enable_incremental_vacuum:
+        enable_incremental_vacuum(Config.DATABASE_PATH)
+    else:
+        parser.print_help()
@@ -0,0 +1,293 @@
+# benchmarks/bench_dispatcher.py
+# Прогон сценариев через dp.feed_update без сети: Bot с заглушкой сессии,
+# базы во временном каталоге. Сценарий виртуального пользователя: /start,
+# создание группы и вступление в неё, полный диалог «➕ Создать событие»,
+# «📋 Мои события», смена часового пояса. Можно подать и записанные обновления
+# (--updates: JSON-массив или по объекту на строку).
+#
+# Итог — пропускная способность, p50/p95/p99 по обработчикам и число запросов
+# к БД на обновление; --output пишет их в JSON, --compare сравнивает с прошлым
+# прогоном.
+#
+#   python benchmarks/bench_dispatcher.py --users 200 --output before.json
+#   python benchmarks/bench_dispatcher.py --users 200 --compare before.json
+import argparse
+import asyncio
+import contextvars
+import itertools
+import json
+import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.dispatcher.middlewares.user_context import UserContextMiddleware  # noqa: E402
+from aiogram.methods import SendMessage  # noqa: E402
+from aiogram.types import Chat, Message, Update  # noqa: E402
+
+# Обновление, в рамках которого идёт запрос к БД (наследуется задачами и db.run)
+current_update = contextvars.ContextVar("current_update", default=None)
+
+
+class StubSession(BaseSession):
+    # Отвечает на методы Bot API сразу; отправленные тексты нужны сценарию
+    # (например, код группы из ответа на её создание)
+    def __init__(self):
+        super().__init__()
+        self.message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        if isinstance(method, SendMessage):
+            return Message(message_id=next(self.message_ids), date=datetime.now(),
+                           chat=Chat(id=method.chat_id, type="private"), text=method.text)
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b""
+
+    async def close(self):
+        pass
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))
+    return sorted_values[index]
+
+
+def load_updates(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+
+class Bench:
+    def __init__(self, main_module):
+        self.main = main_module
+        self.update_ids = itertools.count(1)
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.queries: dict[str, int] = defaultdict(int)
+        self.total_queries = 0
+        self._db_tag = None
+        self.updates = 0
+        self.last_reply: dict[int, str] = {}
+
+        # Имя обработчика узнаём из внутренней мидлвари: она видит выбранный HandlerObject
+        async def record_handler(handler, event, data):
+            data["bench"]["handler"] = data["handler"].callback.__name__
+            return await handler(event, data)
+
+        self.main.dp.message.middleware(record_handler)
+
+    def count_query(self, statement: str):
+        # Вызывается в потоке БД; при параллельных пользователях запрос
+        # засчитывается тому обновлению, от имени которого выполняется db.run
+        self.total_queries += 1
+        if self._db_tag is not None:
+            self._db_tag["queries"] += 1
+
+    def instrument(self, db):
+        run, write = db.run, db.write
+
+        async def tagged_run(func, *args):
+            tag = current_update.get()
+
+            def _tagged(conn, *a):
+                self._db_tag = tag
+                try:
+                    return func(conn, *a)
+                finally:
+                    self._db_tag = None
+
+            return await run(_tagged, *args)
+
+        def counted_write(sql, params=()):
+            # Сами отложенные записи выполняет общая пачка — считаем их по вызовам
+            tag = current_update.get()
+            if tag is not None:
+                tag["queries"] += 1
+            return write(sql, params)
+
+        db.run, db.write = tagged_run, counted_write
+        db._connect().set_trace_callback(self.count_query)
+
+    def make_update(self, user_id: int, text: str) -> Update:
+        update_id = next(self.update_ids)
+        return Update(update_id=update_id, message={
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}", "username": f"u{user_id}"},
+            "text": text,
+        })
+
+    async def feed(self, update: Update):
+        bench = {"handler": "unhandled", "queries": 0}
+        token = current_update.set(bench)
+        start = time.perf_counter()
+        try:
+            # feed_update только ставит обновление в очередь чата — ждём, пока она опустеет
+            await self.main.dp.feed_update(self.main.bot, update, bench=bench)
+            chat = UserContextMiddleware.resolve_event_context(update).chat
+            if chat is not None:
+                await self.main.chat_queues.wait(chat.id)
+        finally:
+            current_update.reset(token)
+        elapsed = time.perf_counter() - start
+        self.latencies[bench["handler"]].append(elapsed)
+        self.queries[bench["handler"]] += bench["queries"]
+        self.updates += 1
+
+    async def say(self, user_id: int, text: str) -> str:
+        # Возвращает ответ пользователю на это сообщение (нужен код группы)
+        self.last_reply.pop(user_id, None)
+        await self.feed(self.make_update(user_id, text))
+        return self.last_reply.get(user_id, "")
+
+    async def scenario(self, user_id: int, partner_id: int):
+        await self.say(user_id, "/start")
+        await self.say(user_id, "👥 Группы")
+        await self.say(user_id, "➕ Создать группу")
+        reply = await self.say(user_id, f"Группа {user_id}")
+        code = re.search(r"`(\d+)`", reply)
+        if code:
+            await self.say(partner_id, "🚪 Вступить по коду")
+            await self.say(partner_id, code.group(1))
+
+        for text in ("➕ Создать событие", f"Событие {user_id}", "/skip", "2030", "Май (5)", "10", "14:30",
+                     "Без повтора", "👤 Только я"):
+            await self.say(user_id, text)
+        await self.say(user_id, "📋 Мои события")
+        await self.say(user_id, "🌍 Сменить часовой пояс")
+        await self.say(user_id, "UTC+5 — Екатеринбург")
+        await self.say(user_id, "📋 Мои события")
+
+    def report(self, elapsed: float) -> dict:
+        handlers = {}
+        for name, values in sorted(self.latencies.items()):
+            values.sort()
+            handlers[name] = {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 3),
+                "p95_ms": round(percentile(values, 95) * 1000, 3),
+                "p99_ms": round(percentile(values, 99) * 1000, 3),
+                "db_queries_per_update": round(self.queries[name] / len(values), 2),
+            }
+        return {
+            "commit": git_commit(),
+            "updates": self.updates,
+            "elapsed_s": round(elapsed, 3),
+            "updates_per_s": round(self.updates / elapsed, 1),
+            "db_queries_per_update": round(self.total_queries / max(self.updates, 1), 2),
+            "handlers": handlers,
+        }
+
+
+def print_report(result: dict, baseline: dict = None):
+    def delta(new, old):
+        return f" ({(new - old) / old * 100:+.0f}%)" if old else ""
+
+    old_handlers = baseline["handlers"] if baseline else {}
+    print(f"коммит {result['commit']}: {result['updates']} обновлений за {result['elapsed_s']} с, "
+          f"{result['updates_per_s']}/с{delta(result['updates_per_s'], baseline and baseline['updates_per_s'])}, "
+          f"запросов к БД на обновление: {result['db_queries_per_update']}")
+    print(f"{'обработчик':32} {'n':>6} {'p50 мс':>8} {'p95 мс':>8} {'p99 мс':>8} {'БД/обн':>7}")
+    for name, h in result["handlers"].items():
+        old = old_handlers.get(name, {})
+        print(f"{name:32} {h['count']:6} {h['p50_ms']:8.2f} {h['p95_ms']:8.2f} {h['p99_ms']:8.2f} "
+              f"{h['db_queries_per_update']:7.2f}{delta(h['p95_ms'], old.get('p95_ms'))}")
+
+
+async def run(args) -> dict:
+    import main
+
+    # Строка лога на каждое обновление исказила бы замер
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    main.bot.session = StubSession()
+    session = main.bot.session
+    bench = Bench(main)
+
+    # Запоминаем последний текст, отправленный каждому чату
+    make_request = session.make_request
+
+    async def recording_request(bot, method, timeout=None):
+        result = await make_request(bot, method, timeout)
+        if isinstance(method, SendMessage):
+            bench.last_reply[method.chat_id] = method.text
+        return result
+
+    session.make_request = recording_request
+
+    await main.init_db()
+    bench.instrument(main.db)
+    main.sender.start()
+
+    start = time.perf_counter()
+    if args.updates:
+        for raw in load_updates(args.updates):
+            await bench.feed(Update.model_validate(raw))
+    else:
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def user(i: int):
+            async with semaphore:
+                await bench.scenario(1_000_000 + i, 2_000_000 + i)
+
+        await asyncio.gather(*(user(i) for i in range(args.users)))
+    await main.db.flush()
+    elapsed = time.perf_counter() - start
+
+    await main.sender.close()
+    await main.dp.fsm.storage.close()
+    await main.db.close()
+    return bench.report(elapsed)
+
+
+def main_cli():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20, help="пользователей одновременно")
+    parser.add_argument("--updates", help="записанные обновления вместо сценария")
+    parser.add_argument("--output", help="куда записать результат (JSON)")
+    parser.add_argument("--compare", help="результат прошлого прогона для сравнения")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    compare = os.path.abspath(args.compare) if args.compare else None
+    if args.updates:
+        args.updates = os.path.abspath(args.updates)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # Пути баз в Config относительные — создаём их во временном каталоге
+        os.chdir(tmp)
+        result = asyncio.run(run(args))
+
+    baseline = None
+    if compare:
+        with open(compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,95 @@
+# benchmarks/bench_reschedule.py
+# Смена часового пояса у пользователя с большим числом будущих событий:
+# прежний построчный пересчёт против пакетного _reschedule из main.py.
+# С временем в секундах UTC (user-014) разбор строк из построчной схемы ушёл,
+# и разница — около x1.2: почти всё время занимает обновление индексов в UPDATE.
+# Групповые события автора при смене пояса не сдвигаются.
+#
+#   python benchmarks/bench_reschedule.py --events 10000
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from main import _reschedule  # noqa: E402
+from migrations import apply_migrations  # noqa: E402
+
+USER_ID = 42
+
+
+def fill(path: str, events: int):
+    random.seed(1)
+    conn = sqlite3.connect(path)
+    apply_migrations(conn)
+    start = datetime.now(timezone.utc).replace(second=0, microsecond=0) + timedelta(hours=1)
+    rows = [
+        (f"Событие {i}", int((start + timedelta(minutes=random.randrange(0, 2 * 365 * 24 * 60))).timestamp()),
+         USER_ID, "private", USER_ID)
+        for i in range(events)
+    ]
+    rows += [(f"Групповое {i}", rows[i][1], USER_ID, "group", 1) for i in range(events // 10)]
+    conn.executemany("INSERT INTO events (title, event_time, created_by, chat_type, chat_id) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def reschedule_rowwise(conn: sqlite3.Connection, user_id: int, old_tz: str, new_tz: str):
+    # Прежняя построчная схема (со сдвигом по времени на часах, как в _reschedule):
+    # datetime на каждую строку, новые ZoneInfo и отдельный UPDATE
+    old_zone = ZoneInfo(old_tz)
+    new_zone = ZoneInfo(new_tz)
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, event_time FROM events WHERE created_by = ? AND event_time > ? AND chat_type = 'private'",
+                   (user_id, int(time.time())))
+    for event_id, event_ts in cursor.fetchall():
+        utc_dt = datetime.fromtimestamp(event_ts, ZoneInfo("UTC"))
+        new_local = utc_dt.astimezone(old_zone).replace(tzinfo=new_zone)
+        cursor.execute("UPDATE events SET event_time = ? WHERE id = ?", (int(new_local.timestamp()), event_id))
+
+
+def timed(template: str, path: str, func, repeat: int) -> float:
+    # Лучшее из нескольких прогонов, каждый — на свежей копии базы
+    best = float("inf")
+    for _ in range(repeat):
+        shutil.copy(template, path)
+        conn = sqlite3.connect(path)
+        start = time.perf_counter()
+        func(conn, USER_ID, "Europe/Moscow", "America/New_York")
+        conn.commit()
+        best = min(best, time.perf_counter() - start)
+        conn.close()
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        template = os.path.join(tmp, "template.db")
+        rowwise_path = os.path.join(tmp, "rowwise.db")
+        batched_path = os.path.join(tmp, "batched.db")
+        fill(template, args.events)
+
+        rowwise = timed(template, rowwise_path, reschedule_rowwise, args.repeat)
+        batched = timed(template, batched_path, _reschedule, args.repeat)
+
+        query = "SELECT id, event_time FROM events ORDER BY id"
+        same = sqlite3.connect(rowwise_path).execute(query).fetchall() == sqlite3.connect(batched_path).execute(query).fetchall()
+
+    print(f"построчно: {rowwise * 1000:8.1f} мс")
+    print(f"пакетно:   {batched * 1000:8.1f} мс  (x{rowwise / batched:.1f}, результаты совпадают: {same})")
+
+
+if __name__ == "__main__":
+    main()
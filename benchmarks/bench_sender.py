@@ -0,0 +1,87 @@
+# benchmarks/bench_sender.py
+# Рассылка по большой группе через фейковый Bot API (benchmarks/fake_bot_api.py).
+# Сравнивает последовательные bot.send_message без учёта лимитов с очередью Sender.
+#
+#   python benchmarks/bench_sender.py --members 1000
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+
+from config import Config  # noqa: E402
+from fake_bot_api import FakeBotAPI, serve  # noqa: E402
+from sender import Sender  # noqa: E402
+
+PORT = 18081
+TOKEN = "42:fake"
+
+
+def make_bot() -> Bot:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(f"http://127.0.0.1:{PORT}"))
+    return Bot(token=TOKEN, session=session)
+
+
+async def run_baseline(chat_ids: list[int]) -> tuple[float, int]:
+    bot = make_bot()
+    failed = 0
+    start = time.perf_counter()
+    for chat_id in chat_ids:
+        try:
+            await bot.send_message(chat_id, "⏰ Напоминание")
+        except Exception:
+            failed += 1
+    elapsed = time.perf_counter() - start
+    await bot.session.close()
+    return elapsed, failed
+
+
+async def run_sender(chat_ids: list[int], rate: float) -> tuple[float, Sender]:
+    bot = make_bot()
+    sender = Sender(bot, rate=rate, chat_rate=Config.SEND_CHAT_RATE, chat_burst=Config.SEND_CHAT_BURST,
+                    concurrency=Config.SEND_CONCURRENCY, max_retries=Config.SEND_MAX_RETRIES)
+    sender.start()
+    start = time.perf_counter()
+    futures = sender.send_many(chat_ids, "⏰ Напоминание")
+    await asyncio.gather(*futures, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    await sender.close()
+    await bot.session.close()
+    return elapsed, sender
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--members", type=int, default=1000)
+    parser.add_argument("--blocked", type=int, default=10, help="сколько участников заблокировали бота")
+    parser.add_argument("--rate", type=float, default=Config.SEND_RATE, help="лимит фейкового API и Sender")
+    parser.add_argument("--latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    chat_ids = list(range(1, args.members + 1))
+    blocked = chat_ids[::max(1, args.members // max(args.blocked, 1))][:args.blocked]
+
+    for name in ("baseline", "sender"):
+        api = FakeBotAPI(rate=args.rate, latency=args.latency, blocked=blocked)
+        runner = await serve(api, "127.0.0.1", PORT)
+        try:
+            if name == "baseline":
+                elapsed, failed = await run_baseline(chat_ids)
+                extra = f"ошибок: {failed}"
+            else:
+                elapsed, sender = await run_sender(chat_ids, args.rate)
+                extra = f"повторов: {sender.retried}, в dead letter: {sender.dead}"
+        finally:
+            await runner.cleanup()
+        print(f"{name:8}: {elapsed:7.2f} с, доставлено {api.delivered}/{args.members} "
+              f"({api.delivered / elapsed:.1f}/с), 429 от API: {api.rejected}, {extra}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+# benchmarks/bench_storage.py
+# Синтетическая нагрузка на запись: register_user на каждое сообщение.
+# Сравнивает прежнюю схему (соединение и коммит на каждую запись, журнал отката)
+# с Database: WAL + отложенная пакетная запись.
+#
+#   python benchmarks/bench_storage.py --messages 5000 --rate 1000
+import argparse
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from database import Database  # noqa: E402
+from migrations import apply_migrations  # noqa: E402
+
+REGISTER_SQL = """
+    INSERT OR REPLACE INTO users (user_id, username, first_name, timezone)
+    VALUES (?, ?, ?, COALESCE((SELECT timezone FROM users WHERE user_id = ?), 'Europe/Moscow'))
+"""
+
+
+def make_db(path: str):
+    conn = sqlite3.connect(path)
+    apply_migrations(conn)
+    conn.close()
+
+
+async def run_baseline(path: str, messages: int, rate: int) -> float:
+    start = time.perf_counter()
+    for i in range(messages):
+        conn = sqlite3.connect(path)
+        conn.execute(REGISTER_SQL, (i % 1000, f"u{i}", f"U{i}", i % 1000))
+        conn.commit()
+        conn.close()
+        await _pace(start, i, rate)
+    return time.perf_counter() - start
+
+
+async def run_write_behind(path: str, messages: int, rate: int) -> tuple[float, int]:
+    db = Database(path)
+    commits = 0
+    flush = db.flush
+
+    async def counting_flush():
+        nonlocal commits
+        if db._pending:
+            commits += 1
+        await flush()
+
+    db.flush = counting_flush
+    start = time.perf_counter()
+    futures = []
+    for i in range(messages):
+        futures.append(db.write(REGISTER_SQL, (i % 1000, f"u{i}", f"U{i}", i % 1000)))
+        await _pace(start, i, rate)
+    await asyncio.gather(*futures)
+    elapsed = time.perf_counter() - start
+    await db.close()
+    return elapsed, commits
+
+
+async def _pace(start: float, i: int, rate: int):
+    # Держим заданный темп входящих сообщений; 0 — без ограничения
+    if rate:
+        delay = start + (i + 1) / rate - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    elif i % 100 == 0:
+        await asyncio.sleep(0)
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--rate", type=int, default=0, help="сообщений в секунду, 0 — максимум")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        baseline_path = os.path.join(tmp, "baseline.db")
+        make_db(baseline_path)
+        baseline = await run_baseline(baseline_path, args.messages, args.rate)
+
+        wb_path = os.path.join(tmp, "write_behind.db")
+        make_db(wb_path)
+        elapsed, commits = await run_write_behind(wb_path, args.messages, args.rate)
+
+    print(f"baseline:     {args.messages / baseline:10.0f} записей/с, коммитов: {args.messages}")
+    print(f"write-behind: {args.messages / elapsed:10.0f} записей/с, коммитов: {commits} "
+          f"(~{args.messages / max(commits, 1):.0f} записей на коммит)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,95 @@
+# benchmarks/bench_webhook.py
+# Отправляет обновления Telegram POST-запросами на локальный вебхук и меряет
+# задержку ответа. Бот должен быть запущен с BOT_MODE = "webhook" и пустым
+# WEBHOOK_URL — тогда он не регистрируется в Telegram и работает без сети.
+#
+#   python benchmarks/bench_webhook.py --updates recorded.json --concurrency 40
+#   python benchmarks/bench_webhook.py --synthetic 5000
+#
+# recorded.json — массив обновлений или по одному JSON-объекту на строку
+# (например, сохранённые ответы getUpdates).
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from aiohttp import ClientSession
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from config import Config  # noqa: E402
+
+
+def load_updates(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        text = f.read().strip()
+    if text.startswith("["):
+        return json.loads(text)
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+
+def synthetic_updates(count: int, users: int) -> list[dict]:
+    texts = ("/start", "📋 Мои события", "⚙️ Профиль", "❓ Помощь")
+    now = int(time.time())
+    updates = []
+    for i in range(count):
+        user_id = 100000 + i % users
+        updates.append({
+            "update_id": i + 1,
+            "message": {
+                "message_id": i + 1,
+                "date": now,
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": f"U{user_id}"},
+                "text": texts[i % len(texts)],
+            },
+        })
+    return updates
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))
+    return sorted_values[index]
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", help="файл с сохранёнными обновлениями")
+    parser.add_argument("--synthetic", type=int, default=1000, help="сколько обновлений сгенерировать")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=Config.WEBHOOK_MAX_CONNECTIONS)
+    parser.add_argument("--url", default=f"http://127.0.0.1:{Config.WEBHOOK_PORT}{Config.WEBHOOK_PATH}")
+    parser.add_argument("--secret", default=Config.WEBHOOK_SECRET)
+    args = parser.parse_args()
+
+    updates = load_updates(args.updates) if args.updates else synthetic_updates(args.synthetic, args.users)
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    latencies = []
+    statuses: dict[int, int] = {}
+    pending = iter(updates)
+
+    async def client(session: ClientSession):
+        # Как Telegram: не больше concurrency запросов одновременно
+        for update in pending:
+            start = time.perf_counter()
+            async with session.post(args.url, json=update, headers=headers) as response:
+                await response.read()
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status] = statuses.get(response.status, 0) + 1
+
+    async with ClientSession() as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(client(session) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    print(f"обновлений: {len(updates)}, {len(updates) / elapsed:.0f}/с, ответы: {statuses}")
+    print("задержка, мс: " + ", ".join(
+        f"p{p} {percentile(latencies, p) * 1000:.2f}" for p in (50, 95, 99)
+    ))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
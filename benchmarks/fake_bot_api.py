@@ -0,0 +1,122 @@
+# benchmarks/fake_bot_api.py
+# Локальный сервер, отвечающий как Bot API: sendMessage с лимитами Telegram
+# (общий и на чат), 429 с retry_after при превышении, 403 для «заблокировавших»
+# бота. Для проверки отправки без сети:
+#
+#   python benchmarks/fake_bot_api.py --port 8081
+#   # в config.py: TELEGRAM_API_URL = "http://127.0.0.1:8081"
+import argparse
+import asyncio
+import math
+import time
+
+from aiohttp import web
+
+
+class Limit:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self) -> float:
+        # 0 — разрешено, иначе через сколько секунд появится токен
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class FakeBotAPI:
+    def __init__(self, rate: float = 30, chat_rate: float = 1, latency: float = 0.02, blocked=()):
+        self.rate = rate
+        self.chat_rate = chat_rate
+        self.latency = latency
+        self.blocked = set(blocked)
+        self._global = Limit(rate, rate)
+        self._chats: dict[int, Limit] = {}
+        self.delivered = 0
+        self.rejected = 0
+        self.message_id = 0
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = dict(await request.post())
+        await asyncio.sleep(self.latency)
+
+        if method == "getme":
+            return self._ok({"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"})
+        if method == "getupdates":
+            await asyncio.sleep(min(float(params.get("timeout", 0)), 1.0))
+            return self._ok([])
+        if method != "sendmessage":
+            return self._ok(True)
+
+        chat_id = int(params["chat_id"])
+        if chat_id in self.blocked:
+            return self._error(403, "Forbidden: bot was blocked by the user")
+        chat = self._chats.setdefault(chat_id, Limit(self.chat_rate, 1))
+        wait = max(self._global.take(), chat.take())
+        if wait:
+            self.rejected += 1
+            retry_after = math.ceil(wait)
+            return self._error(429, f"Too Many Requests: retry after {retry_after}",
+                               parameters={"retry_after": retry_after})
+
+        self.delivered += 1
+        self.message_id += 1
+        return self._ok({
+            "message_id": self.message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": params.get("text", ""),
+        })
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def _error(code: int, description: str, **extra) -> web.Response:
+        return web.json_response({"ok": False, "error_code": code, "description": description, **extra},
+                                 status=code)
+
+
+async def serve(api: FakeBotAPI, host: str, port: int) -> web.AppRunner:
+    runner = web.AppRunner(api.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--rate", type=float, default=30)
+    parser.add_argument("--latency", type=float, default=0.02, help="задержка ответа, с")
+    args = parser.parse_args()
+
+    api = FakeBotAPI(rate=args.rate, latency=args.latency)
+    runner = await serve(api, args.host, args.port)
+    print(f"Фейковый Bot API: http://{args.host}:{args.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
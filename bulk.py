@@ -0,0 +1,76 @@
+# bulk.py
+import csv
+from datetime import datetime
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from config import Config
+from recurrence import parse_rule
+from timeutils import get_zone, to_epoch
+
+DATE_FORMATS = ("%d.%m.%Y %H:%M", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M", "%d.%m.%y %H:%M")
+
+
+class BulkEvent(NamedTuple):
+    line: int
+    title: str
+    description: Optional[str]
+    event_ts: int
+    recurrence: Optional[str]
+
+
+# === Пакетное создание событий ===
+# Одна строка — одно событие: «когда; название; описание; повтор», последние два
+# поля необязательны. Вставленный текст делится точкой с запятой, у CSV-файла
+# разделитель (запятая, точка с запятой или табуляция) определяется по первым
+# строкам. Каждая строка проверяется отдельно: ошибки копятся с номером строки
+# и не мешают остальным, а всё правильное потом вставляется одной транзакцией.
+def parse_when(value: str, tz_name: str) -> int:
+    value = " ".join(value.split())
+    for fmt in DATE_FORMATS:
+        try:
+            local = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        return to_epoch(local.replace(tzinfo=get_zone(tz_name)))
+    raise ValueError(f"не понял дату «{value}», нужно ДД.ММ.ГГГГ ЧЧ:ММ")
+
+
+def sniff_dialect(sample: str):
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",;\t")
+    except csv.Error:
+        return csv.excel
+
+
+def parse_rows(rows: Iterable[List[str]], tz_name: str, now: int,
+               limit: int) -> Tuple[List[BulkEvent], List[Tuple[int, str]]]:
+    events, errors = [], []
+    for line, fields in enumerate(rows, 1):
+        fields = [field.strip() for field in fields]
+        if not any(fields):
+            continue
+        if len(events) >= limit:
+            errors.append((line, f"больше {limit} событий за раз"))
+            break
+        when, title, description, recurrence = (fields + ["", "", "", ""])[:4]
+        try:
+            event_ts = parse_when(when, tz_name)
+        except ValueError as e:
+            if line == 1 and not any(ch.isdigit() for ch in when):
+                continue  # строка заголовков CSV
+            errors.append((line, str(e)))
+            continue
+        try:
+            rule = parse_rule(recurrence)
+        except ValueError as e:
+            errors.append((line, f"повтор: {e}"))
+            continue
+        if not title:
+            errors.append((line, "нет названия"))
+        elif len(title) > Config.EVENT_TITLE_MAX:
+            errors.append((line, f"название длиннее {Config.EVENT_TITLE_MAX} символов"))
+        elif event_ts <= now and rule is None:
+            errors.append((line, "время уже прошло"))
+        else:
+            events.append(BulkEvent(line, title, description or None, event_ts, str(rule) if rule else None))
+    return events, errors
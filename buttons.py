@@ -0,0 +1,79 @@
+# buttons.py
+from typing import Dict, List, Optional, Tuple
+
+from aiogram import Dispatcher
+from aiogram.dispatcher.event.bases import SkipHandler
+from aiogram.dispatcher.event.handler import CallbackType, HandlerObject
+from aiogram.dispatcher.event.telegram import TelegramEventObserver
+from aiogram.fsm.state import State
+from aiogram.types import Message
+
+
+# === Маршрутизация кнопок ===
+# Кнопки reply-клавиатуры приходят обычным текстом, и цепочка фильтров
+# F.text == ... проверялась бы по одному на каждое сообщение. Здесь точный текст
+# кнопки — ключ словаря, а префиксы (👤 клиент, 👥 группа) привязаны к состоянию FSM,
+# в котором такие кнопки показываются. Порядок поиска:
+#   1. префиксы текущего состояния — клавиатура этого шага важнее общего меню;
+#   2. точный текст;
+#   3. префиксы без состояния — только вне диалога: на текстовом шаге (название
+#      события и т. п.) «👤 ...» — это ввод пользователя, а не кнопка.
+# Если ничего не нашлось, сообщение идёт по обычным фильтрам (команды, состояния),
+# так что стоимость разбора кнопки не зависит от их числа.
+class ButtonObserver(TelegramEventObserver):
+    def __init__(self, router: Dispatcher, event_name: str = "message"):
+        super().__init__(router=router, event_name=event_name)
+        self._exact: Dict[str, HandlerObject] = {}
+        self._prefixes: Dict[Optional[str], List[Tuple[str, HandlerObject]]] = {}
+
+    def button(self, *texts: str):
+        def wrapper(callback: CallbackType) -> CallbackType:
+            handler = HandlerObject(callback=callback, filters=[])
+            for text in texts:
+                if text in self._exact:
+                    raise ValueError(f"Кнопка «{text}» уже занята обработчиком {self._exact[text].callback.__name__}")
+                self._exact[text] = handler
+            return callback
+        return wrapper
+
+    def prefix(self, *prefixes: str, state: Optional[State] = None):
+        def wrapper(callback: CallbackType) -> CallbackType:
+            handler = HandlerObject(callback=callback, filters=[])
+            key = state.state if state is not None else None
+            self._prefixes.setdefault(key, []).extend((prefix, handler) for prefix in prefixes)
+            return callback
+        return wrapper
+
+    def _match_prefix(self, state: Optional[str], text: str) -> Optional[HandlerObject]:
+        for prefix, handler in self._prefixes.get(state, ()):
+            if text.startswith(prefix):
+                return handler
+        return None
+
+    def resolve(self, text: str, state: Optional[str]) -> Optional[HandlerObject]:
+        handler = self._match_prefix(state, text) if state is not None else None
+        if handler is None:
+            handler = self._exact.get(text)
+        if handler is None and state is None:
+            handler = self._match_prefix(None, text)
+        return handler
+
+    async def trigger(self, event: Message, **kwargs):
+        text = event.text
+        handler = self.resolve(text, kwargs.get("raw_state")) if text else None
+        if handler is not None:
+            kwargs["handler"] = handler
+            wrapped = self.outer_middleware.wrap_middlewares(self._resolve_middlewares(), handler.call)
+            try:
+                return await wrapped(event, dict(kwargs))
+            except SkipHandler:
+                kwargs.pop("handler", None)
+        return await super().trigger(event, **kwargs)
+
+
+def setup_buttons(dp: Dispatcher) -> ButtonObserver:
+    # Подменяет наблюдатель сообщений диспетчера до регистрации обработчиков
+    # и мидлварей: обычные @dp.message(...) остаются запасной цепочкой
+    observer = ButtonObserver(dp)
+    dp.message = dp.observers["message"] = observer
+    return observer
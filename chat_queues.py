@@ -0,0 +1,109 @@
+# chat_queues.py
+import asyncio
+import contextvars
+import logging
+from collections import deque
+from typing import Dict, Optional
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.event.handler import HandlerObject
+from aiogram.dispatcher.middlewares.error import ErrorsMiddleware
+
+logger = logging.getLogger(__name__)
+
+
+# === Очереди обновлений по чатам ===
+# Внешняя мидлварь на dp.update между контекстом пользователя и FSM. Обновление
+# кладётся в очередь своего чата и принимается сразу; у каждой непустой очереди
+# один исполнитель, поэтому обновления одного чата обрабатываются строго по порядку
+# и каждое видит состояние FSM после предыдущего (два быстрых нажатия на шаге выбора
+# группы больше не гонятся). Разные чаты идут параллельно, но не больше concurrency
+# обработчиков одновременно. Когда принятых обновлений становится max_pending,
+# приём ждёт: опрос перестаёт забирать обновления, а вебхук упирается в свою очередь.
+# Штатная ErrorsMiddleware диспетчера стоит снаружи и к моменту обработки уже
+# вернулась, поэтому очередь сама передаёт ошибки обработчиков в dp.errors;
+# что там не обработано — в лог с трассировкой.
+class ChatQueues(BaseMiddleware):
+    def __init__(self, dp: Dispatcher, concurrency: int = 64, max_pending: int = 1000):
+        self._errors = ErrorsMiddleware(dp)
+        self.max_pending = max_pending
+        self._slots = asyncio.Semaphore(concurrency)
+        self._queues: Dict[int, deque] = {}
+        self._workers: Dict[int, asyncio.Task] = {}
+        self._pending = 0
+        self._space = asyncio.Event()
+        self._space.set()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    @property
+    def chats(self) -> int:
+        return len(self._queues)
+
+    @property
+    def max_depth(self) -> int:
+        return max(map(len, list(self._queues.values())), default=0)
+
+    async def __call__(self, handler, event, data):
+        chat = data.get("event_chat") or data.get("event_from_user")
+        if chat is None:
+            return await handler(event, data)
+
+        while self._pending >= self.max_pending:
+            self._space.clear()
+            await self._space.wait()
+
+        self._pending += 1
+        queue = self._queues.get(chat.id)
+        if queue is None:
+            queue = self._queues[chat.id] = deque()
+            self._workers[chat.id] = asyncio.create_task(self._drain(chat.id, queue))
+        # Результат обработчика не ждём: обработка продолжится в очереди чата,
+        # в контексте (contextvars) того вызова, который её принял
+        queue.append((handler, event, data, contextvars.copy_context()))
+
+    async def _drain(self, key: int, queue: deque):
+        try:
+            while queue:
+                handler, event, data, context = queue[0]
+                async with self._slots:
+                    try:
+                        await asyncio.create_task(self._errors(handler, event, data), context=context)
+                    except Exception:
+                        logger.exception(f"Ошибка обработки обновления в чате {key}")
+                queue.popleft()
+                self._pending -= 1
+                if self._pending < self.max_pending:
+                    self._space.set()
+        finally:
+            del self._queues[key]
+            del self._workers[key]
+
+    async def wait(self, key: int):
+        # Дождаться, пока очередь чата опустеет
+        worker = self._workers.get(key)
+        if worker is not None:
+            await asyncio.shield(worker)
+
+    async def close(self, timeout: Optional[float] = 30):
+        workers = list(self._workers.values())
+        if not workers:
+            return
+        done, pending = await asyncio.wait(workers, timeout=timeout)
+        if pending:
+            logger.warning(f"Не обработано обновлений при остановке: {self._pending}")
+            for task in pending:
+                task.cancel()
+
+
+def setup_chat_queues(dp: Dispatcher, concurrency: int, max_pending: int) -> ChatQueues:
+    # Диспетчер создаётся с disable_fsm=True: мидлварь FSM регистрируется после очередей,
+    # чтобы состояние читалось уже в очереди чата. Очереди дорабатывают первыми при
+    # остановке — до закрытия хранилища FSM.
+    queues = ChatQueues(dp, concurrency, max_pending)
+    dp.update.outer_middleware(queues)
+    dp.update.outer_middleware(dp.fsm)
+    dp.shutdown.handlers.insert(0, HandlerObject(callback=queues.close))
+    return queues
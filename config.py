@@ -5,4 +5,53 @@ class Config:
 
     OWNER_ID = 1965081517  # ← Замени на свой ID
     DATABASE_PATH = "events.db"
+    DB_CACHE_SIZE_KB = 65536  # кэш страниц SQLite, КБ
+    DB_MMAP_SIZE = 268435456  # отображение файла БД в память, байт
+    DB_WRITE_BATCH_MS = 5  # окно группировки отложенных записей
+    DB_WRITE_BATCH_SIZE = 500  # при таком размере пачка пишется, не дожидаясь окна
+    FSM_DATABASE_PATH = "fsm.db"  # состояния диалогов, переживают перезапуск
+    FSM_FLUSH_MS = 50  # окно объединения записей состояний FSM
+    ARCHIVE_AFTER_DAYS = 30  # прошедшие события старше этого уходят в events_archive
+    ARCHIVE_BATCH_SIZE = 500  # событий за одну транзакцию переноса
+    ARCHIVE_INTERVAL = 3600  # секунд между проходами архиватора
+    ARCHIVE_VACUUM_PAGES = 256  # страниц за один шаг incremental_vacuum
+    REMINDER_CATCHUP_MAX_LATE = 6 * 3600  # пропущенное при простое напоминание старше этого не отправляется
+    DIGEST_HOUR = 8  # час ежедневной сводки по поясу пользователя
+    DIGEST_BATCH_SIZE = 1000  # пользователей за одну транзакцию сборки сводок
+    EVENT_TITLE_MAX = 100  # символов в названии события — в диалоге, /bulk и /import
+    ICS_IMPORT_MAX_BYTES = 5 * 1048576  # размер загружаемого .ics
+    ICS_IMPORT_MAX_EVENTS = 5000  # событий из одного файла
+    BULK_MAX_EVENTS = 1000  # событий за один /bulk
+    BULK_MAX_BYTES = 512 * 1024  # размер CSV-файла для /bulk
+    PROFILE_CACHE_SIZE = 50000  # профилей в памяти
+    PROFILE_CACHE_TTL = 300  # секунд до повторного чтения профиля из БД
+    TELEGRAM_API_URL = ""  # свой сервер Bot API (например, локальный фейк для тестов); пусто — api.telegram.org
+    SEND_RATE = 30  # исходящих сообщений в секунду на бота
+    SEND_CHAT_RATE = 1  # сообщений в секунду в один чат
+    SEND_CHAT_BURST = 1
+    SEND_CONCURRENCY = 30  # одновременных запросов отправки
+    SEND_MAX_RETRIES = 5  # после этого сообщение уходит в sender.dead_letter
+    BOT_MODE = "polling"  # "polling" или "webhook"
+    UPDATE_CONCURRENCY = 64  # обновлений разных чатов в обработке одновременно
+    UPDATE_MAX_PENDING = 1000  # сверх этого приём обновлений ждёт
+    # Ограничение частоты по пользователю: политика → (в секунду, подряд, ответ или None — молча).
+    # Обработчик выбирает политику флагом @flags.throttle("имя"), без флага — "default";
+    # "exempt" и служебные сообщения (оплата и т. п.) не ограничиваются
+    THROTTLE_POLICIES = {
+        "default": (3, 20, "⏳ Слишком много сообщений подряд, часть пропущена. Подождите немного."),
+        "register": (0.1, 2, None),  # /start перезаписывает профиль
+        "billing": (0.2, 3, "⏳ Слишком часто. Подождите несколько секунд."),
+        "export": (1 / 60, 1, "⏳ Выгрузка календаря — не чаще раза в минуту."),
+    }
+    WEBHOOK_URL = ""  # публичный https-адрес; пусто — вебхук не регистрируется (локальная проверка)
+    WEBHOOK_PATH = "/webhook"
+    WEBHOOK_SECRET = ""  # X-Telegram-Bot-Api-Secret-Token: A-Z, a-z, 0-9, _ и -; обязателен при WEBHOOK_URL
+    WEBHOOK_HOST = "0.0.0.0"
+    WEBHOOK_PORT = 8080
+    WEBHOOK_MAX_CONNECTIONS = 40  # одновременных запросов от Telegram (1–100)
+    WEBHOOK_WORKERS = 64  # обработчиков приёма: передают обновления в очереди чатов
+    WEBHOOK_QUEUE_SIZE = 1000  # сверх этого отвечаем 503, Telegram повторит
+    WEBHOOK_SHUTDOWN_TIMEOUT = 30  # секунд на доработку очереди при остановке
+    METRICS_HOST = "127.0.0.1"  # эндпоинт Prometheus: http://METRICS_HOST:METRICS_PORT/metrics
+    METRICS_PORT = 9100  # 0 — не запускать
     LOG_LEVEL = "INFO"
@@ -0,0 +1,69 @@
+# data/build_cities.py
+# Собирает data/cities.bin для geo.CityIndex из списка городов GeoNames
+# (cities15000: ~34 000 городов с населением от 15 000, у каждого — пояс IANA).
+# Источник — пакет geonamescache (MIT), ставить его в рабочее окружение не нужно:
+#
+#   pip download geonamescache --no-deps -d /tmp/gnc
+#   unzip -q /tmp/gnc/geonamescache-*.whl -d /tmp/gnc/x
+#   python data/build_cities.py /tmp/gnc/x/geonamescache/data/cities15000.json
+import argparse
+import json
+import os
+import sys
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from geo import CITIES_PATH, HEADER, MAGIC, to_unit_vector  # noqa: E402
+
+
+def kd_order(points: list, lo: int, hi: int, axis: int):
+    # Раскладка неявного KD-дерева: медиана по оси — в середину диапазона,
+    # слева и справа — рекурсивно со следующей осью
+    if hi - lo <= 1:
+        return
+    points[lo:hi] = sorted(points[lo:hi], key=lambda p: p[0][axis])
+    mid = (lo + hi) >> 1
+    next_axis = (axis + 1) % 3
+    kd_order(points, lo, mid, next_axis)
+    kd_order(points, mid + 1, hi, next_axis)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="cities15000.json из geonamescache")
+    parser.add_argument("--output", default=CITIES_PATH)
+    args = parser.parse_args()
+
+    with open(args.source, encoding="utf-8") as f:
+        cities = json.load(f).values()
+
+    zones = sorted({city["timezone"] for city in cities})
+    zone_ids = {zone: i for i, zone in enumerate(zones)}
+    points = [
+        (to_unit_vector(city["latitude"], city["longitude"]), city["name"], zone_ids[city["timezone"]])
+        for city in cities
+    ]
+    kd_order(points, 0, len(points), 0)
+
+    xyz = array("f", (c for point in points for c in point[0]))
+    tz_index = array("H", (point[2] for point in points))
+    names = bytearray()
+    name_offsets = array("I", [0])
+    for _, name, _ in points:
+        names += name.encode()
+        name_offsets.append(len(names))
+    zones_blob = "\n".join(zones).encode()
+
+    with open(args.output, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(points), len(names), len(zones_blob)))
+        f.write(xyz.tobytes())
+        f.write(name_offsets.tobytes())
+        f.write(tz_index.tobytes())
+        f.write(names)
+        f.write(zones_blob)
+    print(f"{args.output}: {len(points)} городов, {len(zones)} поясов, {os.path.getsize(args.output)} байт")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+# database.py
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from metrics import TimedConnection
+
+logger = logging.getLogger(__name__)
+
+
+# === Доступ к базе данных ===
+# Одно долгоживущее соединение и один выделенный поток: все запросы выполняются
+# последовательно вне цикла asyncio, поэтому медленный fsync не блокирует обработку
+# обновлений других пользователей, а соединение не открывается заново на каждое сообщение.
+class Database:
+    def __init__(self, path: str):
+        self.path = path
+        self._conn = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db")
+        self._pending: list[tuple[str, tuple, asyncio.Future]] = []
+        self._flush_handle = None
+        self._flush_tasks: set[asyncio.Task] = set()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, factory=TimedConnection)
+            # WAL: читатели не ждут писателя, а fsync нужен только на контрольной точке
+            self._conn.execute("PRAGMA journal_mode = WAL")
+            self._conn.execute("PRAGMA synchronous = NORMAL")
+            self._conn.execute(f"PRAGMA cache_size = -{Config.DB_CACHE_SIZE_KB}")
+            self._conn.execute(f"PRAGMA mmap_size = {Config.DB_MMAP_SIZE}")
+            self._conn.execute("PRAGMA temp_store = MEMORY")
+            self._conn.execute("PRAGMA busy_timeout = 5000")
+        return self._conn
+
+    def _call(self, func, args):
+        conn = self._connect()
+        try:
+            result = func(conn, *args)
+            conn.commit()
+            return result
+        except Exception:
+            conn.rollback()
+            raise
+
+    async def run(self, func, *args):
+        # func(conn, *args) выполняется в потоке БД одной транзакцией
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._call, func, args)
+
+    async def execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        return await self.run(lambda conn: conn.execute(sql, params))
+
+    async def executemany(self, sql: str, seq_of_params) -> sqlite3.Cursor:
+        return await self.run(lambda conn: conn.executemany(sql, seq_of_params))
+
+    async def fetchone(self, sql: str, params=()):
+        return await self.run(lambda conn: conn.execute(sql, params).fetchone())
+
+    async def fetchall(self, sql: str, params=()) -> list:
+        return await self.run(lambda conn: conn.execute(sql, params).fetchall())
+
+    async def fetchval(self, sql: str, params=(), default=None):
+        row = await self.fetchone(sql, params)
+        return row[0] if row else default
+
+    # === Отложенная запись (write-behind) ===
+    # Мелкие записи копятся DB_WRITE_BATCH_MS миллисекунд и уходят одной транзакцией —
+    # один fsync на пачку вместо одного на каждое сообщение. Возвращаемый future
+    # завершается курсором после коммита пачки; ждать его не обязательно, ошибки
+    # логируются в любом случае. Чтение может не увидеть запись, ещё стоящую в очереди.
+    def write(self, sql: str, params=()) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((sql, params, future))
+        if len(self._pending) >= Config.DB_WRITE_BATCH_SIZE:
+            self._start_flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(Config.DB_WRITE_BATCH_MS / 1000, self._start_flush)
+        return future
+
+    def _start_flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        task = asyncio.get_running_loop().create_task(self.flush())
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    @staticmethod
+    def _write_batch(conn: sqlite3.Connection, ops: list[tuple[str, tuple]]):
+        # Каждая запись — в своей точке сохранения: ошибка одной не откатывает пачку
+        results = []
+        conn.execute("BEGIN")
+        for sql, params in ops:
+            conn.execute("SAVEPOINT write_behind")
+            try:
+                results.append(conn.execute(sql, params))
+            except sqlite3.Error as e:
+                conn.execute("ROLLBACK TO write_behind")
+                results.append(e)
+            conn.execute("RELEASE write_behind")
+        return results
+
+    async def flush(self):
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            results = await self.run(self._write_batch, [(sql, params) for sql, params, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (sql, _, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                logger.error(f"Ошибка отложенной записи: {result} ({sql.split()[0]})")
+                future.set_exception(result)
+                future.exception()  # ошибка уже в логе, даже если future никто не ждёт
+            else:
+                future.set_result(result)
+
+    async def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+        await self.flush()
+
+        def _close():
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, _close)
+        self._executor.shutdown(wait=True)
+
+
+db = Database(Config.DATABASE_PATH)
@@ -0,0 +1,120 @@
+# digest.py
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from timeutils import format_local, get_zone, to_epoch
+
+logger = logging.getLogger(__name__)
+
+DAY = 86400
+WEEK = 7 * DAY
+MESSAGE_LIMIT = 4000  # с запасом до 4096 символов Telegram
+
+
+def next_digest_ts(tz_name: str, hour: int, now: int) -> int:
+    # Ближайшие hour:00 на часах пользователя строго после now
+    zone = get_zone(tz_name)
+    local = datetime.fromtimestamp(now, zone)
+    target = local.replace(hour=hour, minute=0, second=0, microsecond=0)
+    if target <= local:
+        target += timedelta(days=1)
+    return to_epoch(target)
+
+
+# === Ежедневная сводка ===
+# Пользователь с users.digest_mode = 1 вместо отдельных напоминаний «через неделю»
+# и «завтра» получает одно сообщение в день в hour:00 по своему поясу: события
+# ближайших суток и события через неделю, личные и всех его групп. Время следующей
+# сводки хранится в users.digest_next, поэтому задача одним запросом по частичному
+# индексу берёт пачку пользователей, у которых оно наступило, и одним запросом —
+# их события за оба окна. Напоминание «через 15 минут» остаётся отдельным.
+# Пропущенная при простое сводка уходит при запуске, но не больше одной на человека.
+class DailyDigest:
+    def __init__(self, sender, db, hour: int = 8, batch_size: int = 1000, poll_interval: float = 60):
+        self.sender = sender
+        self.db = db
+        self.hour = hour
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.sent = 0
+
+    def _collect(self, conn: sqlite3.Connection, now: int):
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT user_id, COALESCE(timezone, 'Europe/Moscow') FROM users
+            WHERE digest_mode = 1 AND digest_next <= ?
+            ORDER BY digest_next LIMIT ?
+        """, (now, self.batch_size))
+        users = dict(cursor.fetchall())
+        if not users:
+            return {}
+
+        due = json.dumps(list(users))
+        window = (now, now + DAY, now + WEEK, now + WEEK + DAY)
+        cursor.execute("""
+            WITH due(user_id) AS (SELECT value FROM json_each(?))
+            SELECT d.user_id, e.event_time, e.title FROM due d
+            JOIN events e ON e.chat_id = d.user_id AND e.chat_type = 'private'
+            WHERE (e.event_time >= ? AND e.event_time < ?) OR (e.event_time >= ? AND e.event_time < ?)
+            UNION ALL
+            SELECT d.user_id, e.event_time, e.title FROM due d
+            JOIN group_members gm ON gm.user_id = d.user_id
+            JOIN events e ON e.chat_id = gm.group_id AND e.chat_type = 'group'
+            WHERE (e.event_time >= ? AND e.event_time < ?) OR (e.event_time >= ? AND e.event_time < ?)
+            ORDER BY 1, 2
+        """, (due, *window, *window))
+
+        digests = {user_id: (tz_name, []) for user_id, tz_name in users.items()}
+        for user_id, event_ts, title in cursor:
+            digests[user_id][1].append((event_ts, title))
+
+        cursor.executemany("UPDATE users SET digest_next = ? WHERE user_id = ?", [
+            (next_digest_ts(tz_name, self.hour, now), user_id) for user_id, tz_name in users.items()
+        ])
+        return digests
+
+    def _render(self, tz_name: str, items: list, now: int) -> Optional[str]:
+        today = [f"• «{title}» — {format_local(ts, tz_name)}" for ts, title in items if ts < now + DAY]
+        week = [f"• «{title}» — {format_local(ts, tz_name)}" for ts, title in items if ts >= now + DAY]
+        if not today and not week:
+            return None
+        text = "📰 Сводка на день"
+        if today:
+            text += "\n\n⏰ Ближайшие сутки:\n" + "\n".join(today)
+        if week:
+            text += "\n\n📅 Через неделю:\n" + "\n".join(week)
+        if len(text) > MESSAGE_LIMIT:
+            text = text[:MESSAGE_LIMIT].rsplit("\n", 1)[0] + "\n…"
+        return text
+
+    async def send_due(self) -> int:
+        total = 0
+        while True:
+            now = int(time.time())
+            digests = await self.db.run(self._collect, now)
+            for user_id, (tz_name, items) in digests.items():
+                # Пустая сводка не отправляется: сообщение только когда есть что сказать
+                text = self._render(tz_name, items, now)
+                if text:
+                    self.sender.send(user_id, text)
+                    total += 1
+            if len(digests) < self.batch_size:
+                break
+            await asyncio.sleep(0)
+        self.sent += total
+        if total:
+            logger.info(f"Отправлено сводок: {total}")
+        return total
+
+    async def run(self):
+        while True:
+            try:
+                await self.send_due()
+            except Exception as e:
+                logger.error(f"Ошибка ежедневной сводки: {e}")
+            await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,168 @@
+# fsm_storage.py
+import asyncio
+import json
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+
+# === Постоянное хранилище FSM ===
+# Состояния диалогов живут в отдельном SQLite-файле и переживают перезапуск.
+# Чтение и запись идут через горячий слой в памяти; изменения копятся и сбрасываются
+# в файл одной транзакцией раз в flush_ms, так что переход состояния стоит несколько
+# микросекунд. Несколько процессов могут работать с одним файлом: перед чтением
+# проверяется PRAGMA data_version, и при чужом коммите чистые записи горячего слоя
+# отбрасываются и перечитываются.
+class SQLiteStorage(BaseStorage):
+    def __init__(self, path: str, flush_ms: int = 50, key_builder: Optional[KeyBuilder] = None):
+        self.path = path
+        self.flush_delay = flush_ms / 1000
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm")
+        self._conn = None
+        self._probe = None
+        self._data_version = None
+
+        self._states: Dict[str, Optional[str]] = {}
+        self._data: Dict[str, Dict[str, Any]] = {}
+        self._dirty_states: set[str] = set()
+        self._dirty_data: set[str] = set()
+        self._flush_handle = None
+        self._flush_task: Optional[asyncio.Task] = None
+
+    def _ensure_open(self):
+        if self._probe is not None:
+            return
+        self._conn = self._open(check_same_thread=False)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS fsm_state (
+                key TEXT PRIMARY KEY,
+                state TEXT,
+                data TEXT NOT NULL DEFAULT '{}'
+            ) WITHOUT ROWID
+        """)
+        self._conn.commit()
+        # Отдельное соединение в потоке цикла — только для дешёвой проверки data_version
+        self._probe = self._open()
+        self._data_version = self._read_data_version()
+
+    def _open(self, **kwargs) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, **kwargs)
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA synchronous = NORMAL")
+        conn.execute("PRAGMA busy_timeout = 5000")
+        return conn
+
+    def _read_data_version(self) -> int:
+        return self._probe.execute("PRAGMA data_version").fetchone()[0]
+
+    def _check_external_writes(self):
+        self._ensure_open()
+        version = self._read_data_version()
+        if version == self._data_version:
+            return
+        self._data_version = version
+        # Другой процесс что-то записал: несохранённые изменения оставляем, остальное перечитаем
+        self._states = {k: v for k, v in self._states.items() if k in self._dirty_states}
+        self._data = {k: v for k, v in self._data.items() if k in self._dirty_data}
+
+    async def _load(self, key: str):
+        loop = asyncio.get_running_loop()
+        row = await loop.run_in_executor(self._executor, self._select, key)
+        state, data = row if row else (None, "{}")
+        self._states.setdefault(key, state)
+        self._data.setdefault(key, json.loads(data))
+
+    def _select(self, key: str):
+        return self._conn.execute("SELECT state, data FROM fsm_state WHERE key = ?", (key,)).fetchone()
+
+    def _mark_dirty(self):
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.flush_delay, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    async def flush(self):
+        if self._flush_task is not None and self._flush_task is not asyncio.current_task():
+            await asyncio.shield(self._flush_task)
+        states = {key: self._states.get(key) for key in self._dirty_states}
+        data = {key: json.dumps(self._data.get(key, {}), ensure_ascii=False) for key in self._dirty_data}
+        self._dirty_states.clear()
+        self._dirty_data.clear()
+        if not states and not data:
+            return
+        self._ensure_open()
+
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(self._executor, self._write, states, data)
+        except Exception as e:
+            logger.error(f"Ошибка записи состояний FSM: {e}")
+            # Вернём ключи в очередь: следующий сброс попробует ещё раз
+            self._dirty_states.update(states)
+            self._dirty_data.update(data)
+            self._mark_dirty()
+            return
+        # Собственный коммит тоже меняет data_version для пробного соединения
+        self._data_version = self._read_data_version()
+
+    def _write(self, states: Dict[str, Optional[str]], data: Dict[str, str]):
+        conn = self._conn
+        with conn:
+            conn.executemany("""
+                INSERT INTO fsm_state (key, state) VALUES (?, ?)
+                ON CONFLICT (key) DO UPDATE SET state = excluded.state
+            """, states.items())
+            conn.executemany("""
+                INSERT INTO fsm_state (key, data) VALUES (?, ?)
+                ON CONFLICT (key) DO UPDATE SET data = excluded.data
+            """, data.items())
+            conn.executemany("DELETE FROM fsm_state WHERE key = ? AND state IS NULL AND data = '{}'",
+                             ((key,) for key in {*states, *data}))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        k = self.key_builder.build(key)
+        self._states[k] = state.state if isinstance(state, State) else state
+        self._dirty_states.add(k)
+        self._mark_dirty()
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        k = self.key_builder.build(key)
+        self._check_external_writes()
+        if k not in self._states:
+            await self._load(k)
+        return self._states[k]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        k = self.key_builder.build(key)
+        self._data[k] = dict(data)
+        self._dirty_data.add(k)
+        self._mark_dirty()
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        k = self.key_builder.build(key)
+        self._check_external_writes()
+        if k not in self._data:
+            await self._load(k)
+        return dict(self._data[k])
+
+    async def close(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        await self.flush()
+        if self._probe is not None:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(self._executor, self._conn.close)
+            self._probe.close()
+            self._conn = self._probe = None
+        self._executor.shutdown(wait=True)
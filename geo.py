@@ -0,0 +1,117 @@
+# geo.py
+import logging
+import math
+import mmap
+import os
+import struct
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CITIES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "cities.bin")
+EARTH_RADIUS_KM = 6371.0088
+
+# Заголовок файла: сигнатура, число городов, размер блока имён, размер блока поясов
+MAGIC = b"CTZ1"
+HEADER = struct.Struct("<4sIII")
+
+
+def to_unit_vector(lat: float, lon: float) -> Tuple[float, float, float]:
+    phi = math.radians(lat)
+    lam = math.radians(lon)
+    cos_phi = math.cos(phi)
+    return cos_phi * math.cos(lam), cos_phi * math.sin(lam), math.sin(phi)
+
+
+def chord_to_km(chord_sq: float) -> float:
+    # Хорда между точками единичной сферы → расстояние по большому кругу (haversine)
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(chord_sq) / 2))
+
+
+# === Ближайший город ===
+# Города лежат в data/cities.bin уже упорядоченными как неявное KD-дерево:
+# корень поддиапазона [lo, hi) — его середина, ось разбиения — глубина mod 3.
+# Координаты — точки единичной сферы (x, y, z), поэтому нет разрыва на 180-м
+# меридиане и у полюсов, а ближайший по хорде — ближайший и по haversine.
+# Файл отображается в память при первом запросе: ни разбора, ни построения
+# дерева при запуске; поиск обходит несколько десятков узлов.
+class CityIndex:
+    def __init__(self, path: str = CITIES_PATH):
+        self.path = path
+        self._mmap = None
+        self._xyz = None
+        self._tz_index = None
+        self._name_offsets = None
+        self._names = None
+        self._zones = None
+        self.size = 0
+
+    def _load(self):
+        with open(self.path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n, names_size, zones_size = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path}: неизвестный формат")
+
+        view = memoryview(self._mmap)
+        offset = HEADER.size
+        self._xyz = view[offset:offset + 12 * n].cast("f")
+        offset += 12 * n
+        self._name_offsets = view[offset:offset + 4 * (n + 1)].cast("I")
+        offset += 4 * (n + 1)
+        self._tz_index = view[offset:offset + 2 * n].cast("H")
+        offset += 2 * n
+        self._names = view[offset:offset + names_size]
+        offset += names_size
+        self._zones = bytes(view[offset:offset + zones_size]).decode().split("\n")
+        self.size = n
+        logger.info(f"Загружен индекс городов: {n}")
+
+    def nearest(self, lat: float, lon: float) -> Tuple[str, str, float]:
+        # (часовой пояс, город, расстояние в км)
+        if self._xyz is None:
+            self._load()
+        xyz = self._xyz
+        query = to_unit_vector(lat, lon)
+        best = 0
+        best_sq = float("inf")
+
+        # (lo, hi, ось, квадрат расстояния до плоскости, отделяющей поддиапазон)
+        stack = [(0, self.size, 0, 0.0)]
+        while stack:
+            lo, hi, axis, bound_sq = stack.pop()
+            if lo >= hi or bound_sq >= best_sq:
+                continue
+            mid = (lo + hi) >> 1
+            base = 3 * mid
+            dx = xyz[base] - query[0]
+            dy = xyz[base + 1] - query[1]
+            dz = xyz[base + 2] - query[2]
+            dist_sq = dx * dx + dy * dy + dz * dz
+            if dist_sq < best_sq:
+                best_sq = dist_sq
+                best = mid
+
+            diff = query[axis] - xyz[base + axis]
+            next_axis = axis + 1 if axis < 2 else 0
+            # Сначала ближняя половина; дальнюю отсечёт проверка bound_sq, если
+            # плоскость разбиения окажется дальше найденного города
+            if diff < 0:
+                stack.append((mid + 1, hi, next_axis, diff * diff))
+                stack.append((lo, mid, next_axis, 0.0))
+            else:
+                stack.append((lo, mid, next_axis, diff * diff))
+                stack.append((mid + 1, hi, next_axis, 0.0))
+
+        name = bytes(self._names[self._name_offsets[best]:self._name_offsets[best + 1]]).decode()
+        return self._zones[self._tz_index[best]], name, chord_to_km(best_sq)
+
+
+_index: Optional[CityIndex] = None
+
+
+def nearest_city(lat: float, lon: float) -> Tuple[str, str, float]:
+    global _index
+    if _index is None:
+        _index = CityIndex()
+    return _index.nearest(lat, lon)
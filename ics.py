@@ -0,0 +1,326 @@
+# ics.py
+import asyncio
+import calendar
+import logging
+import sqlite3
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Iterator, NamedTuple, Optional
+
+from timeutils import UTC, from_epoch, get_zone, to_epoch
+
+logger = logging.getLogger(__name__)
+
+PRODID = "-//You_timebot//RU"
+LINE_LIMIT = 75  # октетов в строке без CRLF, RFC 5545 3.1
+VTIMEZONE_YEARS = 10  # на столько лет вперёд проверяются переходы пояса
+EXPORT_PAGE_SIZE = 1000  # событий за один запрос выгрузки
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+
+
+class IcsEvent(NamedTuple):
+    title: str
+    description: Optional[str]
+    event_ts: int
+    recurrence: Optional[str]
+
+
+# === Экранирование и перенос строк (RFC 5545) ===
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _unescape(text: str) -> str:
+    out = []
+    chars = iter(text)
+    for ch in chars:
+        if ch == "\\":
+            ch = next(chars, "")
+            out.append("\n" if ch in "nN" else ch)
+        else:
+            out.append(ch)
+    return "".join(out)
+
+
+def _fold(line: str) -> str:
+    data = line.encode()
+    if len(data) <= LINE_LIMIT:
+        return line + "\r\n"
+    parts = []
+    start, limit = 0, LINE_LIMIT
+    while len(data) - start > limit:
+        end = start + limit
+        while data[end] & 0xC0 == 0x80:  # не разрываем символ UTF-8
+            end -= 1
+        parts.append(data[start:end])
+        start, limit = end, LINE_LIMIT - 1  # продолжение начинается с пробела
+    parts.append(data[start:])
+    return b"\r\n ".join(parts).decode() + "\r\n"
+
+
+# === Часовые пояса (VTIMEZONE) ===
+# Каждому TZID в файле нужно описание пояса, RFC 5545 3.6.5. Переходы берутся из
+# zoneinfo: ищутся по суткам и уточняются делением пополам до секунды. Если за
+# VTIMEZONE_YEARS лет они повторяются по правилу «n-е воскресенье месяца», пишется
+# RRULE, иначе — каждый переход отдельным разделом.
+def _offset(zone, ts: int) -> int:
+    return int(datetime.fromtimestamp(ts, zone).utcoffset().total_seconds())
+
+
+def _transitions(zone, year: int) -> list:
+    # [(момент перехода, смещение до, смещение после)] за календарный год
+    ts = to_epoch(datetime(year, 1, 1, tzinfo=UTC))
+    end = to_epoch(datetime(year + 1, 1, 1, tzinfo=UTC))
+    found = []
+    before = _offset(zone, ts)
+    while ts < end:
+        step = min(ts + 86400, end)
+        after = _offset(zone, step)
+        if after != before:
+            lo, hi = ts, step
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if _offset(zone, mid) == before:
+                    lo = mid
+                else:
+                    hi = mid
+            found.append((hi, before, after))
+            before = after
+        ts = step
+    return found
+
+
+def _onset(ts: int, offset_from: int) -> datetime:
+    # Начало раздела — местное время по смещению, действовавшему до перехода
+    return datetime.fromtimestamp(ts, timezone(timedelta(seconds=offset_from))).replace(tzinfo=None)
+
+
+def _yearly_rule(onset: datetime) -> tuple:
+    # (месяц, номер дня недели в месяце — -1 для последнего, день недели)
+    last = onset.day + 7 > calendar.monthrange(onset.year, onset.month)[1]
+    return onset.month, -1 if last else (onset.day - 1) // 7 + 1, onset.weekday()
+
+
+def _rule_date(year: int, rule: tuple, onset: datetime) -> datetime:
+    month, nth, weekday = rule
+    days = [week[weekday] for week in calendar.monthcalendar(year, month) if week[weekday]]
+    return onset.replace(year=year, day=days[nth if nth < 0 else nth - 1])
+
+
+def _utc_offset(seconds: int) -> str:
+    sign = "-" if seconds < 0 else "+"
+    hours, minutes = divmod(abs(seconds) // 60, 60)
+    return f"{sign}{hours:02d}{minutes:02d}"
+
+
+def _observance(zone, ts: int, offset_from: int, offset_to: int, rrule: str = None) -> list:
+    local = datetime.fromtimestamp(ts, zone)
+    kind = "DAYLIGHT" if local.dst() else "STANDARD"
+    lines = [f"BEGIN:{kind}", f"DTSTART:{_onset(ts, offset_from):%Y%m%dT%H%M%S}"]
+    if rrule:
+        lines.append(rrule)
+    lines += [f"TZOFFSETFROM:{_utc_offset(offset_from)}", f"TZOFFSETTO:{_utc_offset(offset_to)}",
+              f"TZNAME:{local.tzname()}", f"END:{kind}"]
+    return lines
+
+
+def vtimezone(tz_name: str, year: int) -> list:
+    zone = get_zone(tz_name)
+    years = [_transitions(zone, y) for y in range(year, year + VTIMEZONE_YEARS)]
+    lines = ["BEGIN:VTIMEZONE", f"TZID:{tz_name}"]
+    first = years[0]
+    if not any(years):
+        # Без перехода на летнее время: одно постоянное смещение
+        offset = _offset(zone, to_epoch(datetime(year, 1, 1, tzinfo=UTC)))
+        lines += ["BEGIN:STANDARD", "DTSTART:19700101T000000", f"TZOFFSETFROM:{_utc_offset(offset)}",
+                  f"TZOFFSETTO:{_utc_offset(offset)}", f"TZNAME:{datetime.fromtimestamp(0, zone).tzname()}",
+                  "END:STANDARD"]
+    else:
+        rules = [_yearly_rule(_onset(ts, before)) for ts, before, _ in first]
+        regular = all(
+            len(found) == len(first) and all(
+                (before, after) == (first[i][1], first[i][2])
+                and _onset(ts, before) == _rule_date(year + n, rules[i], _onset(first[i][0], first[i][1]))
+                for i, (ts, before, after) in enumerate(found))
+            for n, found in enumerate(years)
+        )
+        if regular:
+            for (ts, before, after), (month, nth, weekday) in zip(first, rules):
+                rrule = f"RRULE:FREQ=YEARLY;BYMONTH={month};BYDAY={nth}{WEEKDAYS[weekday]}"
+                lines += _observance(zone, ts, before, after, rrule)
+        else:
+            for found in years:
+                for ts, before, after in found:
+                    lines += _observance(zone, ts, before, after)
+    lines.append("END:VTIMEZONE")
+    return lines
+
+
+def _until_utc(recurrence: str, tz_name: str) -> str:
+    # UNTIL у нас — местное время серии; при DTSTART с TZID RFC требует UTC
+    parts = []
+    for part in recurrence.split(";"):
+        name, _, value = part.partition("=")
+        if name == "UNTIL" and "T" in value and not value.endswith("Z"):
+            local = datetime.strptime(value, "%Y%m%dT%H%M%S").replace(tzinfo=get_zone(tz_name))
+            part = f"UNTIL={local.astimezone(UTC):%Y%m%dT%H%M%SZ}"
+        parts.append(part)
+    return ";".join(parts)
+
+
+def _until_local(recurrence: str, tz_name: str) -> str:
+    # Обратное преобразование при импорте: UNTIL в UTC → местное время пользователя
+    parts = []
+    for part in recurrence.split(";"):
+        name, _, value = part.partition("=")
+        if name.strip().upper() == "UNTIL" and value.strip().upper().endswith("Z"):
+            moment = datetime.strptime(value.strip()[:-1], "%Y%m%dT%H%M%S").replace(tzinfo=UTC)
+            part = f"UNTIL={moment.astimezone(get_zone(tz_name)):%Y%m%dT%H%M%S}"
+        parts.append(part)
+    return ";".join(parts)
+
+
+# === Экспорт ===
+# События пользователя — личные и всех его групп — читаются страницами по
+# EXPORT_PAGE_SIZE: каждая страница — отдельный короткий запрос в потоке БД по
+# ключу (event_time, id) индекса idx_events_chat_time, так что поток БД между
+# страницами свободен для обработчиков остальных пользователей. Форматирование и
+# запись файла идут в отдельном потоке; в памяти не больше одной страницы, сколько
+# бы событий ни было. Разовые события пишутся в UTC, серии — с поясом автора (TZID),
+# потому что их повторы считаются по его часам. Описания использованных поясов
+# (VTIMEZONE) идут в конце файла: порядок разделов календаря RFC не задаёт, а так
+# события не приходится держать в памяти.
+def iter_calendar(rows: Iterable[tuple]) -> Iterator[str]:
+    # rows: (id, title, description, event_time, recurrence, tz_name)
+    stamp = datetime.now(UTC).strftime("%Y%m%dT%H%M%SZ")
+    zones = {}  # TZID → самый ранний год начала серии
+    yield "BEGIN:VCALENDAR\r\nVERSION:2.0\r\n" + _fold(f"PRODID:{PRODID}")
+    for event_id, title, description, event_ts, recurrence, tz_name in rows:
+        lines = ["BEGIN:VEVENT", f"UID:{event_id}@you-timebot", f"DTSTAMP:{stamp}"]
+        if recurrence:
+            start = from_epoch(event_ts, tz_name)
+            zones[tz_name] = min(zones.get(tz_name, start.year), start.year)
+            lines.append(f"DTSTART;TZID={tz_name}:{start:%Y%m%dT%H%M%S}")
+            lines.append(f"RRULE:{_until_utc(recurrence, tz_name)}")
+        else:
+            lines.append(f"DTSTART:{from_epoch(event_ts):%Y%m%dT%H%M%SZ}")
+        lines.append(f"SUMMARY:{_escape(title or '')}")
+        if description:
+            lines.append(f"DESCRIPTION:{_escape(description)}")
+        lines.append("END:VEVENT")
+        yield "".join(map(_fold, lines))
+    for tz_name, year in zones.items():
+        yield "".join(map(_fold, vtimezone(tz_name, year)))
+    yield "END:VCALENDAR\r\n"
+
+
+def _export_chats(conn: sqlite3.Connection, user_id: int) -> list:
+    groups = conn.execute("SELECT group_id FROM group_members WHERE user_id = ?", (user_id,)).fetchall()
+    return [("private", user_id)] + [("group", group_id) for group_id, in groups]
+
+
+def _export_page(conn: sqlite3.Connection, chat_type: str, chat_id: int, after: tuple, limit: int) -> list:
+    return conn.execute("""
+        SELECT e.id, e.title, e.description, e.event_time, e.recurrence, COALESCE(u.timezone, 'Europe/Moscow')
+        FROM events e
+        LEFT JOIN users u ON u.user_id = e.created_by
+        WHERE e.chat_id = ? AND e.chat_type = ? AND e.event_time IS NOT NULL AND (e.event_time, e.id) > (?, ?)
+        ORDER BY e.event_time, e.id LIMIT ?
+    """, (chat_id, chat_type, *after, limit)).fetchall()
+
+
+def _paged_rows(db, loop, user_id: int, page_size: int) -> Iterator[tuple]:
+    # Выполняется в потоке записи файла: каждая страница — отдельный db.run
+    def fetch(func, *args):
+        return asyncio.run_coroutine_threadsafe(db.run(func, *args), loop).result()
+
+    for chat_type, chat_id in fetch(_export_chats, user_id):
+        after = (-(1 << 63), 0)
+        while True:
+            page = fetch(_export_page, chat_type, chat_id, after, page_size)
+            yield from page
+            if len(page) < page_size:
+                break
+            after = (page[-1][3], page[-1][0])
+
+
+async def write_calendar(db, user_id: int, path: str, page_size: int = EXPORT_PAGE_SIZE) -> int:
+    # Возвращает число выгруженных событий
+    loop = asyncio.get_running_loop()
+
+    def write() -> int:
+        count = 0
+
+        def counted(rows):
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            for chunk in iter_calendar(counted(_paged_rows(db, loop, user_id, page_size))):
+                f.write(chunk)
+        return count
+
+    return await asyncio.to_thread(write)
+
+
+# === Импорт ===
+def _unfold(lines: Iterable[str]) -> Iterator[str]:
+    current = None
+    for line in lines:
+        line = line.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def parse_datetime(value: str, params: dict, default_tz: str) -> int:
+    # 20261017T083000Z — UTC; с TZID — по этому поясу; без пояса и дата без
+    # времени (VALUE=DATE) — по часам пользователя
+    value = value.strip()
+    if value.endswith("Z"):
+        return to_epoch(datetime.strptime(value[:-1], "%Y%m%dT%H%M%S").replace(tzinfo=UTC))
+    fmt = "%Y%m%dT%H%M%S" if "T" in value else "%Y%m%d"
+    tz_name = params.get("TZID", default_tz)
+    try:
+        zone = get_zone(tz_name)
+    except (KeyError, ValueError):
+        # Windows-имена поясов и прочие неизвестные — по поясу пользователя
+        zone = get_zone(default_tz)
+    return to_epoch(datetime.strptime(value, fmt).replace(tzinfo=zone))
+
+
+def iter_events(lines: Iterable[str], default_tz: str) -> Iterator[IcsEvent]:
+    # Непонятные события пропускаются с записью в лог, остальные идут дальше.
+    # Повторы серии считаются по часам пользователя, поэтому UNTIL в UTC
+    # переводится в его местное время
+    fields = None
+    for line in _unfold(lines):
+        name, sep, value = line.partition(":")
+        if not sep:
+            continue
+        name, *raw_params = name.split(";")
+        name = name.upper()
+        if name == "BEGIN" and value.upper() == "VEVENT":
+            fields = {}
+        elif name == "END" and value.upper() == "VEVENT" and fields is not None:
+            try:
+                start_value, params = fields["DTSTART"]
+                yield IcsEvent(
+                    title=_unescape(fields.get("SUMMARY", ("",))[0]) or "Без названия",
+                    description=_unescape(fields["DESCRIPTION"][0]) if "DESCRIPTION" in fields else None,
+                    event_ts=parse_datetime(start_value, params, default_tz),
+                    recurrence=_until_local(fields["RRULE"][0], default_tz) if "RRULE" in fields else None,
+                )
+            except (KeyError, ValueError) as e:
+                logger.error(f"Пропущено событие .ics: {e}")
+            fields = None
+        elif fields is not None and name not in fields:
+            params = dict(p.partition("=")[::2] for p in raw_params)
+            params = {key.upper(): value.strip('"') for key, value in params.items()}
+            fields[name] = (value, params)
@@ -0,0 +1,71 @@
+# keyboards.py
+from typing import Dict, Iterable, Optional, Union
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.methods import TelegramMethod
+from aiogram.types import KeyboardButton, ReplyKeyboardMarkup
+from aiohttp import FormData
+
+Row = Iterable[Union[str, KeyboardButton]]
+
+
+# === Реестр клавиатур ===
+# Неизменяемые клавиатуры собираются один раз при импорте main.py; модели aiogram
+# заморожены, так что один объект безопасно отдавать всем пользователям.
+# JSON зарегистрированной клавиатуры считается при первой отправке и дальше
+# берётся из кэша по id объекта — aiogram иначе заново выгружал бы её в dict и
+# сериализовал на каждое сообщение. Клавиатуры с данными пользователя (списки
+# групп, клиентов) собираются на лету, но из тех же готовых кнопок.
+_static: Dict[int, ReplyKeyboardMarkup] = {}
+_serialized: Dict[int, str] = {}
+_buttons: Dict[str, KeyboardButton] = {}
+
+
+def button(text: str) -> KeyboardButton:
+    cached = _buttons.get(text)
+    if cached is None:
+        cached = _buttons[text] = KeyboardButton(text=text)
+    return cached
+
+
+def build(*rows: Row, **options) -> ReplyKeyboardMarkup:
+    # Разовая клавиатура: не регистрируется, кнопки с постоянным текстом — общие
+    keyboard = [[item if isinstance(item, KeyboardButton) else button(item) for item in row] for row in rows]
+    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True, **options)
+
+
+def static(*rows: Row, **options) -> ReplyKeyboardMarkup:
+    markup = build(*rows, **options)
+    _static[id(markup)] = markup
+    return markup
+
+
+def serialized(markup, session: AiohttpSession, bot: Bot) -> Optional[str]:
+    key = id(markup)
+    if _static.get(key) is not markup:
+        return None
+    body = _serialized.get(key)
+    if body is None:
+        body = _serialized[key] = session.prepare_value(markup, bot=bot, files={})
+    return body
+
+
+class KeyboardSession(AiohttpSession):
+    # Сессия, подставляющая готовый JSON зарегистрированных клавиатур
+    def build_form_data(self, bot: Bot, method: TelegramMethod) -> FormData:
+        markup_json = serialized(getattr(method, "reply_markup", None), self, bot)
+        if markup_json is None:
+            return super().build_form_data(bot, method)
+
+        form = FormData(quote_fields=False)
+        files = {}
+        for key, value in method.model_dump(warnings=False, exclude={"reply_markup"}).items():
+            value = self.prepare_value(value, bot=bot, files=files)
+            if not value:
+                continue
+            form.add_field(key, value)
+        form.add_field("reply_markup", markup_json)
+        for key, value in files.items():
+            form.add_field(key, value.read(bot), filename=value.filename or key)
+        return form
@@ -1,14 +1,26 @@
 # main.py
 import asyncio
+import csv
+import heapq
+import io
 import logging
+import os
+import tempfile
+import time
 from datetime import datetime, timedelta
-from zoneinfo import ZoneInfo
 import sqlite3
 import re
+from itertools import islice
+from operator import itemgetter
 
-from aiogram import Bot, Dispatcher
-from aiogram.filters import Command, F
+from aiogram import Bot, Dispatcher, F, flags
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiogram.filters import Command, CommandObject
 from aiogram.types import (
+    CallbackQuery,
+    FSInputFile,
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
     Message,
     ReplyKeyboardMarkup,
     KeyboardButton,
@@ -16,51 +28,113 @@ from aiogram.types import (
     SuccessfulPayment
 )
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.fsm.state import State, StatesGroup
 
+from archive import EventArchiver
+import bulk
+from buttons import setup_buttons
+from chat_queues import setup_chat_queues
 from config import Config
+from database import db
+from digest import DailyDigest, next_digest_ts
+from fsm_storage import SQLiteStorage
+from geo import nearest_city
+import ics
+import keyboards
+from keyboards import KeyboardSession
+from metrics import metrics, setup_handler_metrics, start_metrics_server
+from migrations import apply_migrations
+from profiles import profiles
+from recurrence import parse_rule, preceding, upcoming
+from reminders import ReminderScheduler, pending_flags
+from sender import Sender
+from throttling import EXEMPT, setup_throttling
+from timeutils import format_local, from_epoch, get_zone, local_to_epoch, to_epoch
+from webhook import run_webhook
 
 logging.basicConfig(level=Config.LOG_LEVEL)
 logger = logging.getLogger(__name__)
 
-bot = Bot(token=Config.BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
-
+session = KeyboardSession(api=TelegramAPIServer.from_base(Config.TELEGRAM_API_URL) if Config.TELEGRAM_API_URL else PRODUCTION)
+bot = Bot(token=Config.BOT_TOKEN, session=session)
+sender = Sender(
+    bot,
+    rate=Config.SEND_RATE,
+    chat_rate=Config.SEND_CHAT_RATE,
+    chat_burst=Config.SEND_CHAT_BURST,
+    concurrency=Config.SEND_CONCURRENCY,
+    max_retries=Config.SEND_MAX_RETRIES,
+)
+storage = SQLiteStorage(Config.FSM_DATABASE_PATH, flush_ms=Config.FSM_FLUSH_MS)
+dp = Dispatcher(storage=storage, disable_fsm=True)
+chat_queues = setup_chat_queues(dp, Config.UPDATE_CONCURRENCY, Config.UPDATE_MAX_PENDING)
+buttons = setup_buttons(dp)
+setup_handler_metrics(dp)
+throttling = setup_throttling(dp, Config.THROTTLE_POLICIES)
+reminder_scheduler = ReminderScheduler(sender, db, catchup_max_late=Config.REMINDER_CATCHUP_MAX_LATE)
+daily_digest = DailyDigest(sender, db, hour=Config.DIGEST_HOUR, batch_size=Config.DIGEST_BATCH_SIZE)
+archiver = EventArchiver(
+    db,
+    after_days=Config.ARCHIVE_AFTER_DAYS,
+    batch_size=Config.ARCHIVE_BATCH_SIZE,
+    interval=Config.ARCHIVE_INTERVAL,
+    vacuum_pages=Config.ARCHIVE_VACUUM_PAGES,
+)
 
-# === FSM States ===
-class EventStates:
-    waiting_title = "waiting_title"
-    waiting_description = "waiting_description"
-    waiting_year = "waiting_year"
-    waiting_month = "waiting_month"
-    waiting_day = "waiting_day"
-    waiting_hour_minute = "waiting_hour_minute"
-    creating_group_name = "creating_group_name"
-    joining_group_id = "joining_group_id"
-    waiting_scope = "waiting_scope"
-    waiting_curated_client = "waiting_curated_client"
-
-
-# === Города для определения часового пояса ===
-CITIES_DB = [
-    {"name": "Москва", "lat": 55.7558, "lon": 37.6176, "tz": "Europe/Moscow"},
-    {"name": "Екатеринбург", "lat": 56.8389, "lon": 60.6057, "tz": "Asia/Yekaterinburg"},
-]
+metrics.gauge("bot_send_queue_depth", "Сообщений в очереди отправки", lambda: sender.queue_depth)
+metrics.gauge("bot_send_dead_total", "Сообщений, ушедших в dead letter", lambda: sender.dead)
+metrics.gauge("bot_reminders_scheduled", "Напоминаний в куче планировщика", lambda: len(reminder_scheduler))
+metrics.gauge("bot_digests_sent_total", "Отправлено ежедневных сводок", lambda: daily_digest.sent)
+metrics.gauge("bot_events_archived_total", "Событий, перенесённых в архив", lambda: archiver.archived)
+metrics.gauge("bot_updates_pending", "Принятых, но не обработанных обновлений", lambda: chat_queues.pending)
+metrics.gauge("bot_update_queues_active", "Чатов с непустой очередью обновлений", lambda: chat_queues.chats)
+metrics.gauge("bot_throttled_total", "Обновлений, отброшенных ограничением частоты", lambda: throttling.dropped)
+metrics.gauge("bot_throttle_tracked_users", "Пользователей в таблице ограничения частоты", lambda: throttling.tracked)
+metrics.gauge("bot_update_queue_max_depth", "Самая длинная очередь чата", lambda: chat_queues.max_depth)
+metrics.gauge("bot_profile_cache_hit_ratio", "Доля попаданий в кэш профилей", lambda: profiles.hit_ratio)
 
 
+# === FSM States ===
+class EventStates(StatesGroup):
+    waiting_title = State()
+    waiting_description = State()
+    waiting_year = State()
+    waiting_month = State()
+    waiting_day = State()
+    waiting_hour_minute = State()
+    waiting_recurrence = State()
+    creating_group_name = State()
+    joining_group_id = State()
+    waiting_scope = State()
+    waiting_curated_client = State()
+    waiting_ics = State()
+    waiting_bulk = State()
+
+
+# === Варианты повтора ===
+RECURRENCE_CHOICES = {
+    "Без повтора": None,
+    "Каждый день": "FREQ=DAILY",
+    "Каждую неделю": "FREQ=WEEKLY",
+    "Каждый месяц": "FREQ=MONTHLY",
+    "Каждый год": "FREQ=YEARLY",
+}
+
+# === Тарифы: текст кнопки → (дней, цена в копейках) ===
+PAYMENT_PLANS = {
+    "30 дней — 100₽": (30, 10000),
+    "90 дней — 270₽": (90, 27000),
+    "365 дней — 990₽": (365, 99000),
+}
+
+# === Часовой пояс по геолокации ===
 def find_closest_timezone(lat: float, lon: float):
-    import math
-    def distance(lat1, lon1, lat2, lon2):
-        return math.sqrt((lat1 - lat2)**2 + (lon1 - lon2)**2)
-    closest = None
-    min_dist = float("inf")
-    for city in CITIES_DB:
-        d = distance(lat, lon, city["lat"], city["lon"])
-        if d < min_dist:
-            min_dist = d
-            closest = city
-    return closest["tz"], closest["name"]
+    try:
+        tz, city, _ = nearest_city(lat, lon)
+        return tz, city
+    except (OSError, ValueError) as e:
+        logger.error(f"Индекс городов недоступен: {e}")
+        return "Europe/Moscow", "Москва"
 
 
 TIMEZONES_LIST = [
@@ -71,186 +145,162 @@ TIMEZONES_LIST = [
 ]
 
 
+# === Клавиатуры ===
+# Собираются один раз; см. keyboards.py
+BACK = "🔙 Назад"
+CANCEL = "❌ Отмена"
+MONTHS = ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
+          "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"]
+
+_MAIN_MENU_ROWS = [
+    ["➕ Создать событие", "📋 Мои события"],
+    ["👥 Группы", "💳 Оплатить"],
+    ["❓ Помощь", "⚙️ Профиль"],
+]
+MAIN_MENU_KB = keyboards.static(*_MAIN_MENU_ROWS)
+CURATOR_MENU_KB = keyboards.static(*_MAIN_MENU_ROWS[:2], ["👨‍🏫 Курируемые"], *_MAIN_MENU_ROWS[2:])
+BACK_KB = keyboards.static([BACK])
+CANCEL_KB = keyboards.static([CANCEL])
+PRICING_KB = keyboards.static(*([plan] for plan in PAYMENT_PLANS), ["🚫 Отключить автопродление"], [BACK])
+_PROFILE_ROWS = [["🌍 Сменить часовой пояс"], ["📍 Определить по геолокации"], ["📰 Ежедневная сводка"]]
+PROFILE_KB = keyboards.static(*_PROFILE_ROWS, ["➕ Добавить куратора"], [BACK])
+PROFILE_WITH_CURATORS_KB = keyboards.static(*_PROFILE_ROWS, ["👥 Мои кураторы"], ["➕ Добавить куратора"], [BACK])
+LOCATION_KB = keyboards.static(
+    [KeyboardButton(text="📍 Отправить мою геопозицию", request_location=True)], [CANCEL], one_time_keyboard=True
+)
+TIMEZONES_KB = keyboards.static(*([name] for _, name in TIMEZONES_LIST), [CANCEL])
+CLIENT_KB = keyboards.static(["📅 Назначить событие"], ["🗑 Удалить клиента"], [BACK])
+GROUPS_KB = keyboards.static(["➕ Создать группу"], ["🚪 Вступить по коду"], ["🗂 Мои группы"], [BACK])
+MONTHS_KB = keyboards.static(*(
+    [f"{MONTHS[m]} ({m + 1})" for m in range(row, row + 3)] for row in range(0, 12, 3)
+))
+DAYS_KB = keyboards.static(
+    *([str(d) for d in range(start, min(start + 3, 29))] for start in range(1, 29, 3)),
+    *([str(d)] for d in range(29, 32)),
+    [CANCEL],
+)
+RECURRENCE_KB = keyboards.static(*([choice] for choice in RECURRENCE_CHOICES), [CANCEL])
+
+
+
 # === Инициализация базы данных ===
-def init_db():
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.executescript("""
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            timezone TEXT DEFAULT 'Europe/Moscow',
-            username TEXT,
-            first_name TEXT,
-            subscription_type TEXT DEFAULT 'free',
-            subscription_expire TEXT,
-            auto_renew INTEGER DEFAULT 1,
-            subscription_start TEXT
-        );
-        CREATE TABLE IF NOT EXISTS groups (
-            group_id INTEGER PRIMARY KEY,
-            group_name TEXT NOT NULL,
-            owner_id INTEGER NOT NULL,
-            created_at TEXT NOT NULL
-        );
-        CREATE TABLE IF NOT EXISTS group_members (
-            group_id INTEGER,
-            user_id INTEGER,
-            PRIMARY KEY (group_id, user_id),
-            FOREIGN KEY (group_id) REFERENCES groups (group_id) ON DELETE CASCADE,
-            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
-        );
-        CREATE TABLE IF NOT EXISTS events (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            title TEXT,
-            description TEXT,
-            event_time TEXT,
-            created_by INTEGER,
-            chat_type TEXT,
-            chat_id INTEGER,
-            notified_7d INTEGER DEFAULT 1,
-            notified_1 INTEGER DEFAULT 1,
-            notified_15m INTEGER DEFAULT 1,
-            file_type TEXT,
-            file_id TEXT,
-            recurrence TEXT
-        );
-        CREATE TABLE IF NOT EXISTS curator_client (
-            curator_id INTEGER,
-            client_id INTEGER,
-            added_at TEXT,
-            PRIMARY KEY (curator_id, client_id)
-        );
-    """)
-
-    for col in ["notified_7d", "notified_1", "notified_15m"]:
-        try: cursor.execute(f"ALTER TABLE events ADD COLUMN {col} INTEGER DEFAULT 1")
-        except: pass
-    try: cursor.execute("ALTER TABLE users ADD COLUMN auto_renew INTEGER DEFAULT 1")
-    except: pass
-    try: cursor.execute("ALTER TABLE users ADD COLUMN subscription_start TEXT")
-    except: pass
-
-    conn.commit()
-    conn.close()
-
-
-def register_user(user):
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        INSERT OR REPLACE INTO users (user_id, username, first_name, timezone)
-        VALUES (?, ?, ?, COALESCE((SELECT timezone FROM users WHERE user_id = ?), 'Europe/Moscow'))
-    """, (user.id, user.username, user.first_name, user.id))
-    conn.commit()
-    conn.close()
+async def init_db():
+    await db.run(apply_migrations)
 
 
-def get_subscription_status(user_id: int):
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT subscription_type, subscription_expire, auto_renew FROM users WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
+async def register_user(user):
+    # Пишем только новое имя: повторный /start с тем же username и first_name
+    # отсекается отпечатком в памяти, а после перезапуска — условием WHERE,
+    # так что строка не переписывается и подписка с поясом не трогаются
+    fingerprint = hash((user.username, user.first_name))
+    if profiles.identity_known(user.id, fingerprint):
+        return
+    written = db.write("""
+        INSERT INTO users (user_id, username, first_name) VALUES (?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET username = excluded.username, first_name = excluded.first_name
+        WHERE username IS NOT excluded.username OR first_name IS NOT excluded.first_name
+    """, (user.id, user.username, user.first_name))
+    profiles.remember_identity_on(written, user.id, fingerprint)
 
-    if not row:
-        return "free", None, 1
-    sub_type, expire_str, auto_renew = row
-    if sub_type == "premium":
-        if expire_str:
-            try:
-                expire = datetime.strptime(expire_str, "%Y-%m-%d %H:%M")
-                if expire > datetime.now():
-                    return "premium", expire_str, auto_renew
-            except: pass
-    return "free", None, auto_renew
 
+async def get_subscription_status(user_id: int):
+    profile = await profiles.get(user_id)
+    return profile.subscription_status()
 
-def has_access(user_id: int) -> bool:
+
+async def has_access(user_id: int) -> bool:
     if user_id == Config.OWNER_ID:
         return True
-    status, _, _ = get_subscription_status(user_id)
+    status, _, _ = await get_subscription_status(user_id)
     return status == "premium"
 
 
-def get_user_timezone(user_id: int) -> str:
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT timezone FROM users WHERE user_id = ?", (user_id,))
-    row = cursor.fetchone()
-    conn.close()
-    return row[0] if row else "Europe/Moscow"
+async def get_user_timezone(user_id: int) -> str:
+    profile = await profiles.get(user_id)
+    return profile.timezone
+
 
+EVENT_INSERT = """
+    INSERT INTO events (title, description, event_time, created_by, chat_type, chat_id, file_type, file_id,
+                        notified_7d, notified_1, notified_15m, recurrence)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
 
-def add_event(chat_type: str, chat_id: int, creator_id: int, title: str, desc: str,
+
+def event_row(chat_type: str, chat_id: int, creator_id: int, title: str, desc: str, event_ts: int,
+              file_type=None, file_id=None, recurrence=None) -> tuple:
+    # Параметры EVENT_INSERT; правило повтора — в каноническом виде, неверное — ValueError.
+    # Напоминания, чей срок уже прошёл (событие через 20 часов — без «через неделю»),
+    # сразу отмечены отправленными
+    rule = parse_rule(recurrence)
+    return (title, desc, event_ts, creator_id, chat_type, chat_id, file_type, file_id,
+            *pending_flags(event_ts, int(time.time())), str(rule) if rule else None)
+
+
+async def add_event(chat_type: str, chat_id: int, creator_id: int, title: str, desc: str,
               local_time_str: str, tz_name: str, file_type=None, file_id=None, recurrence=None):
     try:
-        local_tz = ZoneInfo(tz_name)
-        utc_tz = ZoneInfo("UTC")
-        local_dt = datetime.strptime(local_time_str, "%Y-%m-%d %H:%M").replace(tzinfo=local_tz)
-        utc_dt = local_dt.astimezone(utc_tz)
-        utc_time_str = utc_dt.strftime("%Y-%m-%d %H:%M")
-
-        conn = sqlite3.connect(Config.DATABASE_PATH)
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO events (title, description, event_time, created_by, chat_type, chat_id, file_type, file_id, recurrence)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (title, desc, utc_time_str, creator_id, chat_type, chat_id, file_type, file_id, recurrence))
-        conn.commit()
-        conn.close()
-        return True, utc_dt
+        event_ts = local_to_epoch(local_time_str, tz_name)
+        row = event_row(chat_type, chat_id, creator_id, title, desc, event_ts, file_type, file_id, recurrence)
+        cursor = await db.write(EVENT_INSERT, row)
+        reminder_scheduler.schedule_event(cursor.lastrowid, event_ts, recurring=row[-1] is not None)
+        return True, event_ts
     except Exception as e:
         logger.error(f"Ошибка добавления события: {e}")
         return False, None
 
 
-# === Главное меню ===
-def get_main_menu(user_id: int) -> ReplyKeyboardMarkup:
-    kb = [
-        [KeyboardButton(text="➕ Создать событие"), KeyboardButton(text="📋 Мои события")],
-        [KeyboardButton(text="👥 Группы"), KeyboardButton(text="💳 Оплатить")],
-        [KeyboardButton(text="❓ Помощь"), KeyboardButton(text="⚙️ Профиль")]
-    ]
-
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM curator_client WHERE curator_id = ?", (user_id,))
-    is_curator = cursor.fetchone()
-    conn.close()
+async def add_events(rows: list) -> int:
+    # Пачка строк event_row одной транзакцией в потоке БД; id каждой строки —
+    # её собственный lastrowid, без догадок о том, какие номера выдаст база
+    def _insert(conn: sqlite3.Connection):
+        cursor = conn.cursor()
+        ids = []
+        for row in rows:
+            cursor.execute(EVENT_INSERT, row)
+            ids.append(cursor.lastrowid)
+        return ids
 
-    if is_curator:
-        kb.insert(2, [KeyboardButton(text="👨‍🏫 Курируемые")])
+    ids = await db.run(_insert)
+    for event_id, row in zip(ids, rows):
+        reminder_scheduler.schedule_event(event_id, row[2], recurring=row[-1] is not None)
+    return len(ids)
 
-    return ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
+
+# === Главное меню ===
+async def get_main_menu(user_id: int) -> ReplyKeyboardMarkup:
+    profile = await profiles.get(user_id)
+    return CURATOR_MENU_KB if profile.is_curator else MAIN_MENU_KB
 
 
 # === /start ===
 @dp.message(Command("start"))
+@flags.throttle("register")
 async def start(message: Message):
-    register_user(message.from_user)
+    await register_user(message.from_user)
     await message.answer(
         f"Привет, {message.from_user.first_name}! 🎉\n\n"
         "Я помогу тебе не забыть важное — события, встречи, дедлайны.\n"
         "Выбери действие в меню ниже.",
-        reply_markup=get_main_menu(message.from_user.id)
+        reply_markup=await get_main_menu(message.from_user.id)
     )
 
 
 # === Кнопки ===
-@dp.message(F.text == "🔙 Назад")
+@buttons.button("🔙 Назад")
 async def go_back(message: Message, state: FSMContext):
     await state.clear()
-    await message.answer("Главное меню:", reply_markup=get_main_menu(message.from_user.id))
+    await message.answer("Главное меню:", reply_markup=await get_main_menu(message.from_user.id))
 
 
-@dp.message(F.text == "❌ Отмена")
+@buttons.button("❌ Отмена")
 async def cancel_action(message: Message, state: FSMContext):
     await state.clear()
-    await message.answer("Отменено.", reply_markup=get_main_menu(message.from_user.id))
+    await message.answer("Отменено.", reply_markup=await get_main_menu(message.from_user.id))
 
 
 # === Помощь ===
-@dp.message(F.text == "❓ Помощь")
+@buttons.button("❓ Помощь")
 async def help_command(message: Message):
     text = (
         "📘 *Помощь — как пользоваться*\n\n"
@@ -269,16 +319,18 @@ async def help_command(message: Message):
         "Оплати премиум → получи 26 напоминаний, хранение файлов, приоритет.\n"
         "Автопродление можно отключить командой /off\n\n"
         
+        "📤 *Календарь*\n"
+        "/export — выгрузить события в файл .ics, /import — загрузить из .ics.\n"
+        "/bulk — создать много событий сразу: списком или файлом .csv.\n\n"
+        
         "🛠 *Техподдержка*\n"
         "Если что-то не работает — пиши: @helper_tp"
     )
-    kb = [[KeyboardButton(text="🔙 Назад")]]
-    keyboard = ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
-    await message.answer(text, parse_mode="Markdown", reply_markup=keyboard)
+    await message.answer(text, parse_mode="Markdown", reply_markup=BACK_KB)
 
 
 # === Оплата через ЮKassa ===
-@dp.message(F.text == "💳 Оплатить")
+@buttons.button("💳 Оплатить")
 async def show_pricing(message: Message):
     text = (
         "💎 *Выбери тариф*\n\n"
@@ -287,41 +339,19 @@ async def show_pricing(message: Message):
         "🔸 *365 дней* — 990₽\n\n"
         "Все тарифы с автопродлением. Можно отключить командой /off"
     )
-    kb = [
-        [KeyboardButton(text="30 дней — 100₽")],
-        [KeyboardButton(text="90 дней — 270₽")],
-        [KeyboardButton(text="365 дней — 990₽")],
-        [KeyboardButton(text="🚫 Отключить автопродление")],
-        [KeyboardButton(text="🔙 Назад")]
-    ]
-    keyboard = ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
-    await message.answer(text, parse_mode="Markdown", reply_markup=keyboard)
-
-
-@dp.message(F.text.contains("дней"))
+    await message.answer(text, parse_mode="Markdown", reply_markup=PRICING_KB)
+
+
+@buttons.button(*PAYMENT_PLANS)
+@flags.throttle("billing")
 async def handle_payment_choice(message: Message):
     user_id = message.from_user.id
+    days, amount = PAYMENT_PLANS[message.text]
+    payload = f"premium_{days}_{user_id}"
 
-    if "30 дней" in message.text:
-        amount = 10000
-        days = 30
-        payload = f"premium_30_{user_id}"
-    elif "90 дней" in message.text:
-        amount = 27000
-        days = 90
-        payload = f"premium_90_{user_id}"
-    elif "365 дней" in message.text:
-        amount = 99000
-        days = 365
-        payload = f"premium_365_{user_id}"
-    else:
-        return
-
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET auto_renew = 1 WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
+    written = db.write("UPDATE users SET auto_renew = 1 WHERE user_id = ?", (user_id,))
+    profiles.update(user_id, auto_renew=1)
+    profiles.invalidate_on(written, user_id)
 
     if not Config.YOOKASSA_PROVIDER_TOKEN or "TEST" not in Config.YOOKASSA_PROVIDER_TOKEN:
         await message.answer("🔧 Оплата временно недоступна.")
@@ -349,6 +379,7 @@ async def process_pre_checkout_query(pre_checkout_query: PreCheckoutQuery):
 
 
 @dp.message(F.successful_payment)
+@flags.throttle(EXEMPT)
 async def process_successful_payment(message: Message):
     successful_payment: SuccessfulPayment = message.successful_payment
     payload = successful_payment.invoice_payload
@@ -361,52 +392,209 @@ async def process_successful_payment(message: Message):
     else:
         days = 365
 
-    expire_date = (datetime.now() + timedelta(days=days)).strftime("%Y-%m-%d %H:%M")
-    start_date = datetime.now().strftime("%Y-%m-%d %H:%M")
+    start_ts = int(time.time())
+    expire_ts = start_ts + days * 86400
 
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
+    await db.execute("""
         UPDATE users 
         SET subscription_type = 'premium', 
             subscription_expire = ?, 
             subscription_start = ?, 
             auto_renew = 1 
         WHERE user_id = ?
-    """, (expire_date, start_date, user_id))
-    conn.commit()
-    conn.close()
+    """, (expire_ts, start_ts, user_id))
+    profiles.invalidate(user_id)
 
+    expire_date = format_local(expire_ts, await get_user_timezone(user_id))
     await message.answer(f"✅ Подписка активирована до {expire_date}\n🔁 Автопродление включено")
 
 
 # === /off — отключить автопродление ===
 @dp.message(Command("off"))
+@flags.throttle("billing")
 async def disable_auto_renew(message: Message):
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET auto_renew = 0 WHERE user_id = ?", (message.from_user.id,))
-    conn.commit()
-    conn.close()
+    written = db.write("UPDATE users SET auto_renew = 0 WHERE user_id = ?", (message.from_user.id,))
+    profiles.update(message.from_user.id, auto_renew=0)
+    profiles.invalidate_on(written, message.from_user.id)
     await message.answer("❌ Автопродление отключено.")
 
 
+# === /stats — метрики для владельца ===
+@dp.message(Command("stats"))
+async def show_stats(message: Message):
+    if message.from_user.id != Config.OWNER_ID:
+        return
+    await message.answer(metrics.summary(), parse_mode="Markdown")
+
+
+# === Экспорт и импорт календаря (.ics) ===
+@dp.message(Command("export"))
+@flags.throttle("export")
+async def export_events(message: Message):
+    fd, path = tempfile.mkstemp(suffix=".ics")
+    os.close(fd)
+    try:
+        count = await ics.write_calendar(db, message.from_user.id, path)
+        if not count:
+            await message.answer("📭 Событий для экспорта нет.")
+            return
+        await message.answer_document(FSInputFile(path, filename="events.ics"),
+                                      caption=f"📤 Событий в календаре: {count}")
+    except Exception as e:
+        logger.error(f"Ошибка экспорта календаря: {e}")
+        await message.answer("❌ Не удалось выгрузить календарь.")
+    finally:
+        os.remove(path)
+
+
+@dp.message(Command("import"))
+async def import_prompt(message: Message, state: FSMContext):
+    await state.set_state(EventStates.waiting_ics)
+    await message.answer("📥 Пришлите файл календаря .ics — события из него станут личными.", reply_markup=CANCEL_KB)
+
+
+@dp.message(EventStates.waiting_ics, F.document)
+async def import_events(message: Message, state: FSMContext):
+    document = message.document
+    if document.file_size and document.file_size > Config.ICS_IMPORT_MAX_BYTES:
+        await message.answer(f"❌ Файл больше {Config.ICS_IMPORT_MAX_BYTES // 1048576} МБ.")
+        return
+    await state.clear()
+
+    user_id = message.from_user.id
+    tz = await get_user_timezone(user_id)
+    now = int(time.time())
+    rows, skipped = [], 0
+    try:
+        buffer = await bot.download(document)
+        for event in ics.iter_events(io.TextIOWrapper(buffer, encoding="utf-8-sig", errors="replace"), tz):
+            if len(rows) >= Config.ICS_IMPORT_MAX_EVENTS:
+                skipped += 1
+                continue
+            # Длинное название обрезается до предела диалога создания
+            title = event.title[:Config.EVENT_TITLE_MAX]
+            try:
+                row = event_row("private", user_id, user_id, title, event.description,
+                                event.event_ts, recurrence=event.recurrence)
+            except ValueError:
+                # Правило, которого мы не умеем, — оставляем только первое вхождение
+                row = event_row("private", user_id, user_id, title, event.description, event.event_ts)
+            if row[-1] is None and event.event_ts <= now:
+                skipped += 1  # прошедшие разовые события не переносим
+                continue
+            rows.append(row)
+        added = await add_events(rows) if rows else 0
+    except Exception as e:
+        logger.error(f"Ошибка импорта календаря: {e}")
+        await message.answer("❌ Не удалось прочитать календарь.", reply_markup=await get_main_menu(user_id))
+        return
+
+    text = f"📥 Импортировано событий: {added}"
+    if skipped:
+        text += f"\nПропущено (прошедшие или сверх лимита): {skipped}"
+    await message.answer(text, reply_markup=await get_main_menu(user_id))
+
+
+@dp.message(EventStates.waiting_ics)
+async def import_wrong_input(message: Message):
+    await message.answer("📎 Нужен файл .ics. Или нажмите «❌ Отмена».", reply_markup=CANCEL_KB)
+
+
+# === Пакетное создание событий ===
+# /bulk — в личные события, /bulk <группа> — в свою группу. Все строки проверяются
+# до записи и вставляются одной транзакцией (add_events), ошибки — по номерам строк.
+@dp.message(Command("bulk"))
+async def bulk_prompt(message: Message, state: FSMContext, command: CommandObject):
+    target = {"chat_type": "private", "chat_id": message.from_user.id, "group_name": None}
+    if command.args:
+        group_name = command.args.strip()
+        row = await db.fetchone("""
+            SELECT g.group_id FROM groups g
+            JOIN group_members gm ON gm.group_id = g.group_id AND gm.user_id = ?
+            WHERE g.group_name = ?
+        """, (message.from_user.id, group_name))
+        if not row:
+            await message.answer("❌ Группа не найдена среди ваших.")
+            return
+        target = {"chat_type": "group", "chat_id": row[0], "group_name": group_name}
+
+    await state.set_state(EventStates.waiting_bulk)
+    await state.update_data(bulk=target)
+    await message.answer(
+        "📋 Пришлите события списком, по одному на строку:\n"
+        "`25.10.2026 18:00; Тренировка; зал 3; FREQ=WEEKLY`\n"
+        "Описание и повтор можно не указывать. Или пришлите файл .csv с теми же колонками.",
+        parse_mode="Markdown",
+        reply_markup=CANCEL_KB
+    )
+
+
+@dp.message(EventStates.waiting_bulk, F.document)
+async def bulk_from_file(message: Message, state: FSMContext):
+    if message.document.file_size and message.document.file_size > Config.BULK_MAX_BYTES:
+        await message.answer(f"❌ Файл больше {Config.BULK_MAX_BYTES // 1024} КБ.")
+        return
+    buffer = await bot.download(message.document)
+    text = buffer.getvalue().decode("utf-8-sig", errors="replace")
+    await _create_bulk(message, state, csv.reader(text.splitlines(), bulk.sniff_dialect(text[:4096])))
+
+
+@dp.message(EventStates.waiting_bulk, F.text)
+async def bulk_from_text(message: Message, state: FSMContext):
+    await _create_bulk(message, state, csv.reader(message.text.splitlines(), delimiter=";"))
+
+
+async def _create_bulk(message: Message, state: FSMContext, rows):
+    user_id = message.from_user.id
+    target = (await state.get_data())["bulk"]
+    tz = await get_user_timezone(user_id)
+    events, errors = bulk.parse_rows(rows, tz, int(time.time()), Config.BULK_MAX_EVENTS)
+    await state.clear()
+
+    added = 0
+    if events:
+        try:
+            added = await add_events([
+                event_row(target["chat_type"], target["chat_id"], user_id, event.title, event.description,
+                          event.event_ts, recurrence=event.recurrence)
+                for event in events
+            ])
+        except Exception as e:
+            logger.error(f"Ошибка пакетного создания событий: {e}")
+            await message.answer("❌ Ошибка при создании событий.", reply_markup=await get_main_menu(user_id))
+            return
+
+    text = f"✅ Создано событий: {added}"
+    if errors:
+        text += f"\n\n⚠️ Не создано: {len(errors)}\n"
+        text += "\n".join(f"Строка {line}: {error}" for line, error in errors[:20])
+        if len(errors) > 20:
+            text += f"\n…и ещё {len(errors) - 20}"
+    await message.answer(text, reply_markup=await get_main_menu(user_id))
+
+    if added and target["chat_type"] == "group":
+        members = await db.fetchall("SELECT user_id FROM group_members WHERE group_id = ? AND user_id != ?",
+                                    (target["chat_id"], user_id))
+        sender.send_many([member for member, in members],
+                         f"📢 В группе «{target['group_name']}» добавлено событий: {added}")
+
+
 # === Кнопка "Отключить автопродление" ===
-@dp.message(F.text == "🚫 Отключить автопродление")
+@buttons.button("🚫 Отключить автопродление")
+@flags.throttle("billing")
 async def cancel_auto_renew_button(message: Message):
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE users SET auto_renew = 0 WHERE user_id = ?", (message.from_user.id,))
-    conn.commit()
-    conn.close()
-    await message.answer("❌ Автопродление отключено.", reply_markup=get_main_menu(message.from_user.id))
+    written = db.write("UPDATE users SET auto_renew = 0 WHERE user_id = ?", (message.from_user.id,))
+    profiles.update(message.from_user.id, auto_renew=0)
+    profiles.invalidate_on(written, message.from_user.id)
+    await message.answer("❌ Автопродление отключено.", reply_markup=await get_main_menu(message.from_user.id))
 
 
 # === Профиль ===
-@dp.message(F.text == "⚙️ Профиль")
+@buttons.button("⚙️ Профиль")
 async def profile(message: Message):
-    tz = get_user_timezone(message.from_user.id)
-    status, expire, auto_renew = get_subscription_status(message.from_user.id)
+    user_profile = await profiles.get(message.from_user.id)
+    tz = user_profile.timezone
+    status, expire, auto_renew = user_profile.subscription_status()
 
     if message.from_user.id == Config.OWNER_ID:
         sub_text = "💎 Премиум (владелец)"
@@ -417,117 +605,157 @@ async def profile(message: Message):
         if auto_renew == 1:
             sub_text += "\n🔁 Автопродление включено"
 
-    kb = [
-        [KeyboardButton(text="🌍 Сменить часовой пояс")],
-        [KeyboardButton(text="📍 Определить по геолокации")]
-    ]
-
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM curator_client WHERE client_id = ?", (message.from_user.id,))
-    has_curators = cursor.fetchone()
-    conn.close()
-
-    if has_curators:
-        kb.append([KeyboardButton(text="👥 Мои кураторы")])
-    kb.append([KeyboardButton(text="➕ Добавить куратора")])
-    kb.append([KeyboardButton(text="🔙 Назад")])
-
-    keyboard = ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
+    keyboard = PROFILE_WITH_CURATORS_KB if user_profile.has_curators else PROFILE_KB
     await message.answer(
         f"🔧 Твой профиль:\n\n"
         f"🌍 Часовой пояс: `{tz}`\n"
+        f"📰 Ежедневная сводка: {'включена' if user_profile.digest_mode else 'выключена'}\n"
         f"🎟 Подписка: {sub_text}",
         parse_mode="Markdown",
         reply_markup=keyboard
     )
 
 
+# === Ежедневная сводка ===
+@buttons.button("📰 Ежедневная сводка")
+async def toggle_digest(message: Message):
+    user_id = message.from_user.id
+    user_profile = await profiles.get(user_id)
+    enabled = not user_profile.digest_mode
+    digest_next = next_digest_ts(user_profile.timezone, Config.DIGEST_HOUR, int(time.time())) if enabled else None
+
+    written = db.write("UPDATE users SET digest_mode = ?, digest_next = ? WHERE user_id = ?",
+                       (int(enabled), digest_next, user_id))
+    profiles.update(user_id, digest_mode=enabled)
+    profiles.invalidate_on(written, user_id)
+
+    if enabled:
+        await message.answer(
+            f"📰 Сводка включена: каждый день в {Config.DIGEST_HOUR:02d}:00 — события на сутки и через неделю.\n"
+            "Напоминания «через неделю» и «завтра» теперь входят в неё, «через 15 минут» приходит как раньше.",
+            reply_markup=await get_main_menu(user_id)
+        )
+    else:
+        await message.answer("📰 Сводка выключена, напоминания снова приходят по одному.",
+                             reply_markup=await get_main_menu(user_id))
+
+
 # === Геолокация ===
-@dp.message(F.text == "📍 Определить по геолокации")
+@buttons.button("📍 Определить по геолокации")
 async def request_location(message: Message):
-    kb = [[KeyboardButton(text="📍 Отправить мою геопозицию", request_location=True)], [KeyboardButton(text="❌ Отмена")]]
-    keyboard = ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True, one_time_keyboard=True)
-    await message.answer("Отправь геопозицию:", reply_markup=keyboard)
+    await message.answer("Отправь геопозицию:", reply_markup=LOCATION_KB)
 
 
 @dp.message(F.location)
 async def handle_location(message: Message):
     lat, lon = message.location.latitude, message.location.longitude
     tz, city = find_closest_timezone(lat, lon)
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT timezone FROM users WHERE user_id = ?", (message.from_user.id,))
-    row = cursor.fetchone()
-    old_tz = row[0] if row else "Europe/Moscow"
-    cursor.execute("UPDATE users SET timezone = ? WHERE user_id = ?", (tz, message.from_user.id))
-    conn.commit()
-    conn.close()
-
-    reschedule_events_for_user(message.from_user.id, old_tz, tz)
+    old_tz = await update_user_timezone(message.from_user.id, tz)
 
-    await message.answer(f"✅ Часовой пояс: {tz} ({city})", reply_markup=get_main_menu(message.from_user.id))
+    await reschedule_events_for_user(message.from_user.id, old_tz, tz)
 
+    await message.answer(f"✅ Часовой пояс: {tz} ({city})", reply_markup=await get_main_menu(message.from_user.id))
 
-def reschedule_events_for_user(user_id: int, old_tz: str, new_tz: str):
-    try:
-        old_zone = ZoneInfo(old_tz)
-        new_zone = ZoneInfo(new_tz)
-        now_utc = datetime.now(ZoneInfo("UTC"))
 
-        conn = sqlite3.connect(Config.DATABASE_PATH)
+async def update_user_timezone(user_id: int, tz: str) -> str:
+    def _update(conn: sqlite3.Connection):
         cursor = conn.cursor()
-        cursor.execute("""
-            SELECT id, event_time FROM events
-            WHERE created_by = ? AND event_time > ?
-        """, (user_id, now_utc.strftime("%Y-%m-%d %H:%M")))
-        rows = cursor.fetchall()
-
-        for event_id, utc_time_str in rows:
-            utc_dt = datetime.strptime(utc_time_str, "%Y-%m-%d %H:%M").replace(tzinfo=ZoneInfo("UTC"))
-            old_local = utc_dt.astimezone(old_zone)
-            new_local = old_local.astimezone(new_zone)
-            new_utc = new_local.astimezone(ZoneInfo("UTC"))
-            new_utc_str = new_utc.strftime("%Y-%m-%d %H:%M")
-            cursor.execute("UPDATE events SET event_time = ? WHERE id = ?", (new_utc_str, event_id))
-
-        conn.commit()
-        conn.close()
+        cursor.execute("SELECT timezone FROM users WHERE user_id = ?", (user_id,))
+        row = cursor.fetchone()
+        cursor.execute("UPDATE users SET timezone = ? WHERE user_id = ?", (tz, user_id))
+        # Сводка приходит в тот же час, но уже по новому поясу
+        cursor.execute("UPDATE users SET digest_next = ? WHERE user_id = ? AND digest_mode = 1",
+                       (next_digest_ts(tz, Config.DIGEST_HOUR, int(time.time())), user_id))
+        return row[0] if row else "Europe/Moscow"
+
+    old_tz = await db.run(_update)
+    profiles.update(user_id, timezone=tz)
+    return old_tz
+
+
+def _wall_clock_shift(old_zone, new_zone, utc_dt: datetime) -> int:
+    # На сколько секунд сдвинется момент события, если оставить его время на часах,
+    # но считать его по новому поясу
+    return int((utc_dt.astimezone(old_zone).replace(tzinfo=new_zone) - utc_dt).total_seconds())
+
+
+def _reschedule(conn: sqlite3.Connection, user_id: int, old_tz: str, new_tz: str):
+    # События сохраняют локальное время на часах: 14:30 по старому поясу становится
+    # 14:30 по новому. Сдвиг меняется только на переходах летнего времени, поэтому
+    # считается один раз на сутки (UTC); построчно — лишь в сутки с переходом.
+    # Запись — одним executemany. Только личные события: групповое событие общее,
+    # и смена пояса одним участником не должна сдвигать его для остальных.
+    old_zone = get_zone(old_tz)
+    new_zone = get_zone(new_tz)
+
+    now = int(time.time())
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT id, event_time, recurrence IS NOT NULL FROM events
+        WHERE created_by = ? AND event_time > ? AND chat_type = 'private'
+    """, (user_id, now))
+
+    day_shifts = {}
+    updates = []
+    moved = []
+    for event_id, event_ts, recurring in cursor.fetchall():
+        day = event_ts // 86400
+        if day not in day_shifts:
+            day_start = from_epoch(day * 86400)
+            first = _wall_clock_shift(old_zone, new_zone, day_start)
+            last = _wall_clock_shift(old_zone, new_zone, day_start + timedelta(days=1))
+            day_shifts[day] = first if first == last else None
+
+        shift = day_shifts[day]
+        if shift is None:
+            shift = _wall_clock_shift(old_zone, new_zone, from_epoch(event_ts))
+        if shift:
+            new_ts = event_ts + shift
+            updates.append((new_ts, *pending_flags(new_ts, now), event_id))
+            moved.append((event_id, new_ts, bool(recurring)))
+
+    # Отправленное напоминание остаётся отправленным; ждущее, чей срок после
+    # сдвига уже прошёл, снимается
+    cursor.executemany("""
+        UPDATE events SET event_time = ?, notified_7d = notified_7d AND ?, notified_1 = notified_1 AND ?,
+                          notified_15m = notified_15m AND ?
+        WHERE id = ?
+    """, updates)
+    return moved
+
+
+async def reschedule_events_for_user(user_id: int, old_tz: str, new_tz: str):
+    if old_tz == new_tz:
+        return
+    try:
+        moved = await db.run(_reschedule, user_id, old_tz, new_tz)
+        for event_id, new_ts, recurring in moved:
+            reminder_scheduler.schedule_event(event_id, new_ts, recurring)
     except Exception as e:
         logger.error(f"Ошибка пересчёта: {e}")
 
 
 # === Ручной выбор TZ ===
-@dp.message(F.text == "🌍 Сменить часовой пояс")
+@buttons.button("🌍 Сменить часовой пояс")
 async def select_timezone(message: Message):
-    kb = [[KeyboardButton(text=name)] for _, name in TIMEZONES_LIST]
-    kb.append([KeyboardButton(text="❌ Отмена")])
-    keyboard = ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
-    await message.answer("Выбери:", reply_markup=keyboard)
+    await message.answer("Выбери:", reply_markup=TIMEZONES_KB)
 
 
-@dp.message(F.text.contains("UTC+"))
+@buttons.button(*(name for _, name in TIMEZONES_LIST))
 async def set_timezone(message: Message):
     for code, name in TIMEZONES_LIST:
         if name == message.text:
-            conn = sqlite3.connect(Config.DATABASE_PATH)
-            cursor = conn.cursor()
-            cursor.execute("SELECT timezone FROM users WHERE user_id = ?", (message.from_user.id,))
-            row = cursor.fetchone()
-            old_tz = row[0] if row else "Europe/Moscow"
-            cursor.execute("UPDATE users SET timezone = ? WHERE user_id = ?", (code, message.from_user.id))
-            conn.commit()
-            conn.close()
-
-            reschedule_events_for_user(message.from_user.id, old_tz, code)
-
-            await message.answer(f"✅ Установлено: {code}", reply_markup=get_main_menu(message.from_user.id))
+            old_tz = await update_user_timezone(message.from_user.id, code)
+
+            await reschedule_events_for_user(message.from_user.id, old_tz, code)
+
+            await message.answer(f"✅ Установлено: {code}", reply_markup=await get_main_menu(message.from_user.id))
             return
     await message.answer("❌ Ошибка.")
 
 
 # === Кураторство ===
-@dp.message(F.text == "➕ Добавить куратора")
+@buttons.button("➕ Добавить куратора")
 async def add_curator_cmd(message: Message):
     cmd = f"/addclient_{message.from_user.id}"
     await message.answer(f"Отправь куратору:\n`{cmd}`", parse_mode="Markdown")
@@ -541,42 +769,34 @@ async def add_client(message: Message):
             await message.answer("❌ Нельзя быть куратором самому себе.")
             return
 
-        conn = sqlite3.connect(Config.DATABASE_PATH)
-        cursor = conn.cursor()
-        cursor.execute("INSERT OR IGNORE INTO curator_client (curator_id, client_id, added_at) VALUES (?, ?, ?)",
-                       (message.from_user.id, client_id, datetime.now().isoformat()))
-        conn.commit()
-        conn.close()
+        await db.execute("INSERT OR IGNORE INTO curator_client (curator_id, client_id, added_at) VALUES (?, ?, ?)",
+                         (message.from_user.id, client_id, datetime.now().isoformat()))
+        profiles.update(message.from_user.id, is_curator=True)
+        profiles.update(client_id, has_curators=True)
 
         await message.answer("✅ Вы теперь куратор этого пользователя.")
-        await bot.send_message(client_id, f"🔔 Вас добавили как клиента.")
+        sender.send(client_id, f"🔔 Вас добавили как клиента.")
     except:
         await message.answer("❌ Неверная команда.")
 
 
-@dp.message(F.text == "👨‍🏫 Курируемые")
+@buttons.button("👨‍🏫 Курируемые")
 async def list_clients(message: Message):
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
+    clients = await db.fetchall("""
         SELECT u.user_id, u.first_name FROM curator_client cc
         JOIN users u ON cc.client_id = u.user_id
         WHERE cc.curator_id = ?
     """, (message.from_user.id,))
-    clients = cursor.fetchall()
-    conn.close()
 
     if not clients:
         await message.answer("📭 Нет курируемых.")
         return
 
-    kb = [[KeyboardButton(text=f"👤 {name} (ID: {uid})")] for uid, name in clients]
-    kb.append([KeyboardButton(text="🔙 Назад")])
-    keyboard = ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
+    keyboard = keyboards.build(*([f"👤 {name} (ID: {uid})"] for uid, name in clients), [BACK])
     await message.answer("Выберите клиента:", reply_markup=keyboard)
 
 
-@dp.message(F.text.startswith("👤 "))
+@buttons.prefix("👤 ")
 async def view_client_profile(message: Message, state: FSMContext):
     try:
         client_id = int(message.text.split("ID: ")[1].strip(")"))
@@ -584,39 +804,36 @@ async def view_client_profile(message: Message, state: FSMContext):
         await message.answer("❌ Ошибка ID.")
         return
 
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM curator_client WHERE curator_id = ? AND client_id = ?", (message.from_user.id, client_id))
-    if not cursor.fetchone():
+    def _load_client(conn: sqlite3.Connection):
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM curator_client WHERE curator_id = ? AND client_id = ?", (message.from_user.id, client_id))
+        if not cursor.fetchone():
+            return None
+
+        cursor.execute("SELECT first_name FROM users WHERE user_id = ?", (client_id,))
+        name = cursor.fetchone()[0]
+
+        cursor.execute("""
+            SELECT title, event_time FROM events
+            WHERE chat_id = ? AND event_time > ?
+            ORDER BY event_time LIMIT 1
+        """, (client_id, int(time.time())))
+        event_row = cursor.fetchone()
+        return name, event_row[0] if event_row else "Нет"
+
+    client = await db.run(_load_client)
+    if not client:
         await message.answer("❌ Не ваш клиент.")
-        conn.close()
         return
+    name, next_event = client
 
-    cursor.execute("SELECT first_name FROM users WHERE user_id = ?", (client_id,))
-    name = cursor.fetchone()[0]
-
-    cursor.execute("""
-        SELECT title, event_time FROM events
-        WHERE chat_id = ? AND event_time > ?
-        ORDER BY event_time LIMIT 1
-    """, (client_id, datetime.now().strftime("%Y-%m-%d %H:%M")))
-    event_row = cursor.fetchone()
-    next_event = event_row[0] if event_row else "Нет"
-    conn.close()
-
-    kb = [
-        [KeyboardButton(text="📅 Назначить событие")],
-        [KeyboardButton(text="🗑 Удалить клиента")],
-        [KeyboardButton(text="🔙 Назад")]
-    ]
-    keyboard = ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
-    await message.answer(f"👨‍💼 {name}\n⏰ Следующее: {next_event}", reply_markup=keyboard)
+    await message.answer(f"👨‍💼 {name}\n⏰ Следующее: {next_event}", reply_markup=CLIENT_KB)
     
     await state.update_data(curated_client_id=client_id)
     await state.set_state(EventStates.waiting_curated_client)
 
 
-@dp.message(F.text == "🗑 Удалить клиента")
+@buttons.button("🗑 Удалить клиента")
 async def remove_client(message: Message, state: FSMContext):
     data = await state.get_data()
     client_id = data.get("curated_client_id")
@@ -626,35 +843,23 @@ async def remove_client(message: Message, state: FSMContext):
         await state.clear()
         return
 
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM curator_client WHERE curator_id = ? AND client_id = ?", (message.from_user.id, client_id))
-    conn.commit()
-    conn.close()
+    await db.execute("DELETE FROM curator_client WHERE curator_id = ? AND client_id = ?", (message.from_user.id, client_id))
+    profiles.invalidate(message.from_user.id, client_id)
 
-    await message.answer("🗑 Клиент удалён.", reply_markup=get_main_menu(message.from_user.id))
+    await message.answer("🗑 Клиент удалён.", reply_markup=await get_main_menu(message.from_user.id))
     await state.clear()
 
 
 # === Группы ===
-@dp.message(F.text == "👥 Группы")
+@buttons.button("👥 Группы")
 async def groups_menu(message: Message):
-    kb = [
-        [KeyboardButton(text="➕ Создать группу")],
-        [KeyboardButton(text="🚪 Вступить по коду")],
-        [KeyboardButton(text="🗂 Мои группы")],
-        [KeyboardButton(text="🔙 Назад")]
-    ]
-    keyboard = ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
-    await message.answer("🔧 Управление группами:", reply_markup=keyboard)
+    await message.answer("🔧 Управление группами:", reply_markup=GROUPS_KB)
 
 
-@dp.message(F.text == "➕ Создать группу")
+@buttons.button("➕ Создать группу")
 async def create_group_prompt(message: Message, state: FSMContext):
     await state.set_state(EventStates.creating_group_name)
-    kb = [[KeyboardButton(text="❌ Отмена")]]
-    keyboard = ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
-    await message.answer("📝 Введите название группы:", reply_markup=keyboard)
+    await message.answer("📝 Введите название группы:", reply_markup=CANCEL_KB)
 
 @dp.message(EventStates.creating_group_name)
 async def create_group_finish(message: Message, state: FSMContext):
@@ -666,16 +871,13 @@ async def create_group_finish(message: Message, state: FSMContext):
     # Генерация уникального ID группы на основе хеша
     group_id = abs(hash(f"{message.from_user.id}_{group_name}")) % (10**10)
 
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-    try:
+    def _create_group(conn: sqlite3.Connection):
+        cursor = conn.cursor()
         # Проверка, не превышен ли лимит групп у пользователя
         cursor.execute("SELECT COUNT(*) FROM groups WHERE owner_id = ?", (message.from_user.id,))
         count = cursor.fetchone()[0]
         if count >= 5:
-            await message.answer("❌ Вы не можете создать больше 5 групп.")
-            await state.clear()
-            return
+            return False
 
         # Создание группы
         cursor.execute("""
@@ -687,28 +889,30 @@ async def create_group_finish(message: Message, state: FSMContext):
         cursor.execute("""
             INSERT INTO group_members (group_id, user_id) VALUES (?, ?)
         """, (group_id, message.from_user.id))
+        return True
+
+    try:
+        if not await db.run(_create_group):
+            await message.answer("❌ Вы не можете создать больше 5 групп.")
+            return
 
-        conn.commit()
         await message.answer(
             f"✅ Группа *{group_name}* создана!\n"
             f"🔢 Код для вступления: `{group_id}`\n\n"
             f"Отправьте этот код своим друзьям.",
             parse_mode="Markdown",
-            reply_markup=get_main_menu(message.from_user.id)
+            reply_markup=await get_main_menu(message.from_user.id)
         )
     except sqlite3.IntegrityError:
         await message.answer("❌ Группа с таким ID уже существует. Попробуйте другое название.")
     finally:
-        conn.close()
         await state.clear()
 
 
-@dp.message(F.text == "🚪 Вступить по коду")
+@buttons.button("🚪 Вступить по коду")
 async def join_group_prompt(message: Message, state: FSMContext):
     await state.set_state(EventStates.joining_group_id)
-    kb = [[KeyboardButton(text="❌ Отмена")]]
-    keyboard = ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
-    await message.answer("🔢 Введите ID группы:", reply_markup=keyboard)
+    await message.answer("🔢 Введите ID группы:", reply_markup=CANCEL_KB)
 
 
 @dp.message(EventStates.joining_group_id)
@@ -719,41 +923,30 @@ async def join_group_by_id(message: Message, state: FSMContext):
         await message.answer("❌ Неверный формат ID. Введите число.")
         return
 
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute("SELECT group_name FROM groups WHERE group_id = ?", (group_id,))
-    row = cursor.fetchone()
+    row = await db.fetchone("SELECT group_name FROM groups WHERE group_id = ?", (group_id,))
     if not row:
         await message.answer("❌ Группа не найдена.")
-        conn.close()
         return
 
     group_name = row[0]
     user_id = message.from_user.id
 
     try:
-        cursor.execute("INSERT INTO group_members (group_id, user_id) VALUES (?, ?)", (group_id, user_id))
-        conn.commit()
-        await message.answer(f"✅ Вы вступили в группу *{group_name}*", parse_mode="Markdown", reply_markup=get_main_menu(user_id))
+        await db.execute("INSERT INTO group_members (group_id, user_id) VALUES (?, ?)", (group_id, user_id))
+        await message.answer(f"✅ Вы вступили в группу *{group_name}*", parse_mode="Markdown", reply_markup=await get_main_menu(user_id))
     except sqlite3.IntegrityError:
         await message.answer(f"Вы уже состоите в группе *{group_name}*", parse_mode="Markdown")
     finally:
-        conn.close()
         await state.clear()
 
 
-@dp.message(F.text == "🗂 Мои группы")
+@buttons.button("🗂 Мои группы")
 async def my_groups(message: Message):
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
+    groups = await db.fetchall("""
         SELECT g.group_name, g.group_id FROM group_members gm
         JOIN groups g ON gm.group_id = g.group_id
         WHERE gm.user_id = ?
     """, (message.from_user.id,))
-    groups = cursor.fetchall()
-    conn.close()
 
     if not groups:
         await message.answer("📭 Вы не состоите ни в одной группе.")
@@ -766,19 +959,17 @@ async def my_groups(message: Message):
 
 
 # === Создание события — с выбором группы ===
-@dp.message(F.text == "➕ Создать событие")
+@buttons.button("➕ Создать событие")
 async def create_event_start(message: Message, state: FSMContext):
     await state.set_state(EventStates.waiting_title)
-    kb = [[KeyboardButton(text="❌ Отмена")]]
-    keyboard = ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
-    await message.answer("🎯 Введите название события:", reply_markup=keyboard)
+    await message.answer("🎯 Введите название события:", reply_markup=CANCEL_KB)
 
 
 @dp.message(EventStates.waiting_title)
 async def get_event_title(message: Message, state: FSMContext):
     title = message.text.strip()
-    if len(title) > 100:
-        await message.answer("❌ Слишком длинное название. Максимум 100 символов.")
+    if len(title) > Config.EVENT_TITLE_MAX:
+        await message.answer(f"❌ Слишком длинное название. Максимум {Config.EVENT_TITLE_MAX} символов.")
         return
     await state.update_data(title=title)
     await state.set_state(EventStates.waiting_description)
@@ -804,14 +995,7 @@ async def get_event_year(message: Message, state: FSMContext):
             raise ValueError
         await state.update_data(year=year)
         await state.set_state(EventStates.waiting_month)
-        kb = [
-            [KeyboardButton(text="Январь (1)"), KeyboardButton(text="Февраль (2)"), KeyboardButton(text="Март (3)")],
-            [KeyboardButton(text="Апрель (4)"), KeyboardButton(text="Май (5)"), KeyboardButton(text="Июнь (6)")],
-            [KeyboardButton(text="Июль (7)"), KeyboardButton(text="Август (8)"), KeyboardButton(text="Сентябрь (9)")],
-            [KeyboardButton(text="Октябрь (10)"), KeyboardButton(text="Ноябрь (11)"), KeyboardButton(text="Декабрь (12)")],
-        ]
-        keyboard = ReplyKeyboardMarkup(keyboard=kb, resize_keyboard=True)
-        await message.answer("📆 Выберите месяц:", reply_markup=keyboard)
+        await message.answer("📆 Выберите месяц:", reply_markup=MONTHS_KB)
     except:
         await message.answer("❌ Неверный год. Попробуйте снова:")
 
@@ -825,17 +1009,7 @@ async def get_event_month(message: Message, state: FSMContext):
             raise ValueError
         await state.update_data(month=month)
         await state.set_state(EventStates.waiting_day)
-        days_kb = []
-        for d in range(1, 29, 3):
-            row = [KeyboardButton(text=str(d))]
-            if d+1 <= 28: row.append(KeyboardButton(text=str(d+1)))
-            if d+2 <= 28: row.append(KeyboardButton(text=str(d+2)))
-            days_kb.append(row)
-        for i in range(29, 32):
-            days_kb.append([KeyboardButton(text=str(i))])
-        days_kb.append([KeyboardButton(text="❌ Отмена")])
-        keyboard = ReplyKeyboardMarkup(keyboard=days_kb, resize_keyboard=True)
-        await message.answer("🔢 День месяца:", reply_markup=keyboard)
+        await message.answer("🔢 День месяца:", reply_markup=DAYS_KB)
     except:
         await message.answer("❌ Выберите месяц из списка:")
 
@@ -866,36 +1040,47 @@ async def get_event_time(message: Message, state: FSMContext):
         year = data["year"]
         month = data["month"]
         day = data["day"]
-        tz = get_user_timezone(message.from_user.id)
+        tz = await get_user_timezone(message.from_user.id)
 
         local_time_str = f"{year}-{month:02d}-{day:02d} {hour:02d}:{minute:02d}"
 
-        # Проверка, есть ли группы
-        conn = sqlite3.connect(Config.DATABASE_PATH)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT g.group_name, g.group_id FROM group_members gm
-            JOIN groups g ON gm.group_id = g.group_id
-            WHERE gm.user_id = ?
-        """, (message.from_user.id,))
-        groups = cursor.fetchall()
-        conn.close()
-
-        scope_kb = [[KeyboardButton(text="👤 Только я")]]
-        for name, gid in groups:
-            scope_kb.append([KeyboardButton(text=f"👥 {name}")])
-
-        scope_kb.append([KeyboardButton(text="❌ Отмена")])
-        keyboard = ReplyKeyboardMarkup(keyboard=scope_kb, resize_keyboard=True)
-
         await state.update_data(local_time_str=local_time_str, tz=tz)
-        await state.set_state(EventStates.waiting_scope)
-        await message.answer("📬 Куда отправить событие?", reply_markup=keyboard)
+        await state.set_state(EventStates.waiting_recurrence)
+        await message.answer(
+            "🔁 Повторять событие?\n"
+            "Выберите вариант или пришлите правило, например `FREQ=WEEKLY;BYDAY=MO,WE;COUNT=10`",
+            parse_mode="Markdown",
+            reply_markup=RECURRENCE_KB
+        )
     except:
         await message.answer("❌ Неверный формат времени. Используйте ЧЧ:ММ:")
 
 
-@dp.message(F.text.startswith("👤") | F.text.startswith("👥"))
+@dp.message(EventStates.waiting_recurrence)
+async def get_event_recurrence(message: Message, state: FSMContext):
+    text = message.text.strip()
+    recurrence = RECURRENCE_CHOICES.get(text, text)
+    try:
+        rule = parse_rule(recurrence)
+    except ValueError as e:
+        await message.answer(f"❌ {e}. Выберите вариант или пришлите правило ещё раз:")
+        return
+
+    # Проверка, есть ли группы
+    groups = await db.fetchall("""
+        SELECT g.group_name, g.group_id FROM group_members gm
+        JOIN groups g ON gm.group_id = g.group_id
+        WHERE gm.user_id = ?
+    """, (message.from_user.id,))
+
+    keyboard = keyboards.build(["👤 Только я"], *([f"👥 {name}"] for name, _ in groups), [CANCEL])
+
+    await state.update_data(recurrence=str(rule) if rule else None)
+    await state.set_state(EventStates.waiting_scope)
+    await message.answer("📬 Куда отправить событие?", reply_markup=keyboard)
+
+
+@buttons.prefix("👤", "👥", state=EventStates.waiting_scope)
 async def send_event_to_scope(message: Message, state: FSMContext):
     data = await state.get_data()
     title = data["title"]
@@ -910,11 +1095,7 @@ async def send_event_to_scope(message: Message, state: FSMContext):
     else:
         try:
             group_name = message.text.split(" ", 1)[1]
-            conn = sqlite3.connect(Config.DATABASE_PATH)
-            cursor = conn.cursor()
-            cursor.execute("SELECT group_id FROM groups WHERE group_name = ?", (group_name,))
-            row = cursor.fetchone()
-            conn.close()
+            row = await db.fetchone("SELECT group_id FROM groups WHERE group_name = ?", (group_name,))
             if not row:
                 await message.answer("❌ Группа не найдена.")
                 await state.clear()
@@ -928,25 +1109,34 @@ async def send_event_to_scope(message: Message, state: FSMContext):
             await state.clear()
             return
 
-    success, utc_dt = add_event(
+    success, event_ts = await add_event(
         chat_type=chat_type,
         chat_id=chat_id,
         creator_id=message.from_user.id,
         title=title,
         desc=desc,
         local_time_str=local_time_str,
-        tz_name=tz
+        tz_name=tz,
+        recurrence=data.get("recurrence")
     )
 
     if success:
-        local_tz = ZoneInfo(tz)
-        local_time = utc_dt.astimezone(local_tz).strftime("%d.%m.%Y в %H:%M")
+        local_time = format_local(event_ts, tz, "%d.%m.%Y в %H:%M")
         await message.answer(
             f"✅ Событие «{title}» создано на {local_time}\n"
             f"📨 Направлено в: {target}",
             parse_mode="Markdown",
-            reply_markup=get_main_menu(message.from_user.id)
+            reply_markup=await get_main_menu(message.from_user.id)
         )
+        if chat_type == "group":
+            members = await db.fetchall("""
+                SELECT gm.user_id, COALESCE(u.timezone, 'Europe/Moscow') FROM group_members gm
+                LEFT JOIN users u ON u.user_id = gm.user_id
+                WHERE gm.group_id = ? AND gm.user_id != ?
+            """, (chat_id, message.from_user.id))
+            for user_id, member_tz in members:
+                member_time = format_local(event_ts, member_tz, "%d.%m.%Y в %H:%M")
+                sender.send(user_id, f"📢 Новое событие в группе «{group_name}»: «{title}» — {member_time}")
     else:
         await message.answer("❌ Ошибка при создании события.")
 
@@ -954,41 +1144,166 @@ async def send_event_to_scope(message: Message, state: FSMContext):
 
 
 # === Мои события ===
-@dp.message(F.text == "📋 Мои события")
+# Постраничный просмотр с курсором (event_time, id) вместо OFFSET. Разовые события
+# читаются отдельным подзапросом на личный чат и на каждую группу пользователя:
+# каждый — поиск по индексу (chat_id, event_time) от курсора и не больше страницы
+# строк, поэтому страница 500 стоит столько же, сколько первая. Повторы серий
+# разворачиваются генераторами (в поясе автора серии) и сливаются с ними.
+EVENTS_PAGE_SIZE = 10
+
+
+@buttons.button("📋 Мои события")
 async def my_events(message: Message):
-    conn = sqlite3.connect(Config.DATABASE_PATH)
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT title, event_time FROM events
-        WHERE chat_id = ? AND event_time > ?
-        ORDER BY event_time
-        LIMIT 5
-    """, (message.from_user.id, datetime.now().strftime("%Y-%m-%d %H:%M")))
-    rows = cursor.fetchall()
-    conn.close()
-
-    if not rows:
+    now_ts = int(time.time())
+    page = await _events_page(message.from_user.id, (now_ts, 0), True, now_ts)
+    if page is None:
         await message.answer("📭 У вас нет предстоящих событий.")
         return
+    text, markup = page
+    await message.answer(text, parse_mode="Markdown", reply_markup=markup)
 
-    text = "📅 *Ваши события:*\n\n"
-    for title, utc_time_str in rows:
+
+@dp.callback_query(F.data.startswith("events:"))
+async def my_events_page(callback: CallbackQuery):
+    try:
+        _, direction, ts, event_id = callback.data.split(":")
+        cursor_key = (int(ts), int(event_id))
+    except ValueError:
+        await callback.answer()
+        return
+
+    page = await _events_page(callback.from_user.id, cursor_key, direction == "next", int(time.time()))
+    if page is None:
+        await callback.answer("Больше событий нет.")
+        return
+    text, markup = page
+    await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=markup)
+    await callback.answer()
+
+
+async def _events_page(user_id: int, cursor_key: tuple, forward: bool, now_ts: int):
+    # Страница после курсора (forward) или перед ним; None — событий нет.
+    # Часовой пояс читается один раз на запрос.
+    tz = await get_user_timezone(user_id)
+    limit = EVENTS_PAGE_SIZE + 1
+    single_rows, recurring_rows = await db.run(_load_events_page, user_id, cursor_key, forward, now_ts, limit)
+
+    streams = [((event_ts, event_id, title, False) for event_ts, event_id, title in single_rows)]
+    for event_ts, event_id, title, recurrence, creator_tz in recurring_rows:
         try:
-            utc_dt = datetime.strptime(utc_time_str, "%Y-%m-%d %H:%M").replace(tzinfo=ZoneInfo("UTC"))
-            local_tz = ZoneInfo(get_user_timezone(message.from_user.id))
-            local_time = utc_dt.astimezone(local_tz).strftime("%d.%m.%Y %H:%M")
-            text += f"• {title} — {local_time}\n"
-        except Exception as e:
-            logger.error(f"Ошибка форматирования времени: {e}")
-            text += f"• {title} — (время недоступно)\n"
-    await message.answer(text, parse_mode="Markdown")
+            rule = parse_rule(recurrence)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Ошибка правила повтора: {e}")
+            continue
+        occurrences = _series_page(event_ts, event_id, title, rule, creator_tz, cursor_key, forward, now_ts, limit)
+        streams.append(occurrences)
+    items = list(islice(heapq.merge(*streams, key=itemgetter(0, 1), reverse=not forward), limit))
+    if not items:
+        return None
+
+    has_more = len(items) > EVENTS_PAGE_SIZE
+    items = items[:EVENTS_PAGE_SIZE]
+    if forward:
+        has_prev, has_next = cursor_key[1] != 0, has_more
+    else:
+        items.reverse()
+        has_prev, has_next = has_more, True
+
+    text = "📅 *Ваши события:*\n\n"
+    for event_ts, _, title, recurring in items:
+        text += f"• {'🔁 ' if recurring else ''}{title} — {format_local(event_ts, tz)}\n"
+
+    nav = []
+    if has_prev:
+        first_ts, first_id = items[0][:2]
+        nav.append(InlineKeyboardButton(text="◀️ Раньше", callback_data=f"events:prev:{first_ts}:{first_id}"))
+    if has_next:
+        last_ts, last_id = items[-1][:2]
+        nav.append(InlineKeyboardButton(text="Позже ▶️", callback_data=f"events:next:{last_ts}:{last_id}"))
+    return text, InlineKeyboardMarkup(inline_keyboard=[nav]) if nav else None
+
+
+def _series_page(event_ts: int, event_id: int, title: str, rule, tz_name: str,
+                 cursor_key: tuple, forward: bool, now_ts: int, limit: int):
+    # Повторы серии по порядку обхода страницы. Генератор сразу переходит к курсору
+    # (вперёд) или к окну перед ним (назад), так что глубокая страница стоит как первая.
+    start = from_epoch(event_ts)
+    if forward:
+        for utc_dt in upcoming(start, rule, tz_name, from_epoch(cursor_key[0] - 1)):
+            key = (to_epoch(utc_dt), event_id)
+            if key > cursor_key:
+                yield key[0], event_id, title, True
+        return
+
+    # На границе курсора решает id: повтор в ту же секунду может быть и до, и после
+    for utc_dt in preceding(start, rule, tz_name, from_epoch(now_ts), from_epoch(cursor_key[0] + 1), limit + 1):
+        key = (to_epoch(utc_dt), event_id)
+        if key < cursor_key:
+            yield key[0], event_id, title, True
+
+
+def _load_events_page(conn: sqlite3.Connection, user_id: int, cursor_key: tuple, forward: bool,
+                      now_ts: int, limit: int):
+    cursor = conn.cursor()
+    cursor.execute("SELECT group_id FROM group_members WHERE user_id = ?", (user_id,))
+    chats = [("private", user_id)] + [("group", group_id) for group_id, in cursor.fetchall()]
+
+    op, order = (">", "ASC") if forward else ("<", "DESC")
+    part = f"""
+        SELECT * FROM (
+            SELECT event_time, id, title FROM events
+            WHERE chat_id = ? AND chat_type = ? AND recurrence IS NULL
+              AND (event_time, id) {op} (?, ?) AND event_time > ?
+            ORDER BY event_time {order}, id {order} LIMIT ?
+        )"""
+    params = []
+    for chat_type, chat_id in chats:
+        params += [chat_id, chat_type, *cursor_key, now_ts, limit]
+    cursor.execute(
+        " UNION ALL ".join([part] * len(chats)) + f" ORDER BY event_time {order}, id {order} LIMIT ?",
+        (*params, limit),
+    )
+    single_rows = cursor.fetchall()
+
+    # Серии — тоже по чату, через частичный индекс idx_events_recurring_chat:
+    # разовые события чата не просматриваются («+» не даёт планировщику взять
+    # вместо него idx_events_chat_time по условию на event_time)
+    series = """
+        SELECT e.event_time, e.id, e.title, e.recurrence, COALESCE(u.timezone, 'Europe/Moscow') FROM events e
+        LEFT JOIN users u ON u.user_id = e.created_by
+        WHERE e.chat_id = ? AND e.chat_type = ? AND e.recurrence IS NOT NULL AND +e.event_time IS NOT NULL"""
+    cursor.execute(" UNION ALL ".join([series] * len(chats)),
+                   [param for chat_type, chat_id in chats for param in (chat_id, chat_type)])
+    return single_rows, cursor.fetchall()
 
 
 # === Запуск бота ===
 async def main():
-    init_db()
+    await init_db()
+    metrics_runner = await start_metrics_server(Config.METRICS_HOST, Config.METRICS_PORT) if Config.METRICS_PORT else None
+    sender.start()
+    await reminder_scheduler.load()
+    reminder_task = asyncio.create_task(reminder_scheduler.run())
+    digest_task = asyncio.create_task(daily_digest.run())
+    archive_task = asyncio.create_task(archiver.run())
     logger.info("Бот запущен и готов к работе")
-    await dp.start_polling(bot)
+    try:
+        if Config.BOT_MODE == "webhook":
+            await run_webhook(dp, bot)
+        else:
+            # Обновление только ставится в очередь своего чата, поэтому ждать его
+            # можно: так заполненные очереди притормаживают getUpdates
+            await dp.start_polling(bot, handle_as_tasks=False)
+    finally:
+        reminder_task.cancel()
+        digest_task.cancel()
+        archive_task.cancel()
+        await sender.close()
+        await bot.session.close()
+        await db.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        logger.info(f"Кэш профилей: {profiles.stats()}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,262 @@
+# metrics.py
+import logging
+import sqlite3
+from bisect import bisect_left
+from time import perf_counter
+from typing import Callable, Dict, Optional, Tuple
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм, секунды
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNHANDLED = "unhandled"
+
+
+class Histogram:
+    __slots__ = ("counts", "count", "sum")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        # Оценка по верхней границе корзины — как histogram_quantile без интерполяции
+        rank = q * self.count
+        seen = 0
+        for bound, n in zip(BUCKETS, self.counts):
+            seen += n
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+# === Метрики ===
+# Гистограммы держатся в словарях по меткам; запись — поиск ключа, bisect и три
+# сложения, около микросекунды. Метрики базы пишет только поток БД, читает их
+# при выдаче цикл asyncio — под GIL этого достаточно.
+class Metrics:
+    def __init__(self):
+        self.handlers: Dict[Tuple[str, str], Histogram] = {}
+        self.statements: Dict[str, Histogram] = {}
+        self.statement_rows: Dict[str, int] = {}
+        self.gauges: Dict[str, Tuple[str, Callable[[], float]]] = {}
+        self._statement_keys: Dict[str, str] = {}
+
+    def observe_handler(self, handler: str, state: str, seconds: float):
+        histogram = self.handlers.get((handler, state))
+        if histogram is None:
+            histogram = self.handlers[(handler, state)] = Histogram()
+        histogram.observe(seconds)
+
+    def statement_key(self, sql: str) -> str:
+        key = self._statement_keys.get(sql)
+        if key is None:
+            key = self._statement_keys[sql] = " ".join(sql.split())[:160]
+        return key
+
+    def observe_statement(self, key: str, seconds: float, rows: int):
+        histogram = self.statements.get(key)
+        if histogram is None:
+            histogram = self.statements[key] = Histogram()
+            self.statement_rows[key] = 0
+        histogram.observe(seconds)
+        if rows > 0:
+            self.statement_rows[key] += rows
+
+    def gauge(self, name: str, help_text: str, func: Callable[[], float]):
+        self.gauges[name] = (help_text, func)
+
+    def render(self) -> str:
+        lines = []
+        _render_histograms(lines, "bot_handler_duration_seconds", "Время обработки обновления",
+                           (({"handler": h, "state": s}, hist) for (h, s), hist in self.handlers.items()))
+        _render_histograms(lines, "bot_db_statement_duration_seconds", "Время выполнения SQL-запроса",
+                           (({"statement": k}, hist) for k, hist in list(self.statements.items())))
+        lines.append("# HELP bot_db_statement_rows_total Строк прочитано или изменено")
+        lines.append("# TYPE bot_db_statement_rows_total counter")
+        for key, rows in list(self.statement_rows.items()):
+            lines.append(f"bot_db_statement_rows_total{_labels({'statement': key})} {rows}")
+        for name, (help_text, func) in self.gauges.items():
+            try:
+                value = func()
+            except Exception as e:
+                logger.error(f"Ошибка метрики {name}: {e}")
+                continue
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, top: int = 5) -> str:
+        # Текст для /stats (legacy Markdown): самые медленные обработчики (по p95) и
+        # запросы (по среднему). Имена — только внутри `…`: подчёркивания в
+        # bot_send_queue_depth вне кода Telegram читает как курсив и отвергает сообщение
+        by_handler: Dict[str, Histogram] = {}
+        for (handler, _), hist in self.handlers.items():
+            total = by_handler.setdefault(handler, Histogram())
+            total.counts = [a + b for a, b in zip(total.counts, hist.counts)]
+            total.count += hist.count
+            total.sum += hist.sum
+
+        lines = ["📊 *Обработчики* (p95, среднее, число):"]
+        for name, hist in sorted(by_handler.items(), key=lambda i: -i[1].quantile(0.95))[:top]:
+            lines.append(f"• {_code(name)} ≤{hist.quantile(0.95) * 1000:g} мс, "
+                         f"{hist.sum / hist.count * 1000:.2f} мс, {hist.count}")
+        lines.append("\n🗄 *Запросы* (среднее, число):")
+        statements = sorted(list(self.statements.items()), key=lambda i: -i[1].sum / i[1].count)[:top]
+        for key, hist in statements:
+            lines.append(f"• {_code(key[:60])} {hist.sum / hist.count * 1000:.2f} мс, {hist.count}")
+        if self.gauges:
+            lines.append("")
+            for name, (_, func) in self.gauges.items():
+                try:
+                    lines.append(f"{_code(name)}: {func()}")
+                except Exception:
+                    continue
+        return "\n".join(lines)
+
+
+def _code(value: str) -> str:
+    # В legacy Markdown обратную кавычку внутри кода не экранировать
+    return "`" + value.replace("`", "'") + "`"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items()) + "}"
+
+
+def _render_histograms(lines: list, name: str, help_text: str, series):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} histogram")
+    for labels, hist in series:
+        cumulative = 0
+        for bound, n in zip(BUCKETS, hist.counts):
+            cumulative += n
+            lines.append(f"{name}_bucket{_labels({**labels, 'le': repr(bound)})} {cumulative}")
+        lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {hist.count}")
+        lines.append(f"{name}_sum{_labels(labels)} {hist.sum}")
+        lines.append(f"{name}_count{_labels(labels)} {hist.count}")
+
+
+metrics = Metrics()
+
+
+# === Время обработчиков ===
+# Внешняя мидлварь на dp.update стоит после FSM-мидлвари и видит состояние до
+# обработки. Какой обработчик сработал, известно только внутри роутера — его имя
+# записывает в общий слот лёгкая внутренняя мидлварь.
+class HandlerTimingMiddleware(BaseMiddleware):
+    def __init__(self, registry: Metrics):
+        self.metrics = registry
+
+    async def __call__(self, handler, event, data):
+        slot = data["metrics_handler"] = [UNHANDLED]
+        state = data.get("raw_state") or ""
+        start = perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.metrics.observe_handler(slot[0], state, perf_counter() - start)
+
+
+async def _record_handler_name(handler, event, data):
+    slot = data.get("metrics_handler")
+    if slot is not None:
+        slot[0] = data["handler"].callback.__name__
+    return await handler(event, data)
+
+
+def setup_handler_metrics(dp: Dispatcher, registry: Metrics = metrics):
+    dp.update.outer_middleware(HandlerTimingMiddleware(registry))
+    for observer in (dp.message, dp.callback_query, dp.pre_checkout_query):
+        observer.middleware(_record_handler_name)
+
+
+# === Время SQL-запросов ===
+# Соединение и курсор, засекающие каждый execute. Для запросов с результатом
+# в замер входит и выборка строк (fetchone/fetchall), а число строк — прочитанные;
+# для остальных — rowcount.
+class TimedCursor(sqlite3.Cursor):
+    _pending: Optional[list] = None
+
+    def _finish(self):
+        key, elapsed, rows = self._pending
+        self._pending = None
+        metrics.observe_statement(key, elapsed, rows)
+
+    def execute(self, sql, parameters=()):
+        if self._pending is not None:
+            self._finish()
+        start = perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            self._pending = [metrics.statement_key(sql), perf_counter() - start, self.rowcount]
+            if self.description is None:
+                self._finish()
+
+    def executemany(self, sql, seq_of_parameters):
+        if self._pending is not None:
+            self._finish()
+        start = perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            metrics.observe_statement(metrics.statement_key(sql), perf_counter() - start, self.rowcount)
+
+    def fetchone(self):
+        start = perf_counter()
+        row = super().fetchone()
+        if self._pending is not None:
+            self._pending[1] += perf_counter() - start
+            self._pending[2] = 1 if row is not None else 0
+            self._finish()
+        return row
+
+    def fetchall(self):
+        start = perf_counter()
+        rows = super().fetchall()
+        if self._pending is not None:
+            self._pending[1] += perf_counter() - start
+            self._pending[2] = len(rows)
+            self._finish()
+        return rows
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# === HTTP-эндпоинт для Prometheus ===
+async def start_metrics_server(host: str, port: int, registry: Metrics = metrics) -> web.AppRunner:
+    async def handle(request: web.Request) -> web.Response:
+        return web.Response(body=registry.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики: http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,244 @@
+# migrations.py
+import logging
+import sqlite3
+
+logger = logging.getLogger(__name__)
+
+
+# === Миграции схемы ===
+# Каждая миграция — (версия, описание, функция(cursor)). Применённые версии хранятся
+# в таблице schema_version, поэтому на обычном старте выполняется один SELECT,
+# а тяжёлые операции (ALTER, CREATE INDEX) — ровно один раз. Новые миграции
+# добавляются только в конец списка; уже выпущенные не меняются.
+
+def _initial_schema(cursor: sqlite3.Cursor):
+    for sql in (
+        """CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            timezone TEXT DEFAULT 'Europe/Moscow',
+            username TEXT,
+            first_name TEXT,
+            subscription_type TEXT DEFAULT 'free',
+            subscription_expire TEXT,
+            auto_renew INTEGER DEFAULT 1,
+            subscription_start TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS groups (
+            group_id INTEGER PRIMARY KEY,
+            group_name TEXT NOT NULL,
+            owner_id INTEGER NOT NULL,
+            created_at TEXT NOT NULL
+        )""",
+        """CREATE TABLE IF NOT EXISTS group_members (
+            group_id INTEGER,
+            user_id INTEGER,
+            PRIMARY KEY (group_id, user_id),
+            FOREIGN KEY (group_id) REFERENCES groups (group_id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users (user_id) ON DELETE CASCADE
+        )""",
+        """CREATE TABLE IF NOT EXISTS events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT,
+            description TEXT,
+            event_time TEXT,
+            created_by INTEGER,
+            chat_type TEXT,
+            chat_id INTEGER,
+            notified_7d INTEGER DEFAULT 1,
+            notified_1 INTEGER DEFAULT 1,
+            notified_15m INTEGER DEFAULT 1,
+            file_type TEXT,
+            file_id TEXT,
+            recurrence TEXT
+        )""",
+        """CREATE TABLE IF NOT EXISTS curator_client (
+            curator_id INTEGER,
+            client_id INTEGER,
+            added_at TEXT,
+            PRIMARY KEY (curator_id, client_id)
+        )""",
+    ):
+        cursor.execute(sql)
+
+    # Базы, созданные до появления этих колонок
+    _add_column(cursor, "events", "notified_7d", "INTEGER DEFAULT 1")
+    _add_column(cursor, "events", "notified_1", "INTEGER DEFAULT 1")
+    _add_column(cursor, "events", "notified_15m", "INTEGER DEFAULT 1")
+    _add_column(cursor, "users", "auto_renew", "INTEGER DEFAULT 1")
+    _add_column(cursor, "users", "subscription_start", "TEXT")
+
+
+def _hot_query_indexes(cursor: sqlite3.Cursor):
+    for sql in (
+        # my_events: WHERE chat_id = ? AND event_time > ? ORDER BY event_time
+        "CREATE INDEX IF NOT EXISTS idx_events_chat_time ON events (chat_id, event_time)",
+        # reschedule_events_for_user: WHERE created_by = ? AND event_time > ?
+        "CREATE INDEX IF NOT EXISTS idx_events_creator_time ON events (created_by, event_time)",
+        # Планировщик напоминаний: только события с неотправленными напоминаниями
+        """CREATE INDEX IF NOT EXISTS idx_events_pending ON events (event_time)
+           WHERE notified_7d = 1 OR notified_1 = 1 OR notified_15m = 1""",
+        # Поиск по curator_id покрывает первичный ключ (curator_id, client_id),
+        # а профиль клиента ищет по client_id
+        "CREATE INDEX IF NOT EXISTS idx_curator_client_client ON curator_client (client_id)",
+        # my_groups и выбор группы при создании события: WHERE gm.user_id = ?
+        "CREATE INDEX IF NOT EXISTS idx_group_members_user ON group_members (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_groups_owner ON groups (owner_id)",
+        "CREATE INDEX IF NOT EXISTS idx_groups_name ON groups (group_name)",
+    ):
+        cursor.execute(sql)
+
+
+def _recurring_index(cursor: sqlite3.Cursor):
+    # Планировщик при запуске читает все повторяющиеся серии
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_recurring ON events (id) WHERE recurrence IS NOT NULL")
+
+
+def _epoch_columns(cursor: sqlite3.Cursor):
+    # Время хранилось строками "%Y-%m-%d %H:%M": event_time — в UTC, подписка —
+    # в локальном времени сервера (datetime.now()), отсюда модификатор 'utc'.
+    # Тип колонки в SQLite не меняется через ALTER, поэтому таблицы пересоздаются;
+    # ссылки group_members на users сохраняются, так как новая таблица получает старое имя.
+    cursor.execute("""
+        CREATE TABLE users_new (
+            user_id INTEGER PRIMARY KEY,
+            timezone TEXT DEFAULT 'Europe/Moscow',
+            username TEXT,
+            first_name TEXT,
+            subscription_type TEXT DEFAULT 'free',
+            subscription_expire INTEGER,
+            auto_renew INTEGER DEFAULT 1,
+            subscription_start INTEGER
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO users_new
+        SELECT user_id, timezone, username, first_name, subscription_type,
+               CAST(strftime('%s', subscription_expire, 'utc') AS INTEGER),
+               auto_renew,
+               CAST(strftime('%s', subscription_start, 'utc') AS INTEGER)
+        FROM users
+    """)
+    cursor.execute("DROP TABLE users")
+    cursor.execute("ALTER TABLE users_new RENAME TO users")
+
+    cursor.execute("""
+        CREATE TABLE events_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT,
+            description TEXT,
+            event_time INTEGER,
+            created_by INTEGER,
+            chat_type TEXT,
+            chat_id INTEGER,
+            notified_7d INTEGER DEFAULT 1,
+            notified_1 INTEGER DEFAULT 1,
+            notified_15m INTEGER DEFAULT 1,
+            file_type TEXT,
+            file_id TEXT,
+            recurrence TEXT
+        )
+    """)
+    cursor.execute("""
+        INSERT INTO events_new
+        SELECT id, title, description, CAST(strftime('%s', event_time) AS INTEGER), created_by,
+               chat_type, chat_id, notified_7d, notified_1, notified_15m, file_type, file_id, recurrence
+        FROM events
+    """)
+    # Счётчик AUTOINCREMENT переносим, чтобы id удалённых событий не выдавались снова
+    cursor.execute("DELETE FROM sqlite_sequence WHERE name = 'events_new'")
+    cursor.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'events_new', seq FROM sqlite_sequence WHERE name = 'events'")
+    cursor.execute("DROP TABLE events")
+    cursor.execute("ALTER TABLE events_new RENAME TO events")
+    _hot_query_indexes(cursor)
+    _recurring_index(cursor)
+
+
+def _events_archive(cursor: sqlite3.Cursor):
+    # Прошедшие события старше горизонта хранения переносятся сюда (archive.py)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS events_archive (
+            id INTEGER PRIMARY KEY,
+            title TEXT,
+            description TEXT,
+            event_time INTEGER,
+            created_by INTEGER,
+            chat_type TEXT,
+            chat_id INTEGER,
+            notified_7d INTEGER,
+            notified_1 INTEGER,
+            notified_15m INTEGER,
+            file_type TEXT,
+            file_id TEXT,
+            recurrence TEXT,
+            archived_at INTEGER NOT NULL
+        )
+    """)
+    # Архиватор: WHERE recurrence IS NULL AND event_time < ? ORDER BY event_time
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_finished ON events (event_time) WHERE recurrence IS NULL")
+
+
+def _digest_mode(cursor: sqlite3.Cursor):
+    # Ежедневная сводка вместо отдельных напоминаний (digest.py)
+    _add_column(cursor, "users", "digest_mode", "INTEGER DEFAULT 0")
+    _add_column(cursor, "users", "digest_next", "INTEGER")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_digest ON users (digest_next) WHERE digest_mode = 1")
+
+
+def _recurring_chat_index(cursor: sqlite3.Cursor):
+    # Мои события: серии чата без просмотра его разовых событий
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_events_recurring_chat ON events (chat_id) WHERE recurrence IS NOT NULL")
+
+
+MIGRATIONS = [
+    (1, "начальная схема", _initial_schema),
+    (2, "индексы для горячих запросов", _hot_query_indexes),
+    (3, "индекс повторяющихся событий", _recurring_index),
+    (4, "время в секундах UTC вместо строк", _epoch_columns),
+    (5, "архив прошедших событий", _events_archive),
+    (6, "ежедневная сводка", _digest_mode),
+    (7, "индекс серий по чату", _recurring_chat_index),
+]
+
+
+def _add_column(cursor: sqlite3.Cursor, table: str, column: str, definition: str):
+    columns = {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def apply_migrations(conn: sqlite3.Connection):
+    if conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0:
+        # Новая база: пустой файл (WAL уже записал заголовок) переводится
+        # в INCREMENTAL мгновенным VACUUM. Существующему файлу нужен полный VACUUM —
+        # это отдельная команда обслуживания, не запуск бота:
+        #   python archive.py --enable-incremental-vacuum
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TEXT DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    current = conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        # Миграция и запись о ней — одна транзакция: либо применена целиком, либо нет
+        conn.execute("BEGIN")
+        try:
+            migrate(conn.cursor())
+            conn.execute("INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                         (version, description))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info(f"Применена миграция {version}: {description}")
+
+    if current < MIGRATIONS[-1][0]:
+        # Статистика для планировщика запросов по выборке — быстро даже на больших таблицах
+        conn.execute("PRAGMA analysis_limit = 1000")
+        conn.execute("ANALYZE")
@@ -0,0 +1,119 @@
+# profiles.py
+import asyncio
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+from config import Config
+from database import db
+from timeutils import format_local
+
+
+class UserProfile(NamedTuple):
+    timezone: str
+    subscription_type: str
+    subscription_expire: Optional[int]
+    auto_renew: int
+    is_curator: bool
+    has_curators: bool
+    digest_mode: bool
+
+    def subscription_status(self):
+        # Срок подписки — секунды UTC; для показа переводится в пояс пользователя
+        if self.subscription_type == "premium" and self.subscription_expire and self.subscription_expire > time.time():
+            return "premium", format_local(self.subscription_expire, self.timezone), self.auto_renew
+        return "free", None, self.auto_renew
+
+
+# === Кэш профилей пользователей ===
+# LRU с TTL: часовой пояс, подписка и флаги кураторства читаются одним запросом
+# и дальше отдаются из памяти. Обработчики, меняющие эти поля, обновляют или
+# сбрасывают запись сами; TTL лишь страхует от записей в обход кэша.
+class ProfileCache:
+    def __init__(self, database, maxsize: int, ttl: float):
+        self.db = database
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[int, tuple[float, UserProfile]] = OrderedDict()
+        self._identities: OrderedDict[int, int] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {"size": len(self._entries), "hits": self.hits, "misses": self.misses,
+                "hit_ratio": round(self.hit_ratio, 4)}
+
+    async def get(self, user_id: int) -> UserProfile:
+        entry = self._entries.get(user_id)
+        if entry is not None and entry[0] > time.monotonic():
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+        self.misses += 1
+        row = await self.db.fetchone("""
+            SELECT u.timezone, u.subscription_type, u.subscription_expire, u.auto_renew, u.digest_mode,
+                   EXISTS (SELECT 1 FROM curator_client WHERE curator_id = q.user_id),
+                   EXISTS (SELECT 1 FROM curator_client WHERE client_id = q.user_id)
+            FROM (SELECT ? AS user_id) q
+            LEFT JOIN users u ON u.user_id = q.user_id
+        """, (user_id,))
+        timezone, sub_type, expire_ts, auto_renew, digest_mode, is_curator, has_curators = row
+        profile = UserProfile(
+            timezone=timezone or "Europe/Moscow",
+            subscription_type=sub_type or "free",
+            subscription_expire=expire_ts,
+            auto_renew=1 if auto_renew is None else auto_renew,
+            is_curator=bool(is_curator),
+            has_curators=bool(has_curators),
+            digest_mode=bool(digest_mode),
+        )
+        self._store(user_id, profile)
+        return profile
+
+    def _store(self, user_id: int, profile: UserProfile):
+        self._entries[user_id] = (time.monotonic() + self.ttl, profile)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def update(self, user_id: int, **fields):
+        # Точечное обновление закэшированной записи; если её нет — следующее чтение загрузит свежую
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return
+        self._store(user_id, entry[1]._replace(**fields))
+
+    def invalidate(self, *user_ids: int):
+        for user_id in user_ids:
+            self._entries.pop(user_id, None)
+
+    def invalidate_on(self, future: asyncio.Future, *user_ids: int):
+        # Для отложенных записей: сбросить запись, когда пачка будет закоммичена
+        future.add_done_callback(lambda _: self.invalidate(*user_ids))
+
+    # Отпечаток имени пользователя (username, first_name), уже записанного в users.
+    # Живёт отдельно от профиля и без TTL: эти поля меняет только register_user.
+    def identity_known(self, user_id: int, fingerprint: int) -> bool:
+        if self._identities.get(user_id) != fingerprint:
+            return False
+        self._identities.move_to_end(user_id)
+        return True
+
+    def remember_identity_on(self, future: asyncio.Future, user_id: int, fingerprint: int):
+        def remember(done: asyncio.Future):
+            if done.cancelled() or done.exception() is not None:
+                return
+            self._identities[user_id] = fingerprint
+            self._identities.move_to_end(user_id)
+            while len(self._identities) > self.maxsize:
+                self._identities.popitem(last=False)
+        future.add_done_callback(remember)
+
+
+profiles = ProfileCache(db, Config.PROFILE_CACHE_SIZE, Config.PROFILE_CACHE_TTL)
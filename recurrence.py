@@ -0,0 +1,226 @@
+# recurrence.py
+import calendar
+from datetime import datetime, timedelta
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+from timeutils import UTC, get_zone
+
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+
+# Короткие формы, которые можно писать вместо RRULE
+ALIASES = {
+    "daily": "FREQ=DAILY",
+    "weekly": "FREQ=WEEKLY",
+    "monthly": "FREQ=MONTHLY",
+    "yearly": "FREQ=YEARLY",
+    "ежедневно": "FREQ=DAILY",
+    "еженедельно": "FREQ=WEEKLY",
+    "ежемесячно": "FREQ=MONTHLY",
+    "ежегодно": "FREQ=YEARLY",
+}
+
+
+# === Правила повторения ===
+# Подмножество RFC 5545 RRULE: FREQ, INTERVAL, COUNT, UNTIL, BYDAY (для WEEKLY),
+# BYMONTHDAY (для MONTHLY). Повторы считаются по времени на часах в поясе автора,
+# поэтому «каждый день в 9:00» остаётся 9:00 и после перехода на летнее время.
+# Даты, которых нет в месяце (31-е, 29 февраля), пропускаются, как в RFC.
+# UNTIL сравнивается с тем же локальным временем.
+class Rule(NamedTuple):
+    freq: str
+    interval: int = 1
+    count: Optional[int] = None
+    until: Optional[datetime] = None
+    byday: tuple = ()
+    bymonthday: Optional[int] = None
+
+    def __str__(self):
+        parts = [f"FREQ={self.freq}"]
+        if self.interval != 1:
+            parts.append(f"INTERVAL={self.interval}")
+        if self.count is not None:
+            parts.append(f"COUNT={self.count}")
+        if self.until is not None:
+            parts.append(f"UNTIL={self.until:%Y%m%dT%H%M%S}")
+        if self.byday:
+            parts.append("BYDAY=" + ",".join(WEEKDAYS[d] for d in self.byday))
+        if self.bymonthday is not None:
+            parts.append(f"BYMONTHDAY={self.bymonthday}")
+        return ";".join(parts)
+
+
+def parse_rule(text: Optional[str]) -> Optional[Rule]:
+    if not text:
+        return None
+    text = ALIASES.get(text.strip().lower(), text.strip())
+    if text.upper().startswith("RRULE:"):
+        text = text[6:]
+
+    fields = {}
+    for part in text.split(";"):
+        if not part:
+            continue
+        name, sep, value = part.partition("=")
+        if not sep:
+            raise ValueError(f"Неверная часть правила: {part}")
+        fields[name.strip().upper()] = value.strip().upper()
+
+    freq = fields.pop("FREQ", None)
+    if freq not in FREQUENCIES:
+        raise ValueError(f"Неподдерживаемая частота: {freq}")
+    rule = Rule(freq=freq)
+
+    if "INTERVAL" in fields:
+        rule = rule._replace(interval=int(fields.pop("INTERVAL")))
+        if rule.interval < 1:
+            raise ValueError("INTERVAL должен быть положительным")
+    if "COUNT" in fields:
+        rule = rule._replace(count=int(fields.pop("COUNT")))
+        if rule.count < 1:
+            raise ValueError("COUNT должен быть положительным")
+    if "UNTIL" in fields:
+        until = fields.pop("UNTIL").rstrip("Z")
+        fmt = "%Y%m%dT%H%M%S" if "T" in until else "%Y%m%d"
+        rule = rule._replace(until=datetime.strptime(until, fmt))
+    if "BYDAY" in fields:
+        if freq != "WEEKLY":
+            raise ValueError("BYDAY поддерживается только для FREQ=WEEKLY")
+        rule = rule._replace(byday=tuple(sorted({WEEKDAYS.index(d) for d in fields.pop("BYDAY").split(",")})))
+    if "BYMONTHDAY" in fields:
+        if freq != "MONTHLY":
+            raise ValueError("BYMONTHDAY поддерживается только для FREQ=MONTHLY")
+        rule = rule._replace(bymonthday=int(fields.pop("BYMONTHDAY")))
+        if not 1 <= rule.bymonthday <= 31:
+            raise ValueError("BYMONTHDAY должен быть от 1 до 31")
+    if fields:
+        raise ValueError(f"Неподдерживаемые части правила: {', '.join(fields)}")
+    return rule
+
+
+def _candidates(start: datetime, rule: Rule, at: Optional[datetime] = None) -> Iterator[Tuple[int, datetime]]:
+    # (номер повтора, дата) по частоте и интервалу, без учёта COUNT/UNTIL. С at —
+    # сразу с периода, в который попадает at: предыдущие периоды не перебираются,
+    # их повторы только досчитываются арифметикой (номер нужен для COUNT)
+    if rule.freq == "DAILY":
+        step = timedelta(days=rule.interval)
+        k = max(0, (at - start).days // rule.interval) if at else 0
+        index, current = k, start + k * step
+        while True:
+            yield index, current
+            index += 1
+            current += step
+
+    elif rule.freq == "WEEKLY":
+        weekdays = rule.byday or (start.weekday(),)
+        week_start = start - timedelta(days=start.weekday())
+        step = timedelta(weeks=rule.interval)
+        k = max(0, (at - week_start).days // 7 // rule.interval) if at else 0
+        first_week = sum(1 for weekday in weekdays if week_start + timedelta(days=weekday) >= start)
+        index = first_week + (k - 1) * len(weekdays) if k else 0
+        week_start += k * step
+        while True:
+            for weekday in weekdays:
+                candidate = week_start + timedelta(days=weekday)
+                if candidate >= start:
+                    yield index, candidate
+                    index += 1
+            week_start += step
+
+    elif rule.freq == "MONTHLY":
+        day = rule.bymonthday or start.day
+        first = start.year * 12 + start.month - 1
+        k = max(0, (at.year * 12 + at.month - 1 - first) // rule.interval) if at else 0
+        index = 0
+        if k and rule.count is not None:
+            # Номер нужен только для COUNT: пропущенные месяцы (31-е) считаются по одному
+            for months in range(first, first + k * rule.interval, rule.interval):
+                year, month = divmod(months, 12)
+                if day <= calendar.monthrange(year, month + 1)[1] and (months != first or day >= start.day):
+                    index += 1
+        months = first + k * rule.interval
+        misses = 0
+        # 31-е при шаге, попадающем только в короткие месяцы, не наступит никогда
+        while misses < 12:
+            year, month = divmod(months, 12)
+            if day <= calendar.monthrange(year, month + 1)[1]:
+                misses = 0
+                candidate = start.replace(year=year, month=month + 1, day=day)
+                if candidate >= start:
+                    yield index, candidate
+                    index += 1
+            else:
+                misses += 1
+            months += rule.interval
+
+    else:  # YEARLY
+        leap_only = start.month == 2 and start.day == 29
+        k = max(0, (at.year - start.year) // rule.interval) if at else 0
+        year = start.year + k * rule.interval
+        index = k
+        if leap_only and rule.count is not None:
+            index = sum(1 for y in range(start.year, year, rule.interval) if calendar.isleap(y))
+        while True:
+            if not leap_only or calendar.isleap(year):
+                yield index, start.replace(year=year)
+                index += 1
+            year += rule.interval
+
+
+def occurrences(start: datetime, rule: Rule, at: Optional[datetime] = None) -> Iterator[datetime]:
+    # Ленивый генератор повторов (наивное локальное время), первый — сам start.
+    # С at первые повторы могут быть раньше at, но не дальше одного периода
+    for index, candidate in _candidates(start, rule, at):
+        if rule.count is not None and index >= rule.count:
+            return
+        if rule.until is not None and candidate > rule.until:
+            return
+        yield candidate
+
+
+# Длина периода с запасом — для поиска повторов назад от курсора
+PERIOD_DAYS = {"DAILY": 1, "WEEKLY": 7, "MONTHLY": 31, "YEARLY": 366}
+
+
+def upcoming(utc_start: datetime, rule: Rule, tz_name: str, after: datetime) -> Iterator[datetime]:
+    # Повторы в UTC строго после after; вычисляются по мере запроса. Генератор
+    # начинает с периода за сутки до after, так что глубина страницы ничего не стоит
+    zone = get_zone(tz_name)
+    local_start = utc_start.astimezone(zone).replace(tzinfo=None)
+    seek = after.astimezone(zone).replace(tzinfo=None) - timedelta(days=1)
+    for local in occurrences(local_start, rule, seek if seek > local_start else None):
+        utc_dt = local.replace(tzinfo=zone).astimezone(UTC)
+        if utc_dt > after:
+            yield utc_dt
+
+
+def preceding(utc_start: datetime, rule: Rule, tz_name: str, after: datetime, before: datetime,
+              limit: int) -> list:
+    # Последние limit повторов в UTC строго между after и before, от поздних к ранним.
+    # Генератор идёт только вперёд, поэтому окно перед before расширяется вдвое,
+    # пока в нём не наберётся limit повторов или оно не упрётся в after
+    span = timedelta(days=PERIOD_DAYS[rule.freq] * rule.interval * limit)
+    while True:
+        low = max(after, before - span)
+        found = []
+        for utc_dt in upcoming(utc_start, rule, tz_name, low):
+            if utc_dt >= before:
+                break
+            found.append(utc_dt)
+        if len(found) >= limit or low == after:
+            return found[::-1][:limit]
+        span *= 2
+
+
+def advance(utc_start: datetime, rule: Rule, tz_name: str, after: datetime):
+    # Следующий повтор после after и правило для него (COUNT уменьшается на пройденные).
+    # None — серия закончилась.
+    zone = get_zone(tz_name)
+    local_start = utc_start.astimezone(zone).replace(tzinfo=None)
+    for index, local in enumerate(occurrences(local_start, rule)):
+        utc_dt = local.replace(tzinfo=zone).astimezone(UTC)
+        if utc_dt > after:
+            if rule.count is not None:
+                rule = rule._replace(count=rule.count - index)
+            return utc_dt, rule
+    return None
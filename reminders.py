@@ -0,0 +1,295 @@
+# reminders.py
+import asyncio
+import heapq
+import json
+import logging
+import sqlite3
+import time
+
+from recurrence import advance, parse_rule
+from timeutils import format_local, from_epoch, to_epoch
+
+logger = logging.getLogger(__name__)
+
+# Колонки-флаги событий: 1 — напоминание ещё ждёт отправки, 0 — уже отправлено.
+# Порядок важен: от самого раннего напоминания к самому позднему. Смещения — секунды.
+REMINDERS = (
+    ("notified_7d", 7 * 86400, "через неделю"),
+    ("notified_1", 86400, "завтра"),
+    ("notified_15m", 15 * 60, "через 15 минут"),
+)
+
+# Служебная запись кучи: в момент события повторяющееся событие переносится на следующий повтор
+ADVANCE = len(REMINDERS)
+
+# Напоминания, которые получателю с ежедневной сводкой заменяет сводка
+DIGEST_KINDS = (0, 1)
+
+# Предел длины сообщения Telegram — 4096 символов; сводка режется по строкам с запасом
+DIGEST_LIMIT = 4000
+
+
+def pending_flags(event_ts: int, now: int) -> tuple:
+    # Значения флагов REMINDERS для события в event_ts: напоминание, чей срок уже
+    # прошёл, сразу считается отправленным — иначе при перезапуске оно ушло бы
+    # сводкой о «пропущенном», которого на самом деле не было
+    return tuple(int(event_ts - offset > now) for _, offset, _ in REMINDERS)
+
+
+# === Планировщик напоминаний ===
+# Очередь — бинарная куча (fire_ts, event_id, kind): вставка и извлечение за O(log n).
+# Цикл спит ровно до ближайшего срабатывания; новое событие будит его только если
+# оно раньше текущей вершины кучи. Записи не удаляются из кучи при изменении события —
+# при срабатывании строка перечитывается и устаревшая запись отбрасывается.
+# Повторяющееся событие хранится одной строкой: event_time — ближайший повтор.
+# Когда он наступает, запись ADVANCE вычисляет следующий и сдвигает строку на него,
+# так что в куче и в таблице всегда только одно вхождение серии.
+#
+# Напоминания, срок которых прошёл, пока бот был выключен, разбираются при загрузке:
+# у события остаётся только самое позднее пропущенное напоминание (как и при обычной
+# отправке, «завтра» отменяет «через неделю»), а если событие уже началось или
+# напоминание опоздало больше чем на catchup_max_late секунд — оно отбрасывается.
+# Оставшиеся собираются в одну сводку на получателя и уходят через очередь отправки
+# с её ограничением скорости, не задерживая обработку новых обновлений.
+class ReminderScheduler:
+    def __init__(self, sender, db, catchup_max_late: int = 6 * 3600):
+        self.sender = sender
+        self.db = db
+        self.catchup_max_late = catchup_max_late
+        self._heap: list[tuple[int, int, int]] = []
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._heap)
+
+    async def load(self):
+        self._heap, digests = await self.db.run(self._load, int(time.time()))
+        self._wakeup.set()
+        logger.info(f"Загружено напоминаний: {len(self._heap)}")
+        if digests:
+            self._send_digests(digests)
+            logger.info(f"Пропущенные напоминания отправлены сводкой: получателей {len(digests)}")
+
+    def _load(self, conn: sqlite3.Connection, now: int):
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, event_time, notified_7d, notified_1, notified_15m FROM events
+            WHERE event_time > ? AND (notified_7d = 1 OR notified_1 = 1 OR notified_15m = 1)
+        """, (now,))
+
+        heap = []
+        missed = {}  # event_id → самое позднее пропущенное напоминание
+        stale = []
+        for event_id, event_ts, *flags in cursor:
+            late_kind = None
+            for kind, (_, offset, _) in enumerate(REMINDERS):
+                fire_ts = event_ts - offset
+                if flags[kind] != 1:
+                    continue
+                if fire_ts > now:
+                    heap.append((fire_ts, event_id, kind))
+                else:
+                    late_kind = kind
+            if late_kind is not None:
+                if now - (event_ts - REMINDERS[late_kind][1]) <= self.catchup_max_late:
+                    missed[event_id] = late_kind
+                else:
+                    stale.append((event_id, late_kind))
+
+        for kind in range(len(REMINDERS)):
+            # Пропущенные помечаются отправленными сразу: сводка уходит один раз
+            sent = ", ".join(f"{col} = 0" for col, _, _ in REMINDERS[:kind + 1])
+            ids = [(event_id,) for event_id, k in (*missed.items(), *stale) if k == kind]
+            if ids:
+                cursor.executemany(f"UPDATE events SET {sent} WHERE id = ?", ids)
+        if stale:
+            logger.info(f"Отброшено устаревших напоминаний: {len(stale)}")
+
+        # Серии, чей повтор прошёл, пока бот был выключен, сдвигаются сразу
+        cursor.execute("SELECT id, event_time FROM events WHERE recurrence IS NOT NULL AND event_time IS NOT NULL")
+        for event_id, event_ts in cursor:
+            heap.append((max(event_ts, now), event_id, ADVANCE))
+
+        heapq.heapify(heap)
+        return heap, self._collect_digests(cursor, list(missed.items()))
+
+    def _collect_digests(self, cursor: sqlite3.Cursor, event_ids: list):
+        # получатель → (часовой пояс, [(время события, название)]).
+        # «Через неделю» и «завтра» подписанным на сводку не шлём, как и в _claim
+        if not event_ids:
+            return {}
+        cursor.execute("""
+            SELECT id, title, event_time, chat_type, chat_id FROM events
+            WHERE id IN (SELECT value FROM json_each(?))
+        """, (json.dumps([event_id for event_id, _ in event_ids]),))
+        events = cursor.fetchall()
+        digest_only = {event_id for event_id, kind in event_ids if kind in DIGEST_KINDS}
+        groups = json.dumps(list({chat_id for _, _, _, chat_type, chat_id in events if chat_type == "group"}))
+        private = json.dumps(list({chat_id for _, _, _, chat_type, chat_id in events if chat_type != "group"}))
+
+        members = {}
+        cursor.execute("""
+            SELECT gm.group_id, gm.user_id, COALESCE(u.timezone, 'Europe/Moscow'), COALESCE(u.digest_mode, 0)
+            FROM group_members gm
+            LEFT JOIN users u ON u.user_id = gm.user_id
+            WHERE gm.group_id IN (SELECT value FROM json_each(?))
+        """, (groups,))
+        for group_id, user_id, tz_name, digest_mode in cursor:
+            members.setdefault(group_id, []).append((user_id, tz_name, digest_mode))
+        cursor.execute("""
+            SELECT q.value, COALESCE(u.timezone, 'Europe/Moscow'), COALESCE(u.digest_mode, 0) FROM json_each(?) q
+            LEFT JOIN users u ON u.user_id = q.value
+        """, (private,))
+        for user_id, tz_name, digest_mode in cursor:
+            members[("private", user_id)] = [(user_id, tz_name, digest_mode)]
+
+        digests = {}
+        for event_id, title, event_ts, chat_type, chat_id in events:
+            key = chat_id if chat_type == "group" else ("private", chat_id)
+            for user_id, tz_name, digest_mode in members.get(key, ()):
+                if digest_mode and event_id in digest_only:
+                    continue
+                digests.setdefault(user_id, (tz_name, []))[1].append((event_ts, title))
+        return digests
+
+    def _send_digests(self, digests: dict):
+        for user_id, (tz_name, items) in digests.items():
+            lines = [f"• «{title}» — {format_local(event_ts, tz_name)}" for event_ts, title in sorted(items)]
+            text = "⏰ Пока бот был недоступен, подошли напоминания:"
+            for line in lines:
+                if len(text) + len(line) + 1 > DIGEST_LIMIT:
+                    self.sender.send(user_id, text)
+                    text = "⏰ Продолжение:"
+                text += "\n" + line
+            self.sender.send(user_id, text)
+
+    def schedule_event(self, event_id: int, event_ts: int, recurring: bool = False):
+        now = int(time.time())
+        head = self._heap[0][0] if self._heap else None
+        for kind, (_, offset, _) in enumerate(REMINDERS):
+            fire_ts = event_ts - offset
+            if fire_ts > now:
+                heapq.heappush(self._heap, (fire_ts, event_id, kind))
+        if recurring:
+            heapq.heappush(self._heap, (max(event_ts, now), event_id, ADVANCE))
+        if self._heap and (head is None or self._heap[0][0] < head):
+            self._wakeup.set()
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                fire_ts, event_id, kind = heapq.heappop(self._heap)
+                try:
+                    await self._fire(fire_ts, event_id, kind)
+                except Exception as e:
+                    logger.error(f"Ошибка отправки напоминания {event_id}: {e}")
+
+            timeout = self._heap[0][0] - time.time() if self._heap else None
+            if timeout is not None and timeout <= 0:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _advance(self, conn: sqlite3.Connection, event_id: int, fire_ts: int):
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT e.event_time, e.recurrence, COALESCE(u.timezone, 'Europe/Moscow') FROM events e
+            LEFT JOIN users u ON u.user_id = e.created_by
+            WHERE e.id = ? AND e.recurrence IS NOT NULL
+        """, (event_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+
+        event_ts, recurrence, tz_name = row
+        if event_ts > fire_ts:
+            # Серию уже сдвинули или перенесли — тот, кто это сделал, поставил новую запись
+            return None
+
+        try:
+            rule = parse_rule(recurrence)
+        except ValueError as e:
+            logger.error(f"Неверное правило повтора у события {event_id}: {e}")
+            rule = None
+        now = from_epoch(int(time.time()))
+        following = advance(from_epoch(event_ts), rule, tz_name, now) if rule else None
+        if following is None:
+            # Серия закончилась: остаётся обычным прошедшим событием
+            cursor.execute("UPDATE events SET recurrence = NULL WHERE id = ? AND event_time = ?",
+                           (event_id, event_ts))
+            return None
+
+        next_dt, rule = following
+        next_ts = to_epoch(next_dt)
+        cursor.execute("""
+            UPDATE events SET event_time = ?, recurrence = ?, notified_7d = ?, notified_1 = ?, notified_15m = ?
+            WHERE id = ? AND event_time = ?
+        """, (next_ts, str(rule), *pending_flags(next_ts, int(time.time())), event_id, event_ts))
+        return next_ts if cursor.rowcount else None
+
+    def _claim(self, conn: sqlite3.Connection, event_id: int, kind: int, fire_ts: int):
+        column, offset, _ = REMINDERS[kind]
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            SELECT title, event_time, chat_type, chat_id FROM events
+            WHERE id = ? AND {column} = 1
+        """, (event_id,))
+        row = cursor.fetchone()
+        if not row:
+            return None
+
+        title, event_ts, chat_type, chat_id = row
+        actual_fire_ts = event_ts - offset
+        if actual_fire_ts != fire_ts:
+            # Событие перенесли — запись в куче устарела
+            return actual_fire_ts
+
+        # Отмечаем этот флаг и все более ранние одним условным UPDATE:
+        # отправленное «завтра» делает ненужным неотправленное «через неделю».
+        sent = ", ".join(f"{col} = 0" for col, _, _ in REMINDERS[:kind + 1])
+        cursor.execute(f"UPDATE events SET {sent} WHERE id = ? AND {column} = 1", (event_id,))
+        if cursor.rowcount == 0:
+            return None
+
+        # «Через неделю» и «завтра» подписанным на сводку не шлём — они войдут в неё (digest.py)
+        no_digest = "AND COALESCE(u.digest_mode, 0) = 0" if kind in DIGEST_KINDS else ""
+        if chat_type == "group":
+            cursor.execute(f"""
+                SELECT gm.user_id, COALESCE(u.timezone, 'Europe/Moscow') FROM group_members gm
+                LEFT JOIN users u ON u.user_id = gm.user_id
+                WHERE gm.group_id = ? {no_digest}
+            """, (chat_id,))
+        else:
+            cursor.execute(f"""
+                SELECT q.user_id, COALESCE(u.timezone, 'Europe/Moscow') FROM (SELECT ? AS user_id) q
+                LEFT JOIN users u ON u.user_id = q.user_id
+                WHERE 1 {no_digest}
+            """, (chat_id,))
+        recipients = cursor.fetchall()
+        return title, event_ts, recipients
+
+    async def _fire(self, fire_ts: int, event_id: int, kind: int):
+        if kind == ADVANCE:
+            next_ts = await self.db.run(self._advance, event_id, fire_ts)
+            if next_ts is not None:
+                self.schedule_event(event_id, next_ts, recurring=True)
+            return
+
+        claimed = await self.db.run(self._claim, event_id, kind, fire_ts)
+        if not claimed:
+            return
+        if isinstance(claimed, int):
+            if claimed > time.time():
+                heapq.heappush(self._heap, (claimed, event_id, kind))
+            return
+
+        title, event_ts, recipients = claimed
+        when = REMINDERS[kind][2]
+        # Рассылка через очередь отправки: цикл планировщика не ждёт доставки
+        for user_id, tz_name in recipients:
+            local_time = format_local(event_ts, tz_name)
+            self.sender.send(user_id, f"⏰ Напоминание: «{title}» {when} — {local_time}")
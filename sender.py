@@ -0,0 +1,240 @@
+# sender.py
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from typing import Any, Deque, Dict, NamedTuple, Optional
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+logger = logging.getLogger(__name__)
+dead_letters = logging.getLogger(f"{__name__}.dead_letter")
+
+# Ошибки, после которых имеет смысл повторить отправку
+RETRYABLE = (TelegramNetworkError, TelegramServerError)
+
+
+class TokenBucket:
+    # Резервирующее ведро: reserve() сразу списывает токен и возвращает, сколько
+    # ждать до его появления, — ожидающие выстраиваются без опроса
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        # Сколько ждать до свободного токена, ничего не списывая
+        self._refill(now)
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def reserve(self, now: float) -> float:
+        self._refill(now)
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def pause(self, now: float, seconds: float):
+        self._refill(now)
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+    def is_full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class Delivery(NamedTuple):
+    chat_id: int
+    text: str
+    kwargs: Dict[str, Any]
+    future: asyncio.Future
+    attempt: int = 0
+    released: bool = False  # вернулась из очереди ожидания своего чата
+
+
+# === Очередь исходящих сообщений ===
+# Все рассылки идут через одну очередь с ограниченным числом обработчиков.
+# Перед отправкой сообщение ждёт токен своего чата (Telegram: ~1 сообщение в секунду
+# в один чат) и общий токен (~30 в секунду на бота), поэтому рассылка по группе
+# из 10 000 человек идёт с предсказуемой максимальной скоростью, а не пачкой 429.
+# Токен чата обработчик не ждёт: сообщение чата без токена откладывается в очередь
+# ожидания этого чата (по порядку), а обработчик берёт следующее. Когда токен
+# появится, таймер возвращает в общую очередь голову очереди чата — так накопившиеся
+# сообщения одного чата не занимают обработчики и не задерживают остальные чаты.
+# Спят обработчики только на общем токене.
+# На RetryAfter вся отправка встаёт на паузу, которую назвал Telegram, плюс случайная
+# добавка, чтобы обработчики не проснулись разом; сетевые ошибки и 5xx повторяются
+# с экспоненциальной задержкой. Что не удалось доставить — в лог sender.dead_letter.
+class Sender:
+    def __init__(self, bot: Bot, rate: float = 30, chat_rate: float = 1, chat_burst: float = 1,
+                 concurrency: int = 30, max_retries: int = 5):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._global = TokenBucket(rate, rate)
+        self._chats: Dict[int, TokenBucket] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: list[asyncio.Task] = []
+        self._retry_handles: set[asyncio.TimerHandle] = set()
+        self._release_handles: set[asyncio.TimerHandle] = set()
+        self._parked: Dict[int, Deque[Delivery]] = {}  # чат → сообщения, ждущие его токена
+        self.sent = 0
+        self.retried = 0
+        self.dead = 0
+
+    @property
+    def queue_depth(self) -> int:
+        if self._queue is None:
+            return 0
+        return self._queue.qsize() + sum(map(len, self._parked.values()))
+
+    def stats(self) -> dict:
+        return {"queued": self.queue_depth, "sent": self.sent, "retried": self.retried, "dead": self.dead}
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    def send(self, chat_id: int, text: str, **kwargs) -> asyncio.Future:
+        # Future завершается отправленным Message или ошибкой; ждать его не обязательно
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait(Delivery(chat_id, text, kwargs, future))
+        return future
+
+    def send_many(self, chat_ids, text: str, **kwargs) -> list[asyncio.Future]:
+        return [self.send(chat_id, text, **kwargs) for chat_id in chat_ids]
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= 10000:
+                # Полные вёдра ничего не помнят — их можно выбросить
+                self._chats = {k: b for k, b in self._chats.items() if not b.is_full(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _worker(self):
+        while True:
+            delivery = await self._queue.get()
+            try:
+                await self._deliver(delivery)
+            except Exception as e:
+                logger.error(f"Ошибка очереди отправки: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _later(self, handles: set, delay: float, callback, *args):
+        def _fire():
+            handles.discard(handle)
+            callback(*args)
+
+        handle = asyncio.get_running_loop().call_later(delay, _fire)
+        handles.add(handle)
+
+    def _release(self, chat_id: int):
+        # Голова очереди чата уходит в общую очередь; пустая очередь чата остаётся
+        # отметкой, что его сообщение в пути, — новые встают за ним
+        parked = self._parked[chat_id]
+        self._queue.put_nowait(parked.popleft()._replace(released=True))
+
+    def _next_parked(self, chat_id: int, now: float):
+        parked = self._parked.get(chat_id)
+        if parked is None:
+            return
+        if parked:
+            self._later(self._release_handles, self._chat_bucket(chat_id, now).delay(now), self._release, chat_id)
+        else:
+            del self._parked[chat_id]
+
+    def _take_chat_token(self, delivery: Delivery, now: float) -> bool:
+        parked = self._parked.get(delivery.chat_id)
+        if parked is not None and not delivery.released:
+            parked.append(delivery)  # впереди уже есть сообщения этого чата
+            return False
+        bucket = self._chat_bucket(delivery.chat_id, now)
+        wait = bucket.delay(now)
+        if wait:
+            if parked is None:
+                self._parked[delivery.chat_id] = deque([delivery])
+            else:
+                parked.appendleft(delivery)
+            self._later(self._release_handles, wait, self._release, delivery.chat_id)
+            return False
+        bucket.reserve(now)
+        self._next_parked(delivery.chat_id, now)
+        return True
+
+    async def _deliver(self, delivery: Delivery):
+        if delivery.future.done():  # отменено вызывающим
+            if delivery.released:
+                self._next_parked(delivery.chat_id, time.monotonic())
+            return
+        if not self._take_chat_token(delivery, time.monotonic()):
+            return
+        wait = self._global.reserve(time.monotonic())
+        if wait:
+            await asyncio.sleep(wait)
+
+        try:
+            message = await self.bot.send_message(delivery.chat_id, delivery.text, **delivery.kwargs)
+        except TelegramRetryAfter as e:
+            delay = e.retry_after + random.uniform(0, 1)
+            self._global.pause(time.monotonic(), delay)
+            self._retry(delivery, e, delay)
+        except RETRYABLE as e:
+            self._retry(delivery, e, min(60.0, 2 ** delivery.attempt) * random.uniform(0.5, 1.5))
+        except Exception as e:
+            # Бот заблокирован, чат не найден, неверный запрос — повторять бессмысленно
+            self._dead(delivery, e)
+        else:
+            self.sent += 1
+            if not delivery.future.done():
+                delivery.future.set_result(message)
+
+    def _retry(self, delivery: Delivery, error: Exception, delay: float):
+        if delivery.attempt >= self.max_retries:
+            self._dead(delivery, error)
+            return
+        self.retried += 1
+        self._later(self._retry_handles, delay, self._queue.put_nowait, delivery._replace(attempt=delivery.attempt + 1, released=False))
+
+    def _dead(self, delivery: Delivery, error: Exception):
+        self.dead += 1
+        dead_letters.error(f"chat_id={delivery.chat_id} attempts={delivery.attempt + 1} "
+                           f"error={type(error).__name__}: {error} text={delivery.text[:100]!r}")
+        if not delivery.future.done():
+            delivery.future.set_exception(error)
+            delivery.future.exception()  # ошибка уже в логе, даже если future никто не ждёт
+
+    async def close(self, timeout: float = 30):
+        if self._queue is None:
+            return
+        # Ждём и отложенные повторы, и очереди чатов: они вернутся в очередь по таймеру
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                await asyncio.wait_for(self._queue.join(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+            if not self._retry_handles and not self._parked:
+                break
+            await asyncio.sleep(0.05)
+        left = self.queue_depth + len(self._retry_handles)
+        if left:
+            logger.warning(f"Не отправлено сообщений при остановке: {left}")
+        for handle in (*self._retry_handles, *self._release_handles):
+            handle.cancel()
+        self._retry_handles.clear()
+        self._release_handles.clear()
+        self._parked.clear()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._queue = None
@@ -0,0 +1,48 @@
+# tests/test_chat_queues.py
+import asyncio
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from aiogram import Bot, Dispatcher  # noqa: E402
+from aiogram.types import ErrorEvent, Message, Update  # noqa: E402
+
+from chat_queues import setup_chat_queues  # noqa: E402
+
+
+def _update(update_id: int, chat_id: int, text: str) -> Update:
+    return Update(update_id=update_id, message=dict(
+        message_id=update_id, date=datetime.datetime.now(), text=text,
+        chat=dict(id=chat_id, type="private"), from_user=dict(id=chat_id, is_bot=False, first_name="U"),
+    ))
+
+
+def test_queued_handler_error_reaches_dp_errors():
+    async def run():
+        dp = Dispatcher(disable_fsm=True)
+        queues = setup_chat_queues(dp, concurrency=4, max_pending=10)
+        bot = Bot("42:TEST")
+        seen, errors = [], []
+
+        @dp.message()
+        async def handler(message: Message):
+            seen.append(message.text)
+            if message.text == "boom":
+                raise RuntimeError("boom")
+
+        @dp.errors()
+        async def on_error(event: ErrorEvent):
+            errors.append((event.update.update_id, str(event.exception)))
+            return True
+
+        await dp.feed_update(bot, _update(1, 7, "boom"))
+        await dp.feed_update(bot, _update(2, 7, "after"))
+        await queues.wait(7)
+        await bot.session.close()
+        return seen, errors
+
+    seen, errors = asyncio.run(run())
+    assert errors == [(1, "boom")]
+    assert seen == ["boom", "after"]  # очередь чата продолжает работу после ошибки
@@ -0,0 +1,27 @@
+# tests/test_metrics.py
+import os
+import re
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from metrics import Metrics  # noqa: E402
+
+
+def _outside_code(text: str) -> str:
+    return re.sub(r"`[^`\n]*`", "", text)
+
+
+def test_summary_markdown_is_balanced():
+    metrics = Metrics()
+    metrics.observe_handler("create_event_start", "waiting_title", 0.01)
+    metrics.observe_statement(metrics.statement_key("SELECT `x` FROM events WHERE user_id = ?"), 0.002, 1)
+    for name in ("bot_send_queue_depth", "bot_send_dead_total", "bot_webhook_queue_depth"):
+        metrics.gauge(name, "", lambda: 1)
+    metrics.gauge("bot_broken_gauge", "", lambda: 1 / 0)
+
+    outside = _outside_code(metrics.summary())
+    assert "`" not in outside
+    assert outside.count("_") == 0
+    assert outside.count("*") % 2 == 0
+    assert outside.count("[") == outside.count("]")
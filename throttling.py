@@ -0,0 +1,109 @@
+# throttling.py
+import logging
+import time
+from typing import Dict, NamedTuple, Optional, Set, Tuple
+
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.dispatcher.flags import get_flag
+from aiogram.enums import ContentType
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLICY = "default"
+EXEMPT = "exempt"  # @flags.throttle(EXEMPT) — обработчик не ограничивается
+
+# Ограничивается только то, что присылает сам пользователь. Служебные сообщения
+# (successful_payment, вход в группу и т. п.) шлёт Telegram, и терять их нельзя:
+# пропущенное подтверждение оплаты оставило бы человека без премиума
+USER_CONTENT = frozenset({
+    ContentType.TEXT, ContentType.DOCUMENT, ContentType.PHOTO, ContentType.VIDEO, ContentType.ANIMATION,
+    ContentType.AUDIO, ContentType.VOICE, ContentType.VIDEO_NOTE, ContentType.STICKER, ContentType.LOCATION,
+    ContentType.VENUE, ContentType.CONTACT, ContentType.DICE, ContentType.POLL, ContentType.STORY,
+})
+
+
+class Policy(NamedTuple):
+    rate: float  # запросов в секунду в среднем
+    burst: int  # сколько можно подряд после паузы
+    reply: Optional[str] = None  # ответ при превышении; None — отбросить молча
+
+
+# === Ограничение частоты по пользователям ===
+# Внутренняя мидлварь на сообщениях и callback-запросах: срабатывает, когда
+# обработчик уже найден, и до того, как он пойдёт в базу. Политика обработчика
+# задаётся флагом: @flags.throttle("billing"); без флага действует "default".
+# Ведро токенов каждого пользователя хранится одним числом — моментом, когда
+# ведро снова станет полным (GCRA, эквивалент ведра с rate и burst): запрос
+# проходит, если до этого момента осталось не больше (burst - 1) интервалов.
+# Если момент уже наступил, ведро ничего не помнит, и такие записи периодически
+# выбрасываются — таблица держит только тех, кто писал недавно.
+# Ответ «слишком часто» уходит один раз за серию отброшенных запросов, чтобы
+# пропуск не был незаметным, но и сам ответ не превращался в поток сообщений.
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(self, policies: Dict[str, Tuple], sweep_interval: float = 60):
+        self.policies = {name: Policy(*spec) for name, spec in policies.items()}
+        self.policies.setdefault(DEFAULT_POLICY, Policy(3, 20, "⏳ Слишком много сообщений подряд, часть пропущена."))
+        self.sweep_interval = sweep_interval
+        self._full_at: Dict[str, Dict[int, float]] = {name: {} for name in self.policies}
+        self._warned: Dict[str, Set[int]] = {name: set() for name in self.policies}
+        self._next_sweep = time.monotonic() + sweep_interval
+        self.dropped = 0
+
+    @property
+    def tracked(self) -> int:
+        return sum(map(len, self._full_at.values()))
+
+    def allow(self, name: str, user_id: int, now: float) -> bool:
+        policy = self.policies[name]
+        table = self._full_at[name]
+        interval = 1 / policy.rate
+        full_at = max(table.get(user_id, now), now)
+        if full_at - now > (policy.burst - 1) * interval:
+            return False
+        table[user_id] = full_at + interval
+        return True
+
+    def sweep(self, now: float):
+        for name, table in self._full_at.items():
+            idle = [user_id for user_id, full_at in table.items() if full_at <= now]
+            for user_id in idle:
+                del table[user_id]
+            self._warned[name].difference_update(idle)
+        self._next_sweep = now + self.sweep_interval
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or (isinstance(event, Message) and event.content_type not in USER_CONTENT):
+            return await handler(event, data)
+
+        now = time.monotonic()
+        if now >= self._next_sweep:
+            self.sweep(now)
+
+        name = get_flag(data, "throttle", default=DEFAULT_POLICY)
+        if name == EXEMPT:
+            return await handler(event, data)
+        if name not in self.policies:
+            logger.error(f"Неизвестная политика ограничения частоты: {name}")
+            name = DEFAULT_POLICY
+
+        if self.allow(name, user.id, now):
+            self._warned[name].discard(user.id)
+            return await handler(event, data)
+
+        self.dropped += 1
+        reply = self.policies[name].reply
+        warned = self._warned[name]
+        if reply and user.id not in warned:
+            warned.add(user.id)
+            # У Message и CallbackQuery answer() — ответ в чат или всплывающее уведомление
+            await event.answer(reply)
+        return None
+
+
+def setup_throttling(dp: Dispatcher, policies: Dict[str, Tuple]) -> ThrottlingMiddleware:
+    throttling = ThrottlingMiddleware(policies)
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(throttling)
+    return throttling
@@ -0,0 +1,33 @@
+# timeutils.py
+from datetime import datetime
+from functools import lru_cache
+from zoneinfo import ZoneInfo
+
+UTC = ZoneInfo("UTC")
+
+# Время в базе — целые секунды UTC (epoch): сравнения и диапазоны по индексу
+# без разбора строк; в datetime переводим только для вывода и календарной арифметики.
+DISPLAY_FORMAT = "%d.%m.%Y %H:%M"
+
+
+@lru_cache(maxsize=None)
+def get_zone(tz_name: str) -> ZoneInfo:
+    return ZoneInfo(tz_name)
+
+
+def to_epoch(dt: datetime) -> int:
+    # dt — с часовым поясом
+    return int(dt.timestamp())
+
+
+def from_epoch(ts: int, tz_name: str = None) -> datetime:
+    return datetime.fromtimestamp(ts, get_zone(tz_name) if tz_name else UTC)
+
+
+def local_to_epoch(local_time_str: str, tz_name: str) -> int:
+    # "%Y-%m-%d %H:%M" на часах пользователя → секунды UTC
+    return to_epoch(datetime.fromisoformat(local_time_str).replace(tzinfo=get_zone(tz_name)))
+
+
+def format_local(ts: int, tz_name: str, fmt: str = DISPLAY_FORMAT) -> str:
+    return datetime.fromtimestamp(ts, get_zone(tz_name)).strftime(fmt)
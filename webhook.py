@@ -0,0 +1,120 @@
+# webhook.py
+import asyncio
+import logging
+import signal
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from config import Config
+from metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+# === Приём обновлений через вебхук ===
+# Telegram сам присылает обновления POST-запросами: нет задержки опроса, и за
+# балансировщиком может стоять несколько процессов бота. Запрос только проверяет
+# секрет и кладёт обновление в ограниченную очередь, которую разбирает фиксированное
+# число обработчиков, — ответ уходит сразу, а нагрузка на базу не растёт без предела.
+# Если очередь полна, отвечаем 503: Telegram повторит доставку позже.
+class QueuedRequestHandler(SimpleRequestHandler):
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret_token: str = None,
+                 workers: int = 64, queue_size: int = 1000, **data):
+        super().__init__(dispatcher, bot, handle_in_background=True, secret_token=secret_token, **data)
+        self.workers = workers
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._worker_tasks: list[asyncio.Task] = []
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def start(self):
+        self._worker_tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def _worker(self):
+        while True:
+            update = await self._queue.get()
+            try:
+                await self._background_feed_update(self.bot, update)
+            except Exception as e:
+                logger.error(f"Ошибка обработки обновления {update.get('update_id')}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _handle_request_background(self, bot: Bot, request: web.Request) -> web.Response:
+        try:
+            update = await request.json(loads=bot.session.json_loads)
+        except ValueError:
+            return web.Response(body="Bad Request", status=400)
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logger.warning("Очередь вебхука переполнена, обновление отклонено")
+            return web.Response(body="Busy", status=503)
+        return web.json_response({}, dumps=bot.session.json_dumps)
+
+    async def close(self):
+        # Сервер уже не принимает запросы: дорабатываем принятые и только потом закрываем сессию
+        try:
+            await asyncio.wait_for(self._queue.join(), Config.WEBHOOK_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"Не обработано обновлений при остановке: {self._queue.qsize()}")
+        for task in self._worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self._worker_tasks, return_exceptions=True)
+        await super().close()
+
+
+async def run_webhook(dispatcher: Dispatcher, bot: Bot, **data):
+    if Config.WEBHOOK_URL and not Config.WEBHOOK_SECRET:
+        # Без секрета любой, кто узнал адрес, может прислать поддельное обновление —
+        # в том числе successful_payment. Случайный секрет не подходит: у процессов
+        # за балансировщиком он должен быть общим
+        raise RuntimeError("WEBHOOK_SECRET обязателен, когда задан WEBHOOK_URL")
+    if not Config.WEBHOOK_SECRET:
+        logger.warning("Вебхук без WEBHOOK_SECRET: только для локальной проверки")
+
+    app = web.Application()
+    handler = QueuedRequestHandler(
+        dispatcher, bot,
+        secret_token=Config.WEBHOOK_SECRET or None,
+        workers=Config.WEBHOOK_WORKERS,
+        queue_size=Config.WEBHOOK_QUEUE_SIZE,
+        **data,
+    )
+    metrics.gauge("bot_webhook_queue_depth", "Обновлений в очереди вебхука", lambda: handler.queue_depth)
+    # Порядок важен: при остановке сначала дренируется очередь, потом закрывается FSM
+    handler.register(app, path=Config.WEBHOOK_PATH)
+    setup_application(app, dispatcher, bot=bot, **data)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except NotImplementedError:  # Windows
+            pass
+
+    runner = web.AppRunner(app, handle_signals=False)
+    await runner.setup()
+    site = web.TCPSite(runner, Config.WEBHOOK_HOST, Config.WEBHOOK_PORT)
+    handler.start()
+    await site.start()
+    try:
+        # Без публичного адреса вебхук не регистрируется — так сервер можно
+        # проверять локально, отправляя сохранённые обновления POST-запросами
+        if Config.WEBHOOK_URL:
+            await bot.set_webhook(
+                Config.WEBHOOK_URL.rstrip("/") + Config.WEBHOOK_PATH,
+                secret_token=Config.WEBHOOK_SECRET or None,
+                allowed_updates=dispatcher.resolve_used_update_types(),
+                max_connections=Config.WEBHOOK_MAX_CONNECTIONS,
+            )
+        logger.info(f"Вебхук слушает {Config.WEBHOOK_HOST}:{Config.WEBHOOK_PORT}{Config.WEBHOOK_PATH}")
+        await stop.wait()
+    finally:
+        # Закрывает порт, ждёт текущие запросы, затем вызывает on_shutdown
+        await runner.cleanup()